@@ -0,0 +1,271 @@
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import functools
+import numpy as np
+from utils.synthetic_graph import synthetic_city
+
+BENCHMARKS = ("dispatch", "routing", "hierarchy", "render", "storage", "districts")
+TOLERANCE = 0.15  # Relative change beyond which a result counts as a regression
+
+
+def make_city(graph, citizens=0):
+    from services.city import City
+
+    return City(citizens, "memory", compiled_graph=graph, seed=0)
+
+
+def percentiles(samples, unit_scale=1000.0):
+    """
+    Returns the p50/p90/p99 of timing samples in seconds, scaled to milliseconds by default.
+    """
+    p50, p90, p99 = np.percentile(np.asarray(samples) * unit_scale, [50, 90, 99])
+    return float(p50), float(p90), float(p99)
+
+
+def result(value, unit, better):
+    return {"value": value, "unit": unit, "better": better}
+
+
+def bench_dispatch(graph, incidents=2000):
+    """
+    Incidents per second through report_incident and one dispatcher pass, vehicles being released right after.
+    """
+    city = make_city(graph)
+    city.deploy_emergency_services(start=False)
+    center = city.emergency_response
+    dispatched = []
+    center.on_dispatch = lambda vehicle, incident: dispatched.append(vehicle)
+    rng = random.Random(0)
+    nodes = graph.node_ids.tolist()
+    locations = [rng.choice(nodes) for _ in range(incidents)]
+    started = time.perf_counter()
+    for location in locations:
+        center.report_incident(location)
+        center.process_incidents()
+        for vehicle in dispatched:
+            vehicle.incident.resolved = True
+            vehicle.release()
+        dispatched.clear()
+    elapsed = time.perf_counter() - started
+    center.close()
+    return {"dispatch.incidents_per_s": result(incidents / elapsed, "incidents/s", "higher")}
+
+
+def bench_routing(graph, routes=300, backends=("astar",)):
+    """
+    Latency of routes from a station (precomputed trees), between arbitrary nodes (Dijkstra, and each of
+    `backends`, see services.routing) and of set_route.
+    """
+    from services.routing import create_backend
+
+    city = make_city(graph)
+    city.deploy_emergency_services(start=False)
+    router = city.router
+    vehicle = city.ambulances_onsite[0]
+    rng = random.Random(1)
+    nodes = graph.node_ids.tolist()
+    cases = {
+        "routing.station_route": lambda target: router.shortest_path(city.stations["Fire-Truck"], target),
+        "routing.point_to_point": lambda target: router.shortest_path(rng.choice(nodes), target),
+        "routing.set_route": lambda target: vehicle.set_route(target),
+    }
+    for backend in backends:
+        cases[f"routing.point_to_point.{backend}"] = functools.partial(
+            lambda router, target: router.route(rng.randrange(len(graph)), graph.index_of(target)),
+            create_backend(backend, graph))
+    results = {}
+    for name, route in cases.items():
+        samples = []
+        for _ in range(routes):
+            target = rng.choice(nodes)
+            started = time.perf_counter()
+            route(target)
+            samples.append(time.perf_counter() - started)
+        for label, value in zip(("p50", "p90", "p99"), percentiles(samples)):
+            results[f"{name}.{label}"] = result(value, "ms", "lower")
+    city.emergency_response.close()
+    return results
+
+
+def bench_hierarchy(graph, routes=300):
+    """
+    Preprocessing time of the contraction hierarchy of the grid (services.contraction), its shortcuts per node and
+    the latency of its distances and routes between arbitrary nodes.
+    """
+    from services.contraction import ContractionHierarchy
+
+    started = time.perf_counter()
+    hierarchy = ContractionHierarchy.build(graph)
+    results = {"hierarchy.build_s": result(time.perf_counter() - started, "s", "lower"),
+               "hierarchy.shortcuts_per_node": result(hierarchy.meta["shortcuts"] / len(graph), "shortcuts", "lower")}
+    rng = random.Random(2)
+    for name in ("distance", "route"):
+        samples = []
+        for _ in range(routes):
+            source, target = rng.randrange(len(graph)), rng.randrange(len(graph))
+            started = time.perf_counter()
+            getattr(hierarchy, name)(source, target)
+            samples.append(time.perf_counter() - started)
+        for label, value in zip(("p50", "p90", "p99"), percentiles(samples)):
+            results[f"hierarchy.{name}.{label}"] = result(value, "ms", "lower")
+    return results
+
+
+def bench_render(graph, citizens=5000, frames=50):
+    """
+    Frame time of Simulation.refresh_map plus blitting the artists it returns, with an offscreen canvas.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import simulation
+    from utils.basemap import load_basemap
+
+    city = make_city(graph, citizens)
+    city.deploy_emergency_services(start=False)
+    city.deploy_citizens(start=False)
+    rng = random.Random(2)
+    nodes = graph.node_ids.tolist()
+    for _ in range(20):
+        city.emergency_response.report_incident(rng.choice(nodes))
+    with tempfile.TemporaryDirectory() as basemaps:
+        # Keep the base map of the synthetic grid out of the cache of the real city
+        simulation.load_basemap = functools.partial(load_basemap, cache_dir=basemaps)
+        sim = simulation.Simulation(city)
+        sim.plot_map()
+    sim.fig.canvas.draw()
+    samples = []
+    for frame in range(frames):
+        for citizen in city.citizens[::10]:
+            citizen.current_node = rng.choice(nodes)
+        started = time.perf_counter()
+        for artist in sim.refresh_map(frame):
+            artist.axes.draw_artist(artist)
+        samples.append(time.perf_counter() - started)
+    plt.close(sim.fig)
+    city.emergency_response.close()
+    p50, p90, p99 = percentiles(samples)
+    return {"render.frame.p50": result(p50, "ms", "lower"), "render.frame.p99": result(p99, "ms", "lower")}
+
+
+def bench_storage(rows=50000):
+    """
+    Insert throughput of the storage layer, directly in batches and through the background BatchWriter.
+    """
+    from utils.storage import create_storage, BatchWriter
+
+    data = [(f"{i}_type_{i % 97}", str(i), f"type_{i % 11}", str(i % 97), i % 50, 1, 0, 1) for i in range(rows)]
+    storage = create_storage("memory")
+    started = time.perf_counter()
+    for i in range(0, rows, 500):
+        storage.insert_many(data[i:i + 500])
+    batch_elapsed = time.perf_counter() - started
+    storage.close()
+
+    storage = create_storage("memory")
+    writer = BatchWriter(storage)
+    writer.start()
+    started = time.perf_counter()
+    for row in data:
+        writer.put(row)
+    writer.flush()
+    writer_elapsed = time.perf_counter() - started
+    writer.close()
+    storage.close()
+    return {"storage.insert_many_rows_per_s": result(rows / batch_elapsed, "rows/s", "higher"),
+            "storage.batch_writer_rows_per_s": result(rows / writer_elapsed, "rows/s", "higher")}
+
+
+def bench_districts(graph, districts=2, citizens=300, max_time=3600):
+    """
+    Incidents per second of a seeded run split into districts (districts.py), which must finish within `max_time`
+    simulated seconds with every report resolved and counted once in the merged statistics.
+    """
+    import districts as district_mode
+    from utils.constants import NINCIDENTS_PER_CITIZEN
+
+    started = time.perf_counter()
+    statistics, figures = district_mode.run(graph, districts, citizens, seed=1, max_time=max_time)
+    elapsed = time.perf_counter() - started
+    reports = citizens * NINCIDENTS_PER_CITIZEN
+    if statistics.incidents != reports or sum(figure["incidents"] for figure in figures) != reports or \
+            statistics.resolution_times.count != reports or \
+            sum(figure["handed_over"] for figure in figures) != sum(figure["taken_over"] for figure in figures):
+        raise RuntimeError(f"The districts did not account for the {reports} reports: {statistics.incidents} merged, "
+                           f"{statistics.resolution_times.count} resolved, per district {figures}")
+    return {"districts.incidents_per_s": result(reports / elapsed, "incidents/s", "higher")}
+
+
+def run(benchmarks=BENCHMARKS, size=100):
+    """
+    Runs benchmarks on a synthetic grid (see utils.synthetic_graph).
+
+    Args:
+        benchmarks (iterable, optional): Names from BENCHMARKS. Defaults to all.
+        size (int, optional): Nodes per side of the grid. Defaults to 100.
+
+    Returns:
+        dict: The environment under "meta" and name -> {value, unit, better} under "results".
+    """
+    graph = synthetic_city("grid", size * size)
+    results = {}
+    for name in benchmarks:
+        logging.warning(f"Running {name} benchmark")
+        results.update(bench_storage() if name == "storage" else globals()[f"bench_{name}"](graph))
+    meta = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "machine": platform.machine(), "processor": platform.processor(), "nodes": len(graph),
+            "edges": graph.number_of_edges}
+    return {"meta": meta, "results": results}
+
+
+def compare(current, baseline, tolerance=TOLERANCE):
+    """
+    Compares results against a baseline.
+
+    Args:
+        current (dict): Results returned by run.
+        baseline (dict): Results of an earlier run, loaded from its JSON file.
+        tolerance (float, optional): Relative change allowed before flagging a regression. Defaults to TOLERANCE.
+
+    Returns:
+        list: (name, baseline value, current value, relative change, regressed) per metric present in both.
+    """
+    rows = []
+    for name, now in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None or not before["value"]:
+            continue
+        change = (now["value"] - before["value"]) / before["value"]
+        regressed = change < -tolerance if now["better"] == "higher" else change > tolerance
+        rows.append((name, before["value"], now["value"], change, regressed))
+    return rows
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format="%(asctime)s  %(message)s", level=logging.WARNING, datefmt="%H:%M:%S")
+    parser = argparse.ArgumentParser(description="Benchmarks of the dispatch, routing, rendering and storage hot paths")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help=f"comma-separated subset of {', '.join(BENCHMARKS)}")
+    parser.add_argument("--size", type=int, default=100, help="nodes per side of the synthetic grid")
+    parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+    parser.add_argument("--compare", default=None, help="baseline JSON to compare against; exits with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="relative change flagged as a regression")
+    args = parser.parse_args()
+
+    current = run(args.only.split(","), args.size)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+    if not args.compare:
+        print(json.dumps(current, indent=2))
+        sys.exit(0)
+    with open(args.compare) as f:
+        rows = compare(current, json.load(f), args.tolerance)
+    for name, before, now, change, regressed in rows:
+        print(f"{name:<40} {before:>14.3f} {now:>14.3f} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    sys.exit(1 if any(row[4] for row in rows) else 0)
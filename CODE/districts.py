@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import logging
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+from utils.constants import FIRE_TRUCKS, AMBULANCES, POLICE_CARS, NCITIZENS, CITIZEN_REPORT_PROBABILITY, SEED
+from utils.graph_cache import CompiledGraph
+from utils.synthetic_graph import kmeans, place_stations, synthetic_city, STATION_TYPES
+
+EPOCH = 5  # Simulated seconds the districts run between two exchanges of mutual aid
+MUTUAL_AID_DELAY = 30  # Seconds an incident waits without any vehicle before it is handed over to another district
+MUTUAL_AID_LIMIT = 20  # Incidents a district hands over per epoch at most
+VEHICLE_TYPES = ("Police-Car", "Fire-Truck", "Ambulance")  # In the order of Incident.vehicles_needed
+
+
+def partition(graph, districts, seed=0, chunk=100000):
+    """
+    Partitions the intersections into districts: the clusters of a k-means clustering of their coordinates.
+
+    Args:
+        graph (CompiledGraph): The road network.
+        districts (int): The number of districts.
+        seed (int, optional): Seed of the clustering. Defaults to 0.
+        chunk (int, optional): Intersections assigned at once, to bound memory. Defaults to 100000.
+
+    Returns:
+        np.ndarray: The district of every node index (int64), numbered without gaps, so there are fewer districts
+            than asked for when some clusters end up without any intersection.
+    """
+    points = np.column_stack((graph.x, graph.y))
+    centers = kmeans(points, districts, np.random.default_rng(seed))
+    labels = np.empty(len(graph), dtype=np.int64)
+    for start in range(0, len(graph), chunk):
+        block = points[start:start + chunk]
+        labels[start:start + chunk] = np.argmin(((block[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2), axis=1)
+    return np.unique(labels, return_inverse=True)[1].astype(np.int64).reshape(-1)
+
+
+def split(total, shares):
+    """
+    Splits an integer total proportionally to shares, largest remainders first.
+    """
+    shares = np.asarray(shares, dtype=np.float64)
+    exact = total * shares / shares.sum()
+    counts = np.floor(exact).astype(np.int64)
+    counts[np.argsort(counts - exact)[:total - counts.sum()]] += 1
+    return counts.tolist()
+
+
+def district_worker(district, graph_path, labels_path, config, epoch, inbox, outbox):
+    """
+    Runs the response center of one district on the discrete-event engine, in its own process.
+
+    The district owns its fleets, stationed inside it, and its citizens, living inside it. It advances epoch by
+    epoch as told by the coordinator. After every epoch it asks for mutual aid with the incidents it could not
+    send any vehicle to for MUTUAL_AID_DELAY seconds while a fleet they need is exhausted. Before the next
+    epoch it hands over the requests the coordinator placed with another district and takes over the
+    incidents placed with it. Nothing runs in between, so a request is still queued when it is handed over.
+
+    Args:
+        district (int): The district.
+        graph_path (str): Directory of the compiled graph, memory-mapped by every district.
+        labels_path (str): The .npy file of the district of every node.
+        config (dict): "citizens", "fleets" (vehicle type -> size), "report_probability" and "seed".
+        epoch (float): Timestamp of simulated time 0, shared by all districts.
+        inbox (multiprocessing.Queue): (until, ids of the incidents to hand over, incidents to take over) per
+            epoch, None to finish.
+        outbox (multiprocessing.Queue): Where the epoch reports and the final statistics are sent.
+    """
+    from services.city import City
+    from services.event_engine import DiscreteEventEngine
+
+    logging.getLogger().setLevel(logging.WARNING)
+    graph = CompiledGraph.load(graph_path)
+    nodes = np.flatnonzero(np.load(labels_path, mmap_mode='r') == district)
+    weights = np.zeros(len(graph))
+    weights[nodes] = 1
+    stations = dict(zip(STATION_TYPES, place_stations(graph, seed=district, nodes=nodes)))
+    fleets = config["fleets"]
+    city = City(config["citizens"], "memory", fire_trucks=fleets["Fire-Truck"], police_cars=fleets["Police-Car"],
+                ambulances=fleets["Ambulance"], compiled_graph=graph, seed=config["seed"], stations=stations,
+                vectorized_citizens=True, population_weights=weights)
+    engine = DiscreteEventEngine(city, epoch=epoch, report_probability=config["report_probability"])
+    center = engine.deploy()
+    handed_over = taken_over = 0
+    arrived = {}  # Incident id -> time an incident taken over arrived, so it waits again before moving on
+    started = time.process_time()
+    while True:
+        message = inbox.get()
+        if message is None:
+            break
+        until, outgoing, incoming = message
+        for incident_id in outgoing:
+            center.hand_over(incident_id)
+        for incident in incoming:
+            arrived[center.take_over(*incident).id] = engine.clock()
+        handed_over += len(outgoing)
+        taken_over += len(incoming)
+        if incoming or not center.incident_queue.empty():
+            engine.resume()
+        engine.advance(until)
+
+        # Ask for help with the incidents waiting for a fleet that is exhausted here
+        available = center.dispatch_index.availability(VEHICLE_TYPES)
+        requests = []
+        for _, incident_id in center.incident_queue.snapshot():
+            if len(requests) == MUTUAL_AID_LIMIT:
+                break
+            incident = center.logged_incidents[incident_id]
+            waiting = engine.clock() - arrived.get(incident_id, incident.report_time)
+            if incident.dispatch_attempts == 0 or incident_id in center.active_incidents or waiting < MUTUAL_AID_DELAY or \
+                    not any(needed > free for needed, free in zip(incident.vehicles_needed, available)):
+                continue
+            requests.append((incident_id, (incident.location, incident.incident_type, incident.report_time,
+                                           incident.severity, incident.dispatch_attempts)))
+        idle = not engine.events and engine.dispatcher_done()
+        outbox.put((district, available, requests, idle))
+    center.sql.add_data()
+    center.close()
+    outbox.put((district, center.statistics, {"handed_over": handed_over, "taken_over": taken_over,
+                                              "events": engine.processed_events, "cpu_time": time.process_time() - started}))
+
+
+def assign_aid(incident, origin, available):
+    """
+    Picks the district taking over an incident: the one with the most free vehicles of the types it needs, among
+    those with enough of them. Returns the district of origin if none has enough.
+
+    Args:
+        incident (tuple): The incident as sent by district_worker.
+        origin (int): The district handing it over.
+        available (dict): District -> free vehicles per type, updated with the assignment.
+
+    Returns:
+        int: The district.
+    """
+    from utils.incident_catalog import CATALOG
+
+    needed = CATALOG.required[CATALOG.codes[incident[1]]]
+    best, best_free = origin, -1
+    for district, free in available.items():
+        if district == origin or any(n > f for n, f in zip(needed, free)):
+            continue
+        spare = min(f for n, f in zip(needed, free) if n) if needed.any() else 0
+        if spare > best_free:
+            best, best_free = district, spare
+    if best != origin:
+        available[best] = tuple(f - n for n, f in zip(needed, available[best]))
+    return best
+
+
+def run(graph, districts, citizens=NCITIZENS, fleets=None, report_probability=CITIZEN_REPORT_PROBABILITY, seed=SEED,
+        max_time=None):
+    """
+    Runs a city split into districts, each with its own response center in its own process.
+
+    The districts advance in lock-step epochs of EPOCH simulated seconds. Between two epochs the coordinator
+    forwards the incidents handed over for mutual aid, so no district waits for another within an epoch and
+    dispatch runs on as many cores as there are districts.
+
+    Args:
+        graph (CompiledGraph): The road network.
+        districts (int): The number of districts.
+        citizens (int, optional): The citizens of the whole city, split by number of intersections. Defaults to NCITIZENS.
+        fleets (dict, optional): Vehicle type -> size of the whole city's fleet, split by number of intersections.
+            Defaults to the sizes of utils.constants.
+        report_probability (float, optional): Probability of a report at each step. Defaults to CITIZEN_REPORT_PROBABILITY.
+        seed (int, optional): Seed of the run; district d uses seed + d. Defaults to SEED.
+        max_time (float, optional): Simulated seconds after which the run is cut short, even if districts are still
+            busy. Defaults to no limit.
+
+    Returns:
+        tuple: The merged IncidentStatistics and a list of per-district figures.
+    """
+    from services.statistics import IncidentStatistics
+
+    fleets = fleets or {"Fire-Truck": FIRE_TRUCKS, "Police-Car": POLICE_CARS, "Ambulance": AMBULANCES}
+    labels = partition(graph, districts, seed or 0)
+    if labels.max() + 1 < districts:
+        logging.warning(f"Only {labels.max() + 1} of the {districts} districts have intersections")
+        districts = int(labels.max()) + 1
+    sizes = np.bincount(labels, minlength=districts)
+    shares = {"citizens": split(citizens, sizes)}
+    shares.update({vehicle_type: split(size, sizes) for vehicle_type, size in fleets.items()})
+    epoch = time.time()
+    context = multiprocessing.get_context()
+    outbox = context.Queue()
+    inboxes = [context.Queue() for _ in range(districts)]
+    with tempfile.TemporaryDirectory() as directory:
+        graph.save(os.path.join(directory, "graph"))
+        np.save(os.path.join(directory, "labels.npy"), labels)
+        workers = []
+        for district in range(districts):
+            config = {"citizens": shares["citizens"][district], "report_probability": report_probability,
+                      "fleets": {vehicle_type: shares[vehicle_type][district] for vehicle_type in fleets},
+                      "seed": None if seed is None else seed + district}
+            worker = context.Process(target=district_worker, name=f"District {district}", daemon=True,
+                                     args=(district, os.path.join(directory, "graph"),
+                                           os.path.join(directory, "labels.npy"), config, epoch,
+                                           inboxes[district], outbox))
+            worker.start()
+            workers.append(worker)
+
+        until = 0.0
+        outgoing = {district: [] for district in range(districts)}
+        incoming = {district: [] for district in range(districts)}
+        while True:
+            until += EPOCH
+            for district in range(districts):
+                inboxes[district].put((until, outgoing[district], incoming[district]))
+            reports = [outbox.get() for _ in range(districts)]
+            available = {district: free for district, free, _, _ in reports}
+            outgoing = {district: [] for district in range(districts)}
+            incoming = {district: [] for district in range(districts)}
+            for district, _, requests, _ in reports:
+                for incident_id, incident in requests:
+                    helper = assign_aid(incident, district, available)
+                    if helper != district:
+                        outgoing[district].append(incident_id)
+                        incoming[helper].append(incident)
+            if all(idle for *_, idle in reports) and not any(incoming.values()):
+                break
+            if max_time is not None and until >= max_time:
+                logging.warning(f"Stopping the districts at {until} s, before they were done")
+                break
+
+        for inbox in inboxes:
+            inbox.put(None)
+        results = [outbox.get() for _ in range(districts)]
+        for worker in workers:
+            worker.join()
+    statistics = IncidentStatistics()
+    figures = [None] * districts
+    for district, district_statistics, figure in results:
+        statistics.merge(district_statistics)
+        figures[district] = dict(figure, district=district, nodes=int(sizes[district]), citizens=shares["citizens"][district],
+                                 incidents=district_statistics.incidents)
+    logging.info(f"Simulated {until} s in {districts} districts")
+    return statistics, figures
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format="%(asctime)s  %(message)s", level=logging.INFO, datefmt="%H:%M:%S")
+    parser = argparse.ArgumentParser(description="Headless simulation of a city split into districts, one process each")
+    parser.add_argument("--districts", type=int, default=os.cpu_count(), help="number of districts (processes)")
+    parser.add_argument("--synthetic", default=None, metavar="LAYOUT:NODES",
+                        help="generated road network instead of the cached network of the bounding box")
+    parser.add_argument("--citizens", type=int, default=NCITIZENS)
+    parser.add_argument("--fire-trucks", type=int, default=FIRE_TRUCKS)
+    parser.add_argument("--police-cars", type=int, default=POLICE_CARS)
+    parser.add_argument("--ambulances", type=int, default=AMBULANCES)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--output", default="output.txt", help="file the merged statistics are written to")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        layout, nodes = args.synthetic.split(":")
+        city_graph = synthetic_city(layout, int(nodes), seed=args.seed or 0)
+    else:
+        from utils.constants import NORTH, SOUTH, EAST, WEST
+        from utils.graph_cache import load_graph
+        city_graph = load_graph(NORTH, SOUTH, EAST, WEST, network_type='drive')
+    started = time.time()
+    total, per_district = run(city_graph, args.districts, args.citizens,
+                              {"Fire-Truck": args.fire_trucks, "Police-Car": args.police_cars, "Ambulance": args.ambulances},
+                              seed=args.seed)
+    total.write_to_file(args.output)
+    for figure in per_district:
+        print(json.dumps(figure))
+    print(f"{total.incidents} incidents in {round(time.time() - started, 1)} s")
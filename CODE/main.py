@@ -1,23 +1,182 @@
 from services.city import City
-from simulation import Simulation
+from services.event_engine import DiscreteEventEngine
+import argparse
 import logging
-from utils.constants import NCITIZENS
+import threading
+from utils.constants import NCITIZENS, STORAGE_BACKEND, SEED, VECTORIZED_CITIZENS, CHECKPOINT_INTERVAL, \
+    TRACK_INTERVAL, ROUTING_BACKEND
+from utils.synthetic_graph import synthetic_city, LAYOUTS
+from services.live_feed import FEED_NAME
+from services.routing import BACKENDS
+# Plotting, OSMnx and the optional engines and services are imported where they are used, so that a headless run
+# only loads what it needs
 
-def main():
+def main(engine="threads", render="raster", storage=STORAGE_BACKEND, seed=SEED, event_log=None, synthetic=None,
+         citizens=NCITIZENS, vectorized=VECTORIZED_CITIZENS, checkpoint=None, checkpoint_interval=CHECKPOINT_INTERVAL,
+         resume=None, resume_index=-1, export=None, live=None, headless=False, track=None,
+         track_interval=TRACK_INTERVAL, routing=ROUTING_BACKEND):
     """
     Entry point of the program.
     Initializes the city, runs the simulation, and waits for the emergency response center to finish.
+
+    Args:
+        engine (str): "threads" for the real-time threaded simulation with visualization,
+            "asyncio" for the same simulation with every agent as a coroutine on one event loop,
+            "des" for the headless discrete-event simulation on a virtual clock.
+        render (str): "raster" to draw the street network from a cached image, "vector" to draw it with OSMnx.
+        storage (str): Where incidents are stored: "mysql", "sqlite" (local file) or "memory".
+        seed (int): Seed of the per-agent random streams, None for an unseeded run.
+        event_log (str): File to write the binary event log of the run to, None for no log.
+        synthetic (str): "layout:nodes" to run on a generated road network (see utils.synthetic_graph) instead of
+            the one of the bounding box, e.g. "grid:100000".
+        citizens (int): The number of citizens.
+        vectorized (bool): Simulate the citizens as one CitizenPopulation of arrays instead of one thread each.
+        checkpoint (str): File to write periodic checkpoints of a "des" run to, None for no checkpoints.
+        checkpoint_interval (float): Simulated seconds between two checkpoints.
+        resume (str): Checkpoint file of an interrupted "des" run to resume, which then goes on checkpointing
+            into it unless `checkpoint` names another file.
+        resume_index (int): The checkpoint of `resume` to resume from, negative counting from the last.
+        export (str): Directory to stream every incident and vehicle trip to as columnar files, None for no export.
+            With `resume`, the directory the export of the interrupted run continues in, None for its own.
+        live (str): Name of a shared memory feed to publish the run to, for viewer.py, None for no feed.
+        headless (bool): Run the "threads" or "asyncio" engine without the visualization window.
+        track (str): File to record the frames of the run to, rendered to a video by render.py, None for no track.
+        track_interval (float): Seconds between two frames of the track, simulated for "des" and wall-clock otherwise.
+        routing (str): Routing between two nodes that are not stations: "dijkstra", "astar" for bidirectional A* or
+            "ch" for a contraction hierarchy, preprocessed on the first run and cached next to the road network.
     """
     logging.info("Starting simulation")
-    my_city = City(NCITIZENS)  # Create an instance of the City class
-    simulation = Simulation(my_city)  # Create an instance of the Simulation class with the city instance
-    simulation.run()  # Run the simulation
-    my_city.emergency_response.join()  # Wait for the emergency response center to finish
+    graph = None
+    if synthetic:
+        layout, nodes = synthetic.split(":")
+        graph = synthetic_city(layout, int(nodes), seed=seed or 0)
+    if resume or checkpoint:
+        from services.checkpoint import Checkpointer, load_checkpoint
+    if resume:
+        continued = checkpoint in (None, resume)
+        des = load_checkpoint(resume, resume_index, compiled_graph=graph, storage_backend=storage,
+                              interval=checkpoint_interval if continued else None, export=export)
+        if not continued:
+            des.checkpointer = Checkpointer(des, checkpoint, checkpoint_interval)
+        my_city = des.city
+    else:
+        # Create an instance of the City class
+        my_city = City(citizens, storage, compiled_graph=graph, seed=seed, event_log=event_log,
+                       vectorized_citizens=vectorized, export=export, routing_backend=routing)
+        if engine == "des":
+            des = DiscreteEventEngine(my_city)
+            if checkpoint:
+                des.checkpointer = Checkpointer(des, checkpoint, checkpoint_interval)
+    feed = recorder = None
+    if live:
+        from services.live_feed import LiveFeed
+
+        feed = LiveFeed(my_city, live)  # Watched by viewer.py processes
+        feed.start()
+    if track:
+        from services.track import TrackRecorder
+
+        recorder = TrackRecorder(track, my_city, track_interval)
+        if resume or engine == "des":
+            des.track = recorder  # Captured between events, on the virtual clock
+            recorder.next_time = des.now
+        else:
+            recorder.start()
+    try:
+        if resume or engine == "des":
+            des.run()  # Run the whole simulation, or the rest of the interrupted one, on the virtual clock
+        elif engine == "asyncio":
+            from services.async_engine import AsyncEngine
+
+            async_engine = AsyncEngine(my_city)
+            if headless:
+                async_engine.run()
+            else:
+                async_engine.deploy()
+                loop = threading.Thread(target=async_engine.run, name="Event loop")
+                loop.start()
+                from simulation import Simulation
+
+                Simulation(my_city, render=render).run(start=False)  # The agents are driven by the event loop
+                loop.join()
+        elif headless:
+            my_city.start_services()
+            my_city.emergency_response.join()
+        else:
+            from simulation import Simulation
+
+            simulation = Simulation(my_city, render=render)  # Create an instance of the Simulation class with the city instance
+            simulation.run()  # Run the simulation
+            my_city.emergency_response.join()  # Wait for the emergency response center to finish
+    finally:
+        if feed is not None:
+            feed.close()
+        if recorder is not None:
+            recorder.close()
     logging.info("Simulation finished")
 
+def replay(path, render="raster", speed=1.0):
+    """
+    Draws a recorded run from its event log instead of simulating it.
+
+    Args:
+        path (str): The event log.
+        render (str): "raster" or "vector", as in main.
+        speed (float): Playback speed relative to the recorded run.
+    """
+    from services.replay import Replay, ReplayView
+    from simulation import Simulation
+
+    city = City(0, "memory")
+    city.deploy_emergency_services(start=False)
+    player = threading.Thread(target=Replay(path).play, args=(ReplayView(city), speed), daemon=True)
+    player.start()
+    Simulation(city, render=render).run(start=False)
+
 if __name__ == '__main__':
     normal_format = "\033[97m%(asctime)s:%(msecs)05d:  %(message)s\033[0m"
     debug_format = "\033[91m%(asctime)s:%(msecs)05d:  %(message)s\033[0m"
     logging.basicConfig(format=normal_format, level=logging.INFO, datefmt="%H:%M:%S")
     logging.basicConfig(format=debug_format, level=logging.ERROR, datefmt="%H:%M:%S", filename="debug.log")
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Emergency response simulation")
+    parser.add_argument("--engine", choices=["threads", "asyncio", "des"], default="threads",
+                        help="threads: real-time simulation with visualization, asyncio: the same on one event loop, "
+                             "des: headless discrete-event simulation")
+    parser.add_argument("--render", choices=["raster", "vector"], default="raster",
+                        help="raster: cached image of the street network (fast), vector: OSMnx line artists")
+    parser.add_argument("--storage", choices=["mysql", "sqlite", "memory"], default=STORAGE_BACKEND,
+                        help="mysql: MySQL server, sqlite: local SQLite file, memory: in-memory SQLite")
+    parser.add_argument("--seed", type=int, default=SEED, help="seed of the per-agent random streams (reproducible runs)")
+    parser.add_argument("--event-log", default=None, help="write the binary event log of the run to this file")
+    parser.add_argument("--export", default=None, metavar="DIR",
+                        help="stream every incident and vehicle trip to compressed columnar files in this directory")
+    parser.add_argument("--live", nargs="?", const=FEED_NAME, default=None, metavar="NAME",
+                        help="publish the run to a shared memory feed, watched with viewer.py")
+    parser.add_argument("--track", default=None, help="record the frames of the run to this file, for render.py")
+    parser.add_argument("--track-interval", type=float, default=TRACK_INTERVAL,
+                        help="seconds between two frames of --track (simulated with des)")
+    parser.add_argument("--headless", action="store_true", help="no visualization window for threads and asyncio")
+    parser.add_argument("--replay", default=None, help="draw the run recorded in this event log instead of simulating")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed of --replay")
+    parser.add_argument("--synthetic", default=None, metavar="LAYOUT:NODES",
+                        help=f"generated road network instead of OpenStreetMap, layout one of {', '.join(LAYOUTS)}")
+    parser.add_argument("--routing", choices=BACKENDS, default=ROUTING_BACKEND,
+                        help="routing between non-station nodes: dijkstra, astar (bidirectional A*) or ch (contraction "
+                             "hierarchy, cached)")
+    parser.add_argument("--citizens", type=int, default=NCITIZENS, help="number of citizens")
+    parser.add_argument("--vectorized-citizens", action="store_true", default=VECTORIZED_CITIZENS,
+                        help="citizens as arrays driven by one scheduler instead of one thread each, for large --citizens")
+    parser.add_argument("--checkpoint", default=None, help="write periodic checkpoints of a des run to this file")
+    parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL,
+                        help="simulated seconds between two checkpoints")
+    parser.add_argument("--resume", default=None, help="resume the des run checkpointed in this file")
+    parser.add_argument("--resume-index", type=int, default=-1,
+                        help="checkpoint of --resume to resume from, negative counting from the last")
+    args = parser.parse_args()
+    if args.replay:
+        replay(args.replay, args.render, args.speed)
+    else:
+        main(args.engine, args.render, args.storage, args.seed, args.event_log, args.synthetic, args.citizens,
+             args.vectorized_citizens, args.checkpoint, args.checkpoint_interval, args.resume, args.resume_index,
+             args.export, args.live, args.headless, args.track, args.track_interval, args.routing)
+ 
\ No newline at end of file
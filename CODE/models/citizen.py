@@ -1,8 +1,8 @@
 from models.moving_object import MovingObject
-import random
 import time 
 import logging
 from utils.constants import NINCIDENTS_PER_CITIZEN, CITIZEN_WAIT_TIME, CITIZEN_REPORT_PROBABILITY
+from utils.rng import agent_rng
 
 class Citizen(MovingObject):
     def __init__(self, id, graph, emergency_center, city):
@@ -11,33 +11,55 @@ class Citizen(MovingObject):
 
         Args:
             id (int): The unique identifier for the citizen.
-            graph (OSMnx Graph): The graph representing the city's road network.
+            graph (OSMnx Graph): The graph representing the city's road network, None unless the city built one.
             emergency_center (EmergencyCenter): The emergency center responsible for handling incidents.
             city (City): The city object to which the citizen belongs.
         """
-        start_node = random.choice(list(graph.nodes()))
+        self.rng = agent_rng(city.seed, "citizen", id)  # Own random stream when the run is seeded
+        start_node = self.random_node(city)
         super().__init__(id, graph, start_node)
         self.num_incidents_reported = 0
         self.emergency_center = emergency_center
         self.city = city
 
+    def random_node(self, city):
+        """
+        Draws a node of the city's road network, in O(1) from the compiled node array.
+        """
+        return int(self.rng.choice(city.compiled_graph.node_ids))
+
     def report_incident(self):
         """
         Reports an incident to the emergency center.
         """
         incident_location = self.current_node
-        self.emergency_center.report_incident(incident_location)
+        incident_type = self.emergency_center.draw_incident_type(self.rng)
+        self.emergency_center.report_incident(incident_location, incident_type)
         self.num_incidents_reported += 1
-        self.current_node = random.choice(list(self.graph.nodes()))
+        self.current_node = self.random_node(self.city)
 
-    def run(self):
+    def steps(self):
         """
-        Runs the citizen's behavior of reporting incidents.
+        The citizen's behavior of reporting incidents, as a generator yielding the seconds to wait between two
+        steps, so the same behavior runs on a thread (time.sleep) or as a coroutine (asyncio.sleep).
         """
-        time.sleep(random.randint(CITIZEN_WAIT_TIME[0], CITIZEN_WAIT_TIME[1]))
+        yield self.rng.randint(CITIZEN_WAIT_TIME[0], CITIZEN_WAIT_TIME[1])
         while self.num_incidents_reported < NINCIDENTS_PER_CITIZEN:
-            if random.random() < CITIZEN_REPORT_PROBABILITY:
+            if self.rng.random() < CITIZEN_REPORT_PROBABILITY:
                 self.report_incident()
-            time.sleep(random.random() * 10)
+            yield self.rng.random() * 10
+
+    def retire(self):
+        """
+        Leaves the city once all incidents are reported.
+        """
         logging.info(f"Citizen {self.id} reported {self.num_incidents_reported} incidents and is done")
-        self.city.citizens.remove(self)
+        self.city.retire_citizen(self)
+
+    def run(self):
+        """
+        Runs the citizen's behavior of reporting incidents.
+        """
+        for delay in self.steps():
+            time.sleep(delay)
+        self.retire()
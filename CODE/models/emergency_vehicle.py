@@ -1,5 +1,6 @@
 from models.moving_object import MovingObject
 from models.incident import Incident
+import threading
 import time
 import logging
 
@@ -10,17 +11,22 @@ class EmergencyVehicle(MovingObject):
 
     Attributes:
         id (int): The unique identifier of the emergency vehicle.
-        graph (OSMnx Graph): The graph representing the road network.
+        graph (OSMnx Graph): The graph representing the road network, None when the router handles all the routing.
         vehicle_type (str): The type of the emergency vehicle.
         home_location (int): The OSM home location of the emergency vehicle.
         incident (Incident): The incident that the emergency vehicle is attending.
         available (bool): Indicates whether the emergency vehicle is available or not.
         at_home_location (bool): Indicates whether the emergency vehicle is at its home location or not.
         done (bool): Indicates whether the emergency vehicle has completed its tasks or not (Simulation End Condition)
+        router (StationRouter): Precomputed routes from and to the vehicle's station.
+        dispatch_index (DispatchIndex): The index tracking the vehicle's position while it is available.
+        center (EmergencyResponseCenter): The response center notified of arrivals, resolutions and returns.
+        wakeup (threading.Condition): Notified, under the vehicle's lock, when an incident is assigned or the vehicle is stopped.
     """
 
-    def __init__(self, id, graph, vehicle_type, home_location):
+    def __init__(self, id, graph, vehicle_type, home_location, router=None):
         super().__init__(id, graph, home_location)
+        self.router = router
         self.id = id
         self.incident = None
         self.vehicle_type = vehicle_type
@@ -28,6 +34,9 @@ class EmergencyVehicle(MovingObject):
         self.at_home_location = True
         self.home_location = home_location
         self.done = False
+        self.dispatch_index = None
+        self.center = None
+        self.wakeup = threading.Condition(self.lock)
 
     def attend_incident(self):
         """
@@ -35,39 +44,103 @@ class EmergencyVehicle(MovingObject):
 
         This method moves the emergency vehicle to the incident location, reduces the severity of the incident,
         and resolves the incident when the severity reaches zero. Finally, it returns the emergency vehicle to its
-        home location.
+        home location. The vehicle is available again as soon as the incident is resolved, so it can be sent
+        to a new incident on its way home.
         """
-        self.available = False
-        self.set_route(self.incident.location)
-        self.at_home_location = False
-        while self.move():
-            time.sleep(0.1)
-        while not self.incident.resolved:
-            with self.incident.lock:
-                self.incident.severity -= 3
-            time.sleep(1)
-            if self.incident.severity <= 0:
-                with self.incident.lock:
-                    self.incident.resolved = True
-                    self.incident.status = "resolved"
-        self.target_node = self.home_location
-        self.route = self.set_route(self.home_location)
-        while self.move():
-            time.sleep(0.1)
-        self.at_home_location = True
-        self.available = True
-        self.incident = None
+        for delay in self.attend_steps():
+            time.sleep(delay)
+
+    def attend_steps(self):
+        """
+        The behavior of attend_incident as a generator yielding the seconds to wait between two steps, so the
+        same behavior runs on a thread (time.sleep) or as a coroutine (asyncio.sleep).
+        """
+        while True:
+            with self.lock:
+                incident = self.incident
+                if incident is None:
+                    # Under the lock the dispatcher assigns with, so a dispatch cannot slip in after the last check
+                    self.at_home_location = True
+                    break
+            self.available = False
+            self.set_route(incident.location)
+            self.at_home_location = False
+            while self.move():
+                yield 0.1
+            self.notify("arrival", incident)
+            while not incident.resolved:
+                with incident.lock:
+                    incident.severity -= 3
+                yield 1
+                if incident.severity <= 0:
+                    with incident.lock:
+                        if incident.resolved:
+                            continue
+                        incident.resolved = True
+                        incident.status = "resolved"
+                    self.notify("resolve", incident)
+            self.release()
+            self.target_node = self.home_location
+            self.route = self.set_route(self.home_location)
+            while self.move():
+                if self.incident is not None:
+                    break  # Dispatched again on the way home
+                yield 0.1
+        self.notify("return", None)
+
+    def notify(self, event, incident):
+        """
+        Reports an event of the vehicle ("arrival", "resolve", "return") to its response center.
+        """
+        if self.center is not None:
+            self.center.notify(event, incident, self)
+
+    def release(self):
+        """
+        Makes the vehicle available again after its incident is resolved and registers it in the dispatch index,
+        both under the vehicle's lock so the dispatcher never sees one without the other.
+        """
+        with self.lock:
+            self.incident = None
+            self.available = True
+            if self.dispatch_index is not None:
+                self.dispatch_index.add(self)
+        if self.center is not None:
+            self.center.wake()  # Queued incidents may be waiting for this vehicle
+
+    def move(self):
+        """
+        Moves the vehicle to the next step in its route and, while it is available, keeps the dispatch index
+        up to date with its position.
+
+        Returns:
+            bool: True if the vehicle successfully moved to the next step, False otherwise.
+        """
+        previous_node = self.current_node
+        moved = super().move()
+        if moved and self.available and self.dispatch_index is not None and previous_node != self.current_node:
+            self.dispatch_index.relocate(self, previous_node)
+        return moved
+
+    def stop(self):
+        """
+        Ends the vehicle's thread once it is back from its current incident, if any.
+        """
+        with self.lock:
+            self.done = True
+            self.wakeup.notify()
 
     def run(self):
         """
         Runs the emergency vehicle's tasks.
 
-        This method continuously checks for incidents and attends them if the emergency vehicle is available.
-        It waits until the emergency vehicle becomes available again before checking for new incidents.
+        The thread sleeps on `wakeup` until the response center assigns it an incident, attends it, and goes back
+        to sleep once it is home, until it is stopped.
         """
-        while not self.done:
-            if self.incident and not self.available:
-                self.attend_incident()
-                while not self.available:
-                    time.sleep(0.1)
-            time.sleep(0.1)
\ No newline at end of file
+        while True:
+            with self.lock:
+                while self.incident is None and not self.done:
+                    self.wakeup.wait()
+                if self.incident is None:
+                    return
+            self.attend_incident()
\ No newline at end of file
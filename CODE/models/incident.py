@@ -1,16 +1,21 @@
 import threading
 
 class Incident:
-    def __init__(self, id, osmid, incident_type, time, severity):
+    def __init__(self, id, osmid, incident_type, time, severity, type_code=None):
         self.id = id
         self.location = osmid
         self.incident_type = incident_type
+        self.type_code = type_code  # Code of the type in utils.incident_catalog.CATALOG
         self.report_time = time
         self.severity = severity
         self.status = "reported"
         self.resolved = False
         self.vehicles_dispatched = []
         self.vehicles_needed = []
+        self.dispatch_attempts = 0  # Times the response center tried to dispatch vehicles to it
+        self.vehicles_arrived = 0
+        self.arrival_time = None  # When the first vehicle reached it
+        self.resolve_time = None
         self.lock = threading.Lock()
 
     def __str__(self):
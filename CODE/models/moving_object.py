@@ -1,6 +1,5 @@
 import threading
 import time
-import osmnx as ox
 import logging
 
 class MovingObject(threading.Thread):
@@ -9,12 +8,14 @@ class MovingObject(threading.Thread):
 
     Attributes:
         id (int): The ID of the moving object.
-        graph (OSMnx Graph): The graph representing the environment.
+        graph (OSMnx Graph): The graph representing the environment, None when the router handles all the routing.
         start_node (int): The starting node of the moving object.
         route (list): The route of the moving object.
         route_index (int): The index of the current step in the route.
         scatter (object): The reference to the matplotlib scatter object.
-        position (tuple): The position of the moving object (x, y coordinates).
+        router (StationRouter): Optional router used instead of OSMnx to compute routes.
+        positions (AgentPositions): The shared position arrays the object publishes its current node to.
+        slot (int): The slot of the object in positions.
     """
 
     def __init__(self, id, graph, start_node, route=[]):
@@ -23,20 +24,53 @@ class MovingObject(threading.Thread):
 
         Args:
             id (int): The ID of the moving object.
-            graph (networkx.Graph): The graph representing the environment.
+            graph (networkx.Graph): The graph representing the environment, or None when routes come from a router.
             start_node (int): The starting node of the moving object.
             route (list, optional): The route of the moving object. Defaults to an empty list.
         """
         super().__init__()
         self.id = id
         self.graph = graph
+        self.positions = None  # Shared position arrays used by the renderer
+        self.slot = None
         self.current_node = start_node
         self.lock = threading.Lock()  # Lock to prevent multiple threads from accessing the same object
         self.target_node = None  # The destination node
         self.route = route
         self.route_index = 0  # Which step we are at in the route
         self.scatter = None  # Reference to the matplotlib scatter object
-        self.position = None  # Position for the animation (x, y coordinates)
+        self.router = None  # Precomputed routing, falls back to OSMnx when not set
+
+    @property
+    def current_node(self):
+        """
+        The node the moving object is on. Setting it also publishes it to the shared position arrays.
+        """
+        return self._current_node
+
+    @current_node.setter
+    def current_node(self, node):
+        self._current_node = node
+        if self.positions is not None:
+            self.positions.update(self.slot, node)
+
+    def attach_positions(self, positions):
+        """
+        Registers the moving object in shared position arrays, which it then keeps up to date.
+
+        Args:
+            positions (AgentPositions): The position arrays of the object's group.
+        """
+        self.slot = positions.register(self.current_node)
+        self.positions = positions
+
+    def detach_positions(self):
+        """
+        Removes the moving object from its position arrays, for example once a citizen is done.
+        """
+        if self.positions is not None:
+            self.positions.release(self.slot)
+            self.positions, self.slot = None, None
 
     def set_route(self, target_node, weight='length'):
         """
@@ -48,9 +82,20 @@ class MovingObject(threading.Thread):
 
         Returns:
             list: The calculated route.
+
+        Raises:
+            RuntimeError: If there is no router (or the weight is not 'length') and no graph to route on with OSMnx.
         """
         self.target_node = target_node
-        self.route = ox.shortest_path(self.graph, self.current_node, self.target_node, weight=weight)
+        if self.router is not None and weight == 'length':
+            self.route = self.router.shortest_path(self.current_node, self.target_node)
+        else:
+            if self.graph is None:
+                raise RuntimeError(f"{type(self).__name__} {self.id} has no graph to route on with weight {weight!r}: "
+                                   "pass a router, or the NetworkX graph of the city")
+            import osmnx as ox  # Only without a router; the vehicles deployed by City always have one
+
+            self.route = ox.shortest_path(self.graph, self.current_node, self.target_node, weight=weight)
         self.route_index = 0
         return self.route
 
@@ -64,21 +109,8 @@ class MovingObject(threading.Thread):
         if self.route and self.route_index < len(self.route):
             self.current_node = self.route[self.route_index]
             self.route_index += 1
-            self.position = (self.graph.nodes[self.current_node]['x'], self.graph.nodes[self.current_node]['y'])
             return True
         else:
             self.route = []
             self.route_index = 0
             return False
-
-    def determine_sleep_time(self):
-        """
-        Determines the sleep time for the moving object based on the length of the edge.
-
-        Returns:
-            float: The sleep time in seconds.
-        """
-        if self.route_index == 0 or self.route_index == len(self.route):
-            return 0.1
-        time_to_sleep = self.graph.edges[self.route[self.route_index - 1], self.route[self.route_index], 0]['length'] / 1000
-        return time_to_sleep
\ No newline at end of file
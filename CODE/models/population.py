@@ -0,0 +1,189 @@
+import threading
+import time
+import logging
+import numpy as np
+from utils.constants import NINCIDENTS_PER_CITIZEN, CITIZEN_WAIT_TIME, CITIZEN_REPORT_PROBABILITY
+from utils.incident_catalog import CATALOG
+
+STEP_TIME = 10  # A Citizen waits up to this many seconds between two report attempts
+
+
+class CitizenPopulation:
+    """
+    All the citizens of a city as arrays instead of one Citizen thread each.
+
+    A Citizen waits CITIZEN_WAIT_TIME, then every U(0, STEP_TIME) seconds reports an incident with probability
+    CITIZEN_REPORT_PROBABILITY. The population keeps the same mean rate but draws it as a Poisson process:
+    the time to a citizen's next report is exponential with rate p / (STEP_TIME / 2). Like a Citizen, a citizen
+    reports where it stands, then moves to a random node, and leaves after NINCIDENTS_PER_CITIZEN reports.
+
+    Reports are drawn in bulk for a time window: the citizens due are found with one comparison over the
+    `next_report` array, and their incident types (from the alias table of the incident catalog), new locations
+    and next report times are drawn with one vectorized call each, so the cost per report is a few array elements
+    whatever the size of the population.
+
+    Attributes:
+        graph (CompiledGraph): The road network.
+        location (np.ndarray): Node index of each citizen (int64).
+        remaining (np.ndarray): Reports each citizen still has to make (int64).
+        next_report (np.ndarray): Time of each citizen's next report in seconds, inf once it left (float64).
+        active (int): The number of citizens that still have reports to make.
+        rate (float): Reports per second of an active citizen.
+        positions (AgentPositions): The position arrays the citizens are published to, if any.
+    """
+
+    def __init__(self, graph, size, seed=None, weights=None, reports=NINCIDENTS_PER_CITIZEN,
+                 report_probability=CITIZEN_REPORT_PROBABILITY, wait_time=CITIZEN_WAIT_TIME, positions=None):
+        """
+        Places the citizens and draws their first report times.
+
+        Args:
+            graph (CompiledGraph): The road network.
+            size (int): The number of citizens.
+            seed (int, optional): Seed of the population's random generator. Defaults to None, unseeded.
+            weights (array-like, optional): Relative population of each node, in the order of graph.node_ids.
+                Citizens are placed and move proportionally to it. Defaults to uniform.
+            reports (int, optional): Reports per citizen. Defaults to NINCIDENTS_PER_CITIZEN.
+            report_probability (float, optional): Probability of reporting at each step. Defaults to CITIZEN_REPORT_PROBABILITY.
+            wait_time (tuple, optional): Range of the initial wait in seconds. Defaults to CITIZEN_WAIT_TIME.
+            positions (AgentPositions, optional): Position arrays to publish the citizens to.
+        """
+        self.graph = graph
+        self.rng = np.random.default_rng(seed)
+        self.rate = report_probability / (STEP_TIME / 2)
+        self._cumulative = None
+        if weights is not None:
+            cumulative = np.cumsum(np.asarray(weights, dtype=np.float64))
+            self._cumulative = cumulative / cumulative[-1]
+        self._incident_types = np.array(CATALOG.names, dtype=object)
+
+        self.location = self.draw_nodes(size)
+        self.remaining = np.full(size, reports, dtype=np.int64)
+        self.next_report = self.rng.integers(wait_time[0], wait_time[1] + 1, size) + self._gaps(size)
+        if reports <= 0:
+            self.next_report[:] = np.inf
+        self.active = size if reports > 0 else 0
+        self.positions = positions
+        self._slots = positions.register_many(self.location) if positions is not None else None
+
+    def __len__(self):
+        return len(self.location)
+
+    def draw_nodes(self, count):
+        """
+        Draws `count` node indices, uniformly or proportionally to the population weights.
+        """
+        if self._cumulative is None:
+            return self.rng.integers(0, len(self.graph), count)
+        return np.minimum(np.searchsorted(self._cumulative, self.rng.random(count), side='right'), len(self.graph) - 1)
+
+    def next_time(self):
+        """
+        Returns the time of the next report, inf once every citizen is done.
+        """
+        return float(self.next_report.min()) if len(self.next_report) else np.inf
+
+    def due(self, until):
+        """
+        Makes every report due up to `until` and advances the citizens that made them.
+
+        Args:
+            until (float): End of the window in seconds.
+
+        Returns:
+            tuple: The times (np.ndarray), OSM node ids (np.ndarray) and incident types (np.ndarray) of the
+            reports, sorted by time.
+        """
+        times, nodes, types = [], [], []
+        citizens = np.flatnonzero(self.next_report <= until)
+        while len(citizens):  # A citizen can report several times in a long window
+            times.append(self.next_report[citizens])
+            nodes.append(self.location[citizens])
+            types.append(CATALOG.draw_many(self.rng, len(citizens)))
+            self.remaining[citizens] -= 1
+            self.location[citizens] = self.draw_nodes(len(citizens))
+            self.next_report[citizens] += self._gaps(len(citizens))
+            finished = citizens[self.remaining[citizens] == 0]
+            self.next_report[finished] = np.inf
+            self.active -= len(finished)
+            if self.positions is not None:
+                moved = self.location[citizens]
+                moved[self.remaining[citizens] == 0] = -1  # Citizens that are done leave the map
+                self.positions.update_many(self._slots[citizens], moved)
+            citizens = citizens[self.next_report[citizens] <= until]
+        if not times:
+            return np.empty(0), np.empty(0, dtype=np.int64), np.empty(0, dtype=object)
+        times, nodes, types = np.concatenate(times), np.concatenate(nodes), np.concatenate(types)
+        order = np.argsort(times, kind='stable')
+        return times[order], self.graph.node_ids[nodes[order]], self._incident_types[types[order]]
+
+    def run(self, center, done, window=1.0):
+        """
+        Feeds the reports to a response center in real time, from a single thread, until every citizen is done
+        or `done` is set.
+
+        Args:
+            center (EmergencyResponseCenter): The center receiving the reports.
+            done (threading.Event): Set to stop early.
+            window (float, optional): Seconds of reports drawn at once. Defaults to 1.
+        """
+        started = time.time()
+        while self.active and not done.is_set():
+            now = time.time() - started
+            next_time = self.next_time()
+            if next_time > now:
+                if done.wait(min(next_time - now, window)):
+                    break
+                continue
+            for report_time, node, incident_type in zip(*self.due(now)):
+                center.report_incident(int(node), incident_type)
+        logging.info(f"All {len(self)} citizens reported their incidents")
+
+    def state(self):
+        """
+        Returns a copy of the citizens' arrays and of the random stream, for checkpoints.
+        """
+        return {"location": self.location.copy(), "remaining": self.remaining.copy(),
+                "next_report": self.next_report.copy(), "active": self.active, "rng": self.rng.bit_generator.state}
+
+    def restore(self, state):
+        """
+        Replaces the citizens with a state returned by state() of a population of the same size.
+        """
+        self.location[:] = state["location"]
+        self.remaining[:] = state["remaining"]
+        self.next_report[:] = state["next_report"]
+        self.active = state["active"]
+        self.rng.bit_generator.state = state["rng"]
+        if self.positions is not None:
+            nodes = self.location.copy()
+            nodes[self.remaining == 0] = -1  # Citizens that are done are off the map
+            self.positions.update_many(self._slots, nodes)
+
+    def _gaps(self, count):
+        return self.rng.exponential(1 / self.rate, count) if self.rate > 0 else np.full(count, np.inf)
+
+
+class PopulationThread(threading.Thread):
+    """
+    The thread feeding the reports of a CitizenPopulation to the response center in real time.
+
+    Attributes:
+        done (threading.Event): Set to stop the thread early.
+        finished (threading.Event): Set once the last report was delivered.
+    """
+
+    def __init__(self, population, center):
+        super().__init__(name="Citizens", daemon=True)
+        self.population = population
+        self.center = center
+        self.done = threading.Event()
+        self.finished = threading.Event()
+
+    def run(self):
+        self.population.run(self.center, self.done)
+        self.finished.set()
+        self.center.wake()
+
+    def stop(self):
+        self.done.set()
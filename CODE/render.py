@@ -0,0 +1,232 @@
+import os
+import math
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from services.track import Track
+
+VIDEO_FORMATS = (".mp4", ".mkv", ".mov", ".webm")  # Encoded with ffmpeg, anything else is a directory of PNG frames
+CHUNK_FRAMES = 240  # Consecutive frames rendered by one task
+
+_renderer = None  # The frame renderer of the worker process
+
+
+def _init_worker(path, width, height, lod_threshold):
+    """
+    Opens the track and builds the figure once per worker process.
+    """
+    global _renderer
+    logging.basicConfig(level=logging.WARNING)
+    _renderer = FrameRenderer(Track(path), width, height, lod_threshold)
+
+
+class FrameRenderer:
+    """
+    Draws the frames of a track off-screen with the Agg backend, without pyplot.
+
+    The street network, the axes and the legend are drawn once and kept as a background; every frame restores it
+    and draws only the agents, the density map, the legend and the title over it.
+
+    Attributes:
+        track (Track): The track being rendered.
+        width (int): Width of the frames in pixels.
+        height (int): Height of the frames in pixels.
+        lod_threshold (int): Number of citizens above which they are drawn as a density map.
+    """
+
+    def __init__(self, track, width=1280, height=720, lod_threshold=2000):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.track = track
+        self.width = width
+        self.height = height
+        self.lod_threshold = lod_threshold
+        meta = track.meta
+        self.fig = Figure(figsize=(width / 100, height / 100), dpi=100, facecolor='black')
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_axes([0, 0, 1, 0.95])
+        self.ax.set_facecolor('#111111')
+        self.ax.set_axis_off()
+        extent = [meta["west"], meta["east"], meta["south"], meta["north"]]
+        if meta["basemap"] and os.path.exists(meta["basemap"]):
+            import matplotlib.image as mpimg
+
+            self.ax.imshow(mpimg.imread(meta["basemap"]), zorder=0, interpolation='bilinear', extent=extent)
+        self.ax.set_xlim(meta["west"], meta["east"])
+        self.ax.set_ylim(meta["south"], meta["north"])
+        styles = {"citizens": ('black', 8, 'o', 'Citizens'), "incidents": ('orange', 40, 's', 'Incidents'),
+                  "police": ('blue', 16, 'o', 'Police'), "firetrucks": ('red', 16, 'o', 'Firetrucks'),
+                  "ambulances": ('green', 16, 'o', 'Ambulances')}
+        self.scatters = {}
+        for group, (color, size, marker, label) in styles.items():
+            self.scatters[group] = self.ax.scatter([], [], c=color, s=size, marker=marker, label=label, zorder=2,
+                                                   animated=True)
+        self.density_image = self.ax.imshow(np.zeros((2, 2)), origin='lower', cmap='magma', alpha=0.6, zorder=1,
+                                            extent=extent, animated=True)
+        self.ax.set_aspect('auto')
+        self.legend = self.ax.legend(loc='upper right')
+        self.legend.set_animated(True)  # Drawn over the agents
+        self.title = self.fig.text(0.5, 0.975, "", ha='center', va='center', color='white', animated=True)
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+    def draw(self, number):
+        """
+        Draws a frame of the track.
+
+        Args:
+            number (int): The frame of the track.
+
+        Returns:
+            bytes: The RGBA pixels of the frame.
+        """
+        frame = self.track.frame(number)
+        self.canvas.restore_region(self.background)
+        density = frame.density
+        citizens = frame.groups["citizens"]
+        if density is None and len(citizens) > self.lod_threshold:
+            meta = self.track.meta
+            density = np.histogram2d(citizens[:, 1], citizens[:, 0], bins=meta["density_bins"],
+                                     range=[[meta["south"], meta["north"]], [meta["west"], meta["east"]]])[0]
+        if density is not None:
+            citizens = np.empty((0, 2))
+            self.density_image.set_data(np.log1p(density))
+            self.density_image.set_clim(0, max(np.log1p(density.max()), 1))
+            self.ax.draw_artist(self.density_image)
+        for group, points in frame.groups.items():
+            self.scatters[group].set_offsets(citizens if group == "citizens" else points)
+            self.ax.draw_artist(self.scatters[group])
+        self.ax.draw_artist(self.legend)
+        self.title.set_text(f"{round(frame.time, 1)} s - {frame.active} active incidents - {frame.queued} queued")
+        self.fig.draw_artist(self.title)
+        return bytes(self.canvas.buffer_rgba())
+
+
+def frame_numbers(times, fps, speed, start=None, end=None):
+    """
+    Maps the frames of a video onto the frames of a track: video frame k shows the latest track frame at or before
+    start + k * speed / fps.
+
+    Args:
+        times (np.ndarray): The times of the track frames.
+        fps (float): Frames per second of the video.
+        speed (float): Seconds of the run per second of video.
+        start (float, optional): Time of the first video frame. Defaults to the first track frame.
+        end (float, optional): Time after which to stop. Defaults to the last track frame.
+
+    Returns:
+        np.ndarray: The track frame of every video frame.
+    """
+    start = times[0] if start is None else start
+    end = times[-1] if end is None else end
+    moments = start + np.arange(int(math.floor((end - start) * fps / speed)) + 1) * speed / fps
+    return np.maximum(np.searchsorted(times, moments, side='right') - 1, 0)
+
+
+def render_chunk(first, numbers, output, fps):
+    """
+    Renders consecutive video frames in a worker, as PNG files in the directory `output`, or as a video segment
+    when `output` is a video file.
+
+    Returns:
+        str: The file or directory written.
+    """
+    encoder = None
+    if output.endswith(VIDEO_FORMATS):
+        encoder = subprocess.Popen(["ffmpeg", "-v", "error", "-y", "-f", "rawvideo", "-pix_fmt", "rgba", "-s",
+                                    f"{_renderer.width}x{_renderer.height}", "-r", str(fps), "-i", "-",
+                                    "-c:v", "libx264", "-pix_fmt", "yuv420p", output], stdin=subprocess.PIPE)
+    else:
+        from PIL import Image
+    last, pixels = None, None
+    for k, number in enumerate(numbers, first):
+        if number != last:
+            pixels = _renderer.draw(number)  # A slow-motion video shows the same track frame several times
+            last = number
+        if encoder is not None:
+            encoder.stdin.write(pixels)
+        else:
+            Image.frombuffer("RGBA", (_renderer.width, _renderer.height), pixels, "raw", "RGBA", 0, 1).save(
+                os.path.join(output, f"frame-{k:06d}.png"), compress_level=1)
+    if encoder is not None:
+        encoder.stdin.close()
+        if encoder.wait():
+            raise RuntimeError(f"ffmpeg failed to encode {output}")
+    return output
+
+
+def render(path, output, fps=30, speed=1.0, workers=None, width=1280, height=720, start=None, end=None,
+           lod_threshold=2000, chunk_frames=CHUNK_FRAMES):
+    """
+    Renders a recorded track (main.py --track) to a video, or to a directory of PNG frames, across a process pool.
+
+    Every task renders CHUNK_FRAMES consecutive frames in a worker holding its own figure; with ffmpeg the chunks
+    are encoded as separate segments in parallel and then joined without re-encoding.
+
+    Args:
+        path (str): The track.
+        output (str): A video file (.mp4, .mkv, .mov, .webm; needs ffmpeg) or a directory for PNG frames.
+        fps (int, optional): Frames per second of the video. Defaults to 30.
+        speed (float, optional): Seconds of the run per second of video. Defaults to 1.
+        workers (int, optional): Number of processes. Defaults to the number of CPUs.
+        width (int, optional): Width in pixels, even for the video encoder. Defaults to 1280.
+        height (int, optional): Height in pixels, even for the video encoder. Defaults to 720.
+        start (float, optional): Time of the run to start at. Defaults to its first frame.
+        end (float, optional): Time of the run to stop at. Defaults to its last frame.
+        lod_threshold (int, optional): Citizens drawn one by one at most. Defaults to 2000.
+        chunk_frames (int, optional): Frames per task. Defaults to CHUNK_FRAMES.
+
+    Returns:
+        int: The number of frames rendered.
+    """
+    track = Track(path)
+    if not len(track):
+        raise ValueError(f"{path} has no frames")
+    numbers = frame_numbers(track.times, fps, speed, start, end)
+    track.close()
+    video = output.endswith(VIDEO_FORMATS)
+    if video and shutil.which("ffmpeg") is None:
+        output = os.path.splitext(output)[0]
+        logging.warning(f"ffmpeg not found, writing PNG frames to {output} instead")
+        video = False
+    segments = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output))) if video else output
+    os.makedirs(segments, exist_ok=True)
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker,
+                             initargs=(path, width, height, lod_threshold)) as pool:
+        futures = [pool.submit(render_chunk, first, numbers[first:first + chunk_frames],
+                               os.path.join(segments, f"segment-{first:06d}{os.path.splitext(output)[1]}")
+                               if video else output, fps)
+                   for first in range(0, len(numbers), chunk_frames)]
+        parts = [future.result() for future in futures]
+    if video:
+        playlist = os.path.join(segments, "segments.txt")
+        with open(playlist, "w") as f:
+            f.writelines(f"file '{os.path.abspath(part)}'\n" for part in parts)
+        subprocess.run(["ffmpeg", "-v", "error", "-y", "-f", "concat", "-safe", "0", "-i", playlist, "-c", "copy",
+                        output], check=True)
+        shutil.rmtree(segments)
+    logging.info(f"Rendered {len(numbers)} frames to {output} in {round(time.time() - started, 1)} s")
+    return len(numbers)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format="%(asctime)s  %(message)s", level=logging.INFO, datefmt="%H:%M:%S")
+    parser = argparse.ArgumentParser(description="Render a recorded run (main.py --track) to a video off-screen")
+    parser.add_argument("track", help="the track file")
+    parser.add_argument("output", help="video file (.mp4, .mkv, .mov, .webm; needs ffmpeg) or directory of PNG frames")
+    parser.add_argument("--fps", type=int, default=30, help="frames per second of the video")
+    parser.add_argument("--speed", type=float, default=1.0, help="seconds of the run per second of video")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: number of CPUs)")
+    parser.add_argument("--size", default="1280x720", metavar="WIDTHxHEIGHT", help="size of the frames in pixels")
+    parser.add_argument("--start", type=float, default=None, help="time of the run to start at")
+    parser.add_argument("--end", type=float, default=None, help="time of the run to stop at")
+    args = parser.parse_args()
+    width, height = (int(value) for value in args.size.split("x"))
+    render(args.track, args.output, args.fps, args.speed, args.workers, width, height, args.start, args.end)
@@ -0,0 +1,154 @@
+import asyncio
+import time
+import logging
+
+POPULATION_WINDOW = 1  # Longest sleep in seconds between two draws of a CitizenPopulation
+
+
+class AsyncEngine:
+    """
+    Runs a city in real time with every agent as a coroutine on a single asyncio event loop.
+
+    Citizens, vehicles and the emergency response center are the same objects used by the threaded
+    simulation, but their threads are never started: `Citizen.steps` and `EmergencyVehicle.attend_steps`
+    are driven with `asyncio.sleep` instead of `time.sleep`, and the dispatcher waits on an asyncio.Event.
+    A coroutine costs a few kilobytes and no context switch, so tens of thousands of agents share one
+    thread. Everything runs on the loop's thread, so the locks of the agents are never contended.
+
+    Attributes:
+        city (City): The city being simulated.
+        assigned (dict): Vehicle -> asyncio.Event set when the response center assigns it an incident.
+        wakeup (asyncio.Event): Set whenever the dispatcher may have something to do (replaces the center's).
+        tasks (list): The agent tasks, once the engine is running.
+    """
+
+    def __init__(self, city):
+        """
+        Initializes the engine.
+
+        Args:
+            city (City): The city to simulate.
+        """
+        self.city = city
+        self.assigned = {}
+        self.wakeup = None
+        self.tasks = []
+
+    def run(self, write_output=True):
+        """
+        Deploys the city and runs it until every citizen is done and every incident is resolved.
+
+        Args:
+            write_output (bool, optional): Write output.txt at the end. Defaults to True.
+
+        Returns:
+            dict: The statistics of the run (see IncidentStatistics.snapshot).
+        """
+        return asyncio.run(self.main(write_output))
+
+    async def main(self, write_output=True):
+        """
+        The coroutine of run, for callers that already have an event loop.
+        """
+        center = self.city.emergency_response if self.wakeup is not None else self.deploy()
+        started = time.time()
+        vehicles = [asyncio.create_task(self.vehicle(vehicle)) for vehicle in self.assigned]
+        citizens = [asyncio.create_task(self.citizen(citizen)) for citizen in self.city.citizens]
+        if self.city.population is not None:
+            citizens.append(asyncio.create_task(self.population(self.city.population)))
+        self.tasks = vehicles + citizens
+        logging.info(f"Running {len(self.tasks)} agents on one event loop")
+        await self.dispatcher()
+
+        # Shut down like City.shutdown: no incident is active anymore, so the vehicles are only driving home
+        center.sql.add_data()
+        if write_output:
+            center.write_statistics()
+        for vehicle, assigned in self.assigned.items():
+            vehicle.done = True
+            assigned.set()
+        await asyncio.gather(*self.tasks)
+        logging.info(f"All {len(self.tasks)} agents done in {round(time.time() - started, 1)} s")
+        center.close()
+        return center.statistics.snapshot()
+
+    def deploy(self):
+        """
+        Creates the vehicles, the emergency response center and the citizens without starting their threads.
+        Called by run, or beforehand from another thread, e.g. to draw the city before the loop starts.
+
+        Returns:
+            EmergencyResponseCenter: The response center of the city.
+        """
+        self.city.deploy_emergency_services(start=False)
+        center = self.city.emergency_response
+        self.wakeup = asyncio.Event()
+        center.wakeup = self.wakeup  # wake() sets it from the coroutines, all on the loop's thread
+        center.on_dispatch = self.vehicle_dispatched
+        for vehicle in center.firetrucks + center.police_cars + center.ambulances:
+            self.assigned[vehicle] = asyncio.Event()
+        self.city.deploy_citizens(start=False)
+        return center
+
+    async def dispatcher(self):
+        """
+        `EmergencyResponseCenter.queue_listener` as a coroutine.
+        """
+        center = self.city.emergency_response
+        while True:
+            self.wakeup.clear()
+            if not self.city.has_active_citizens() and not center.active_incidents:
+                break
+            if center.process_incidents() and not center.incident_queue.empty():
+                await asyncio.sleep(0)  # Let the dispatched vehicles start before the next pass
+                continue
+            await self.wakeup.wait()
+        logging.info("All citizens are done, shutting down Emergency Response Center")
+
+    async def citizen(self, citizen):
+        """
+        `Citizen.run` as a coroutine.
+        """
+        for delay in citizen.steps():
+            await asyncio.sleep(delay)
+        citizen.retire()
+
+    async def population(self, population):
+        """
+        `CitizenPopulation.run` as a coroutine: feeds the reports of the population in real time.
+        """
+        loop = asyncio.get_running_loop()
+        center = self.city.emergency_response
+        started = loop.time()
+        while population.active:
+            now = loop.time() - started
+            next_time = population.next_time()
+            if next_time > now:
+                await asyncio.sleep(min(next_time - now, POPULATION_WINDOW))
+                continue
+            for _, node, incident_type in zip(*population.due(now)):
+                center.report_incident(int(node), incident_type)
+        logging.info(f"All {len(population)} citizens reported their incidents")
+        center.wake()
+
+    def vehicle_dispatched(self, vehicle, incident):
+        """
+        Called by the response center when a vehicle is assigned; wakes up its coroutine.
+        """
+        self.assigned[vehicle].set()
+
+    async def vehicle(self, vehicle):
+        """
+        `EmergencyVehicle.run` as a coroutine: sleeps until an incident is assigned, attends it, and goes back to
+        sleep once home, until the vehicle is stopped.
+        """
+        assigned = self.assigned[vehicle]
+        while True:
+            await assigned.wait()
+            assigned.clear()
+            if vehicle.incident is None:
+                if vehicle.done:
+                    return
+                continue  # Assigned on the way home, already attended to
+            for delay in vehicle.attend_steps():
+                await asyncio.sleep(delay)
@@ -0,0 +1,397 @@
+import os
+import sys
+import json
+import queue
+import pickle
+import random
+import struct
+import logging
+import itertools
+import threading
+import zlib
+from models.citizen import Citizen
+from models.emergency_vehicle import EmergencyVehicle
+from models.incident import Incident
+from services.city import City
+from services.event_engine import DiscreteEventEngine
+from utils.constants import CHECKPOINT_INTERVAL
+from utils.event_log import EventLog
+from utils.export import ColumnarExport
+from utils.incident_catalog import CATALOG
+
+MAGIC = b"ERCKPT"
+CHECKPOINT_VERSION = 1
+HEADER = struct.Struct("<6sHI")  # Magic, version, length of the JSON metadata that follows
+RECORD = struct.Struct("<dQI")  # Simulated time, length and CRC-32 of the compressed state that follows
+COMPRESSION_LEVEL = 1  # zlib level: the states are mostly small integers and repeated strings, fast levels suffice
+
+
+class Checkpointer:
+    """
+    Takes periodic checkpoints of a discrete-event run, from which it can be resumed with load_checkpoint.
+
+    The checkpoints are appended to a single file: a header (magic, version and JSON metadata: the configuration of
+    the city) followed by one RECORD per checkpoint, its simulated time and the zlib-compressed pickle of the state.
+    A checkpoint holds the whole state of the engine (pending events, trips), the citizens, the vehicles, the
+    dispatch index, the response center (queue, statistics, id counter) and every random stream, but only the
+    incidents created or still open since the previous checkpoint: a resolved incident no vehicle is heading to
+    never changes again, so the checkpoints stay small however long the run.
+
+    The engine calls capture() between two events, where the state is plain data. Capturing only copies it; the
+    pickling, compression and fsync happen on a background thread while the run goes on. Every record carries a
+    CRC-32, so a checkpoint torn by a crash is ignored and the run resumes from the one before.
+
+    Attributes:
+        engine (DiscreteEventEngine): The engine being checkpointed.
+        path (str): The checkpoint file.
+        interval (float): Simulated seconds between two checkpoints.
+        next_time (float): Simulated time of the next checkpoint.
+        checkpoints (int): The number of checkpoints in the file.
+    """
+
+    def __init__(self, engine, path, interval=CHECKPOINT_INTERVAL, append=None):
+        """
+        Creates the checkpoint file, replacing any previous file at the same path, and starts the writer thread.
+
+        Args:
+            engine (DiscreteEventEngine): The engine to checkpoint. Set it as its `checkpointer` to take checkpoints.
+            path (str): The file to write.
+            interval (float, optional): Simulated seconds between two checkpoints. Defaults to CHECKPOINT_INTERVAL.
+            append (tuple, optional): (byte offset, number of checkpoints) to continue the existing file after its
+                first checkpoints instead, for an engine restored from the last of them (see load_checkpoint).
+        """
+        self.engine = engine
+        self.path = path
+        self.interval = interval
+        self.next_time = engine.now + interval
+        self.checkpoints = 0
+        self._last_id = 0  # Incidents up to this id were written by a previous checkpoint
+        self._resolved = 0  # Resolved incidents written by previous checkpoints, in order of resolution
+        self._open = set()  # Incidents that may still change after the previous checkpoint
+        if append is not None:
+            offset, self.checkpoints = append
+            self._file = open(path, "r+b")
+            self._file.seek(offset)
+            self._file.truncate()  # Drop the checkpoints taken after the one the run resumed from
+            center = engine.city.emergency_response
+            self._last_id = center.incident_id_counter
+            self._resolved = len(center.resolved_incidents)
+            self._open = open_incidents(center, center.logged_incidents)
+        else:
+            city = engine.city
+            meta = json.dumps({"epoch": engine.epoch, "seed": city.seed, "citizens": city.citizens_number,
+                               "fleets": city.fleet_sizes, "report_probability": engine.report_probability,
+                               "stations": {vehicle_type: int(node) for vehicle_type, node in city.stations.items()},
+                               "vectorized_citizens": city.vectorized_citizens, "storage_backend": city.storage_backend,
+                               "routing_backend": city.routing_backend, "event_log": city.event_log, "export": city.export,
+                               "nodes": len(city.compiled_graph), "edges": city.compiled_graph.number_of_edges}).encode()
+            self._file = open(path, "wb")
+            self._file.write(HEADER.pack(MAGIC, CHECKPOINT_VERSION, len(meta)) + meta)
+            self._file.flush()
+        self._pending = queue.Queue(maxsize=2)  # Captured states waiting to be written; full means the disk is behind
+        self._writer = threading.Thread(target=self._write, name="Checkpoint writer", daemon=True)
+        self._writer.start()
+
+    def capture(self):
+        """
+        Schedules the next checkpoint, then captures the state of the run as plain data and queues it for the writer
+        thread. Must be called between two events.
+        """
+        engine = self.engine
+        city = engine.city
+        center = city.emergency_response
+        sequence = next(engine._sequence)
+        engine._sequence = itertools.count(sequence)  # Hand out the same numbers as without the checkpoint
+        vehicles = center.police_cars + center.firetrucks + center.ambulances
+
+        changed = self._open.union(range(self._last_id + 1, center.incident_id_counter + 1))
+        incidents = [incident_state(center.logged_incidents[incident_id]) for incident_id in sorted(changed)]
+        resolved = list(itertools.islice(center.resolved_incidents, self._resolved, None))
+        self._open = open_incidents(center, changed)
+        self._last_id = center.incident_id_counter
+        self._resolved += len(resolved)
+
+        upcoming = engine.events[0][0] if engine.events else engine.now
+        while self.next_time <= upcoming:
+            self.next_time += self.interval
+        event_log = export = None
+        for recorder in center.recorders:
+            if isinstance(recorder, EventLog):
+                recorder.flush()
+                event_log = recorder.records
+            elif isinstance(recorder, ColumnarExport):
+                export = recorder.state()
+        state = {
+            "now": engine.now, "next_time": self.next_time, "processed_events": engine.processed_events,
+            "sequence": sequence, "pending_reports": engine.pending_reports, "reports_fed": engine._reports_fed,
+            "dispatching": engine.dispatching,
+            "events": [(at, order, handler.__name__, tuple(encode(arg, engine) for arg in args))
+                       for at, order, handler, args in engine.events],
+            "trips": [((vehicle.vehicle_type, vehicle.id), trip) for vehicle, trip in engine.trips.items()],
+            "random": random.getstate(),
+            "citizens": [(citizen.id, citizen.current_node, citizen.num_incidents_reported, rng_state(citizen.rng))
+                         for citizen in city.citizens],
+            "population": city.population.state() if city.population is not None else None,
+            "vehicles": [(vehicle.vehicle_type, vehicle.id, vehicle.current_node,
+                          list(vehicle.route) if vehicle.route is not None else None, vehicle.route_index,
+                          vehicle.target_node, vehicle.available, vehicle.at_home_location,
+                          vehicle.incident.id if vehicle.incident is not None else None, vehicle.done)
+                         for vehicle in vehicles],
+            "index": center.dispatch_index.state() if center.dispatch_index is not None else None,
+            "incident_id_counter": center.incident_id_counter, "rng": rng_state(center.rng),
+            "queue": center.incident_queue.state(), "active": list(center.active_incidents),
+            "resolved": resolved, "incidents": incidents, "statistics": pickle.dumps(center.statistics),
+            "event_log": event_log, "export": export,
+        }
+        self._pending.put((engine.now, state))
+        self.checkpoints += 1
+
+    def close(self):
+        """
+        Waits until every captured checkpoint is on disk and closes the file.
+        """
+        if self._writer.is_alive():
+            self._pending.put(None)
+            self._writer.join()
+        if not self._file.closed:
+            self._file.close()
+        logging.info(f"{self.checkpoints} checkpoints in {self.path}")
+
+    def _write(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            at, state = item
+            payload = zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), COMPRESSION_LEVEL)
+            self._file.write(RECORD.pack(at, len(payload), zlib.crc32(payload)) + payload)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+
+def rng_state(rng):
+    """
+    Returns the state of an agent's random stream, None for the shared `random` module (saved once per checkpoint).
+    """
+    return None if rng is random else rng.getstate()
+
+
+def open_incidents(center, candidates):
+    """
+    Returns the ids among candidates of the incidents that may still change: unresolved, queued or attended by a
+    vehicle (a vehicle reaching an incident resolved in the meantime still counts its arrival).
+    """
+    logged = center.logged_incidents
+    incidents = {incident_id for incident_id in candidates if not logged[incident_id].resolved}
+    incidents.update(incident_id for _, incident_id in center.incident_queue.state()[1])
+    for vehicle in center.police_cars + center.firetrucks + center.ambulances:
+        if vehicle.incident is not None:
+            incidents.add(vehicle.incident.id)
+    return incidents
+
+
+def incident_state(incident):
+    """
+    Returns the fields of an incident as a tuple, the inverse of restore_incident.
+    """
+    return (incident.id, incident.location, incident.incident_type, incident.type_code, incident.report_time,
+            incident.severity, incident.status, incident.resolved, list(incident.vehicles_dispatched),
+            list(incident.vehicles_needed), incident.dispatch_attempts, incident.vehicles_arrived,
+            incident.arrival_time, incident.resolve_time)
+
+
+def restore_incident(state):
+    """
+    Recreates an incident from the tuple of incident_state.
+    """
+    id, location, incident_type, type_code, report_time, severity, *fields = state
+    incident = Incident(id, location, incident_type, report_time, severity, type_code)
+    (incident.status, incident.resolved, incident.vehicles_dispatched, incident.vehicles_needed,
+     incident.dispatch_attempts, incident.vehicles_arrived, incident.arrival_time, incident.resolve_time) = fields
+    return incident
+
+
+def encode(value, engine):
+    """
+    Encodes an argument of a pending event as plain data: agents and incidents by their id, handlers of the engine
+    by their name.
+    """
+    if isinstance(value, Citizen):
+        return "citizen", value.id
+    if isinstance(value, EmergencyVehicle):
+        return "vehicle", (value.vehicle_type, value.id)
+    if isinstance(value, Incident):
+        return "incident", value.id
+    if getattr(value, "__self__", None) is engine:
+        return "handler", value.__name__
+    return "value", value
+
+
+def read_checkpoints(path):
+    """
+    Lists the complete checkpoints of a file, stopping at the first one that is truncated or corrupt.
+
+    Args:
+        path (str): The checkpoint file.
+
+    Returns:
+        tuple: The metadata of the header (dict) and a (simulated time, byte offset, length) tuple per checkpoint.
+    """
+    records = []
+    with open(path, "rb") as f:
+        magic, version, length = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != CHECKPOINT_VERSION:
+            raise ValueError(f"{path} is not a checkpoint file of version {CHECKPOINT_VERSION}")
+        meta = json.loads(f.read(length))
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                break
+            at, length, crc = RECORD.unpack(head)
+            offset = f.tell()
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                logging.warning(f"Ignoring the torn checkpoint at {round(at, 1)} s in {path}")
+                break
+            records.append((at, offset, length))
+    return meta, records
+
+
+def load_checkpoint(path, index=-1, compiled_graph=None, storage_backend=None, population_weights=None, interval=None,
+                    export=None):
+    """
+    Rebuilds a discrete-event run from one of its checkpoints, ready to continue with `run()`.
+
+    The city is deployed again with the configuration of the header, then every agent, incident and random stream
+    is set to its checkpointed state, so the resumed run processes the same events as the uninterrupted one.
+    The storage is refilled with the incidents triaged before the checkpoint, and the event log and the columnar
+    export of the run, if any, are truncated back to the checkpoint and continued.
+
+    Args:
+        path (str): The checkpoint file.
+        index (int, optional): The checkpoint to resume from, negative counting from the last. Defaults to the last.
+        compiled_graph (CompiledGraph, optional): The road network of the run. Defaults to the one of the bbox.
+        storage_backend (str, optional): Where incidents are stored. Defaults to the backend of the run.
+        population_weights (np.ndarray, optional): The population_weights of the run's City, if it had any.
+        interval (float, optional): Continue checkpointing into the same file every `interval` simulated seconds,
+            after the checkpoint resumed from. Defaults to no further checkpoints.
+        export (str, optional): The directory the columnar export of the run continues in, if it was moved.
+            Defaults to the directory of the run.
+
+    Returns:
+        DiscreteEventEngine: The engine, with its city deployed and restored.
+    """
+    meta, records = read_checkpoints(path)
+    if not records:
+        raise ValueError(f"{path} holds no complete checkpoint")
+    position = range(len(records))[index]
+
+    # The incidents are spread over the checkpoints up to the one resumed from, the rest is in that one
+    incidents, resolved = {}, []
+    with open(path, "rb") as f:
+        for _, offset, length in records[:position + 1]:
+            f.seek(offset)
+            state = pickle.loads(zlib.decompress(f.read(length)))
+            incidents.update((fields[0], fields) for fields in state["incidents"])
+            resolved.extend(state["resolved"])
+    export = export or meta.get("export")
+    if export and state.get("export") is None:
+        raise ValueError(f"{path} is of a run without a columnar export, which cannot start halfway through")
+    logging.info(f"Resuming from the checkpoint at {round(state['now'], 1)} s of {path} ({position + 1}/{len(records)})")
+
+    fleets = meta["fleets"]
+    city = City(meta["citizens"], storage_backend or meta["storage_backend"], fire_trucks=fleets["Fire-Truck"],
+                police_cars=fleets["Police-Car"], ambulances=fleets["Ambulance"], compiled_graph=compiled_graph,
+                seed=meta["seed"], stations=meta["stations"], vectorized_citizens=meta["vectorized_citizens"],
+                population_weights=population_weights, routing_backend=meta.get("routing_backend", "dijkstra"))
+    if (len(city.compiled_graph), city.compiled_graph.number_of_edges) != (meta["nodes"], meta["edges"]):
+        raise ValueError(f"{path} was taken on another road network ({meta['nodes']} nodes, {meta['edges']} edges)")
+    engine = DiscreteEventEngine(city, epoch=meta["epoch"], report_probability=meta["report_probability"])
+    center = engine.deploy()
+    city.event_log, city.export = meta["event_log"], export  # Continued below instead of replaced by deploy
+    random.setstate(state["random"])
+
+    # Response center
+    logged = {incident_id: restore_incident(incidents[incident_id]) for incident_id in sorted(incidents)}
+    center.logged_incidents = logged
+    center.active_incidents = {incident_id: logged[incident_id] for incident_id in state["active"]}
+    center.resolved_incidents = {incident_id: logged[incident_id] for incident_id in resolved}
+    center.incident_id_counter = state["incident_id_counter"]
+    center.incident_queue.restore(state["queue"])
+    if state["rng"] is not None:
+        center.rng.setstate(state["rng"])
+    statistics = pickle.loads(state["statistics"])
+    center.recorders[center.recorders.index(center.statistics)] = statistics
+    center.statistics = statistics
+    if meta["event_log"] and state["event_log"] is not None:
+        center.recorders.append(EventLog(meta["event_log"], meta["seed"], meta["epoch"], records=state["event_log"]))
+    if export:
+        center.recorders.append(ColumnarExport(export, meta["seed"], meta["epoch"], state=state["export"]))
+    for incident in logged.values():
+        if incident.dispatch_attempts:  # Stored when triaged, with the severity and needs of its type
+            severity, police_cars, firetrucks, ambulances = CATALOG.rows[incident.type_code]
+            center.sql.add_incident(incident.report_time, incident.incident_type, incident.location, severity,
+                                    police_cars, firetrucks, ambulances)
+
+    # Vehicles
+    vehicles = {(vehicle.vehicle_type, vehicle.id): vehicle
+                for vehicle in center.police_cars + center.firetrucks + center.ambulances}
+    for vehicle_type, id, node, route, route_index, target, available, at_home, incident_id, done in state["vehicles"]:
+        vehicle = vehicles[vehicle_type, id]
+        vehicle.current_node = node
+        vehicle.route, vehicle.route_index, vehicle.target_node = route, route_index, target
+        vehicle.available, vehicle.at_home_location, vehicle.done = available, at_home, done
+        vehicle.incident = logged[incident_id] if incident_id is not None else None
+    if center.dispatch_index is not None:
+        center.dispatch_index.restore(state["index"], vehicles)
+
+    # Citizens
+    citizens = {citizen.id: citizen for citizen in city.citizens}
+    remaining = {id for id, *_ in state["citizens"]}
+    for citizen in list(city.citizens):
+        if citizen.id not in remaining:
+            city.retire_citizen(citizen)
+    city.citizens = []
+    for id, node, reported, rng in state["citizens"]:
+        citizen = citizens[id]
+        citizen.current_node = node
+        citizen.num_incidents_reported = reported
+        if rng is not None:
+            citizen.rng.setstate(rng)
+        city.citizens.append(citizen)
+    if state["population"] is not None:
+        city.population.restore(state["population"])
+
+    # Engine
+    def decode(kind, value):
+        if kind == "citizen":
+            return citizens[value]
+        if kind == "vehicle":
+            return vehicles[value]
+        if kind == "incident":
+            return logged[value]
+        if kind == "handler":
+            return getattr(engine, value)
+        return value
+
+    engine.now = state["now"]
+    engine.processed_events = state["processed_events"]
+    engine.pending_reports = state["pending_reports"]
+    engine._reports_fed = state["reports_fed"]
+    engine.dispatching = state["dispatching"]
+    engine._sequence = itertools.count(state["sequence"])
+    engine.trips = {vehicles[key]: trip for key, trip in state["trips"]}
+    engine.events = [(at, order, getattr(engine, handler), tuple(decode(*arg) for arg in args))
+                     for at, order, handler, args in state["events"]]  # Still a heap: same entries, same order
+    if interval is not None:
+        _, offset, length = records[position]
+        engine.checkpointer = Checkpointer(engine, path, interval, append=(offset + length, position + 1))
+        engine.checkpointer.next_time = state["next_time"]
+    return engine
+
+
+if __name__ == '__main__':
+    header, checkpoints = read_checkpoints(sys.argv[1])
+    print(json.dumps(header))
+    for number, (simulated, start, size) in enumerate(checkpoints):
+        print(f"{number}  {round(simulated, 1)} s  {size} bytes")
@@ -1,10 +1,14 @@
-import osmnx as ox
 import threading
 from models.citizen import Citizen
+from models.population import CitizenPopulation, PopulationThread
 from models.emergency_vehicle import EmergencyVehicle
 from utils.constants import *
 from services.emergency_response_center import EmergencyResponseCenter
-import time
+from utils.graph_cache import load_graph, CompiledGraph
+from services.routing import StationRouter
+from utils.positions import AgentPositions
+from utils.event_log import EventLog
+from utils.export import ColumnarExport
 import logging
 
 
@@ -15,58 +19,168 @@ class City:
     Attributes:
     - citizens_number: The number of citizens in the city.
     - citizens: A list of Citizen objects representing the citizens in the city.
+    - population: The CitizenPopulation standing for the citizens when they are vectorized, None otherwise.
+    - population_weights: Relative population of each node, used to place the vectorized citizens.
     - firetrucks_onsite: A list of EmergencyVehicle objects representing the firetrucks currently on site.
     - police_onsite: A list of EmergencyVehicle objects representing the police cars currently on site.
     - ambulances_onsite: A list of EmergencyVehicle objects representing the ambulances currently on site.
+    - fleet_sizes: The number of vehicles of each type ("Fire-Truck", "Police-Car", "Ambulance").
+    - seed: The seed of the per-agent random streams, None for unseeded runs.
+    - event_log: The file the events of the run are logged to, None for no log.
+    - epoch: The timestamp of the start of a run on a simulated clock, set by the discrete-event engine.
+    - storage_backend: The storage the emergency response center writes incidents to ("mysql", "sqlite" or "memory").
+    - routing_backend: The point-to-point routing of the router ("dijkstra", "astar" or "ch").
     - emergency_response: An EmergencyResponseCenter object representing the emergency response center.
-    - graph: A graph representing the city's road network.
+    - compiled_graph: A CompiledGraph holding the city's road network as memory-mapped arrays.
+    - graph: A graph representing the city's road network, built from compiled_graph on first use.
+    - stations: The station node of each vehicle type ("Fire-Truck", "Police-Car", "Ambulance").
+    - positions: AgentPositions per group ("citizens", "police", "firetrucks", "ambulances") the agents publish their node to.
+    - router: A StationRouter with the shortest-path trees of the stations, built when the services are deployed.
     - fire_incidents: A list of fire incidents in the city.
     - fire_incidents_lock: A threading.Lock object for synchronizing access to the fire_incidents list.
     - police_incidents: A list of police incidents in the city.
     - police_incidents_lock: A threading.Lock object for synchronizing access to the police_incidents list.
     """
 
-    def __init__(self, citizens_number):
+    def __init__(self, citizens_number, storage_backend=STORAGE_BACKEND, fire_trucks=FIRE_TRUCKS, police_cars=POLICE_CARS,
+                 ambulances=AMBULANCES, compiled_graph=None, seed=SEED, event_log=None, graph=None, stations=None,
+                 vectorized_citizens=VECTORIZED_CITIZENS, population_weights=None, export=None,
+                 routing_backend=ROUTING_BACKEND):
         """
         Initializes a City object with the given number of citizens.
 
         Parameters:
         - citizens_number: The number of citizens in the city.
+        - storage_backend: Where incidents are stored: "mysql", "sqlite" or "memory".
+        - fire_trucks, police_cars, ambulances: The size of each fleet.
+        - compiled_graph: An already loaded CompiledGraph to share, instead of loading the one of the bbox.
+        - seed: The seed of the run. Every agent then draws from its own random stream, see utils.rng.agent_rng.
+        - event_log: A file to write the binary event log of the run to (see utils.event_log).
+        - graph: An OSMnx-compatible MultiDiGraph to use as road network, e.g. from utils.synthetic_graph.
+        - stations: The station node of each vehicle type. Defaults to the stations stored with the graph by
+          utils.synthetic_graph, or to the stations of utils.constants.
+        - vectorized_citizens: Represent the citizens as a CitizenPopulation, driven by a single thread or by the
+          discrete-event engine, instead of one Citizen thread each.
+        - population_weights: Relative population of each node of compiled_graph, for the vectorized citizens.
+          Defaults to uniform.
+        - export: A directory to stream every incident and vehicle trip to as columnar files (see utils.export).
+        - routing_backend: How routes between two nodes that are not stations are computed: "dijkstra", "astar" or
+          "ch" (see services.routing.create_backend).
         """
         self.citizens_number = citizens_number
+        self.storage_backend = storage_backend
+        self.routing_backend = routing_backend
+        self.fleet_sizes = {"Fire-Truck": fire_trucks, "Police-Car": police_cars, "Ambulance": ambulances}
+        self.seed = seed
+        self.event_log = event_log
+        self.export = export
+        self.epoch = None
         self.citizens = []
+        self.vectorized_citizens = vectorized_citizens
+        self.population_weights = population_weights
+        self.population = None
+        self._population_thread = None
         self.firetrucks_onsite = []
         self.police_onsite = []
         self.ambulances_onsite = []
         self.emergency_response = None
-        self.graph = ox.graph_from_bbox(NORTH, SOUTH, EAST, WEST, network_type='drive')
+        if graph is not None:
+            compiled_graph = CompiledGraph.from_networkx(graph)
+        self.compiled_graph = compiled_graph if compiled_graph is not None else load_graph(NORTH, SOUTH, EAST, WEST, network_type='drive')
+        self._graph = graph
+        self.stations = stations or self.compiled_graph.meta.get("stations") or \
+            {"Fire-Truck": FIRE_STATION, "Police-Car": POLICE_STATION, "Ambulance": AMBULANCE_STATION}
+        self.router = None
+        self.positions = {group: AgentPositions(self.compiled_graph) for group in ("citizens", "police", "firetrucks", "ambulances")}
         self.fire_incidents = list()
         self.fire_incidents_lock = threading.Lock()
         self.police_incidents = list()
         self.police_incidents_lock = threading.Lock()
 
-    def deploy_citizens(self):
+    @property
+    def graph(self):
+        """
+        The road network as an OSMnx MultiDiGraph, only built when a component needs the NetworkX API.
+        """
+        if self._graph is None:
+            self._graph = self.compiled_graph.to_networkx()
+        return self._graph
+
+    def deploy_citizens(self, start=True, report_probability=CITIZEN_REPORT_PROBABILITY):
         """
         Deploys the citizens in the city by creating Citizen objects and starting their threads.
+
+        Parameters:
+        - start: Whether to start the citizen threads. The discrete-event engine drives the citizens itself.
+        - report_probability: Probability that a vectorized citizen reports an incident at each step.
+        """
+        if self.vectorized_citizens:
+            self.population = CitizenPopulation(self.compiled_graph, self.citizens_number, self.seed,
+                                                self.population_weights, report_probability=report_probability,
+                                                positions=self.positions["citizens"])
+            if start:
+                self._population_thread = PopulationThread(self.population, self.emergency_response)
+                self._population_thread.start()
+        else:
+            for i in range(self.citizens_number):
+                citizen = Citizen(i, self._graph, self.emergency_response, self)
+                citizen.attach_positions(self.positions["citizens"])
+                self.citizens.append(citizen)
+                citizen.name = "Citizen " + str(citizen.id)
+                if start:
+                    citizen.start()
+        if self.emergency_response is not None:
+            self.emergency_response.wake()
+
+    def has_active_citizens(self):
+        """
+        Returns whether some citizens may still report incidents.
+        """
+        if self._population_thread is not None:
+            return not self._population_thread.finished.is_set()  # Set once its last report was delivered
+        return bool(self.citizens) or (self.population is not None and self.population.active > 0)
+
+    def retire_citizen(self, citizen):
         """
-        for i in range(self.citizens_number):
-            citizen = Citizen(i, self.graph, self.emergency_response, self)
-            self.citizens.append(citizen)
-            citizen.name = "Citizen " + str(citizen.id)
-            citizen.start()
+        Removes a citizen that reported all its incidents from the city.
 
-    def deploy_emergency_services(self):
+        Parameters:
+        - citizen: The Citizen object to remove.
+        """
+        citizen.detach_positions()
+        self.citizens.remove(citizen)
+        if self.emergency_response is not None:
+            self.emergency_response.wake()
+
+    def deploy_emergency_services(self, start=True):
         """
         Deploys the emergency services in the city by creating EmergencyVehicle objects and starting their threads.
+
+        Parameters:
+        - start: Whether to start the vehicle and response center threads. The discrete-event engine drives them itself.
         """
+        # Precompute the routes from and to every station once, every dispatch then only reads them
+        self.router = StationRouter(self.compiled_graph, list(dict.fromkeys(self.stations.values())),
+                                    self.routing_backend)
+
         # First, initialize the lists for firetrucks and police cars
-        self.firetrucks_onsite = [EmergencyVehicle(i, self.graph, "Fire-Truck", FIRE_STATION) for i in range(FIRE_TRUCKS)]
-        self.police_onsite = [EmergencyVehicle(i, self.graph, "Police-Car", POLICE_STATION) for i in range(POLICE_CARS)]
-        self.ambulances_onsite = [EmergencyVehicle(i, self.graph, "Ambulance", AMBULANCE_STATION) for i in range(AMBULANCES)]
+        # Vehicles route with the router, so the NetworkX graph is only handed over if something already built it
+        self.firetrucks_onsite = [EmergencyVehicle(i, self._graph, "Fire-Truck", self.stations["Fire-Truck"], self.router) for i in range(self.fleet_sizes["Fire-Truck"])]
+        self.police_onsite = [EmergencyVehicle(i, self._graph, "Police-Car", self.stations["Police-Car"], self.router) for i in range(self.fleet_sizes["Police-Car"])]
+        self.ambulances_onsite = [EmergencyVehicle(i, self._graph, "Ambulance", self.stations["Ambulance"], self.router) for i in range(self.fleet_sizes["Ambulance"])]
+        for group, vehicles in (("firetrucks", self.firetrucks_onsite), ("police", self.police_onsite), ("ambulances", self.ambulances_onsite)):
+            for vehicle in vehicles:
+                vehicle.attach_positions(self.positions[group])
         
         # Now you can pass these lists to the EmergencyResponseCenter
         self.emergency_response = EmergencyResponseCenter(self.firetrucks_onsite, self.police_onsite, self.ambulances_onsite, self)
         self.emergency_response.name = "Emergency Response Center"
+        if self.event_log:
+            self.emergency_response.recorders.append(EventLog(self.event_log, self.seed, self.epoch))
+        if self.export:
+            self.emergency_response.recorders.append(ColumnarExport(self.export, self.seed, self.epoch))
+        if not start:
+            return
         self.emergency_response.start()
 
         # Start the firetrucks and police cars threads
@@ -94,33 +208,28 @@ class City:
         Shuts down the city by stopping all threads and performing cleanup tasks.
         """
         logging.info("CITY SHUTTING DOWN")
+        if self._population_thread is not None:
+            self._population_thread.stop()
+            self._population_thread.join()
         self.emergency_response.sql.add_data()
-        self.emergency_response.sql.write_to_file()
-        
-        time.sleep(5)
-        # Join all threads once every vehicle is done with its job
+        self.emergency_response.write_statistics()
 
-        while self.emergency_response.active_incidents:
-            logging.info(f"Waiting for {self.emergency_response.active_incidents} incidents to be resolved")
-            time.sleep(0.1)
+        # Join all threads once every vehicle is done with its job
+        if self.emergency_response.active_incidents:
+            logging.info(f"Waiting for {len(self.emergency_response.active_incidents)} incidents to be resolved")
+        self.emergency_response.wait_idle()
         
         logging.info("All incidents resolved, shutting down threads")
 
-        while self.firetrucks_onsite or self.police_onsite or self.ambulances_onsite:
-
-            for firetruck in self.firetrucks_onsite:
-                firetruck.done = True
-                firetruck.join()
-                self.firetrucks_onsite.remove(firetruck)
-            
-            for police_car in self.police_onsite:
-                police_car.done = True
-                police_car.join()
-                self.police_onsite.remove(police_car)
-            
-            for ambulance in self.ambulances_onsite:
-                ambulance.done = True
-                ambulance.join()
-                self.ambulances_onsite.remove(ambulance)
-
-        logging.info("All vehicles are shut down, shutting down Emergency Response Center")
\ No newline at end of file
+        # Stop every vehicle first so they all finish their way home in parallel, then join them
+        vehicles = self.firetrucks_onsite + self.police_onsite + self.ambulances_onsite
+        for vehicle in vehicles:
+            vehicle.stop()
+        for vehicle in vehicles:
+            vehicle.join()
+        self.firetrucks_onsite.clear()
+        self.police_onsite.clear()
+        self.ambulances_onsite.clear()
+
+        logging.info("All vehicles are shut down, shutting down Emergency Response Center")
+        self.emergency_response.close()
\ No newline at end of file
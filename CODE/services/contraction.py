@@ -0,0 +1,352 @@
+import os
+import sys
+import json
+import time
+import heapq
+import shutil
+import logging
+import importlib
+import numpy as np
+from utils.graph_cache import GRAPH_CACHE_DIR, load_graph, graph_digest
+
+INFINITY = float('inf')
+HIERARCHY_VERSION = 2
+WITNESS_SETTLED = 64  # Nodes a witness search settles at most; stopping early only costs superfluous shortcuts
+TIE_TOLERANCE = 1e-9  # Relative difference under which a witness counts as long as the route through the node
+ARRAYS = ("up_indptr", "up_indices", "up_lengths", "up_via", "down_indptr", "down_indices", "down_lengths", "down_via")
+
+
+def contract(graph):
+    """
+    Builds the contraction hierarchy of a compiled graph.
+
+    Nodes are contracted one by one, least important first: a node is removed from the graph and, for every pair of
+    neighbors whose only shortest route went through it, a shortcut edge remembering the node is added. A bounded
+    Dijkstra search (the witness search) tells whether another route is as short, up to rounding (TIE_TOLERANCE).
+    The importance of a node is the number of shortcuts its contraction adds minus the edges it removes, plus the
+    neighbors already contracted and its depth in the hierarchy, so contraction spreads evenly over the graph. When
+    a neighbor is contracted only the last two terms are updated; the shortcuts are counted again when the node
+    comes out of the queue, and the node goes back in if it is no longer the least important.
+
+    Args:
+        graph (CompiledGraph): The road network.
+
+    Returns:
+        dict: Name in ARRAYS -> array. Row v of the "up" CSR holds the edges from v to the nodes contracted after
+        it, row v of the "down" CSR the edges into v from them; "via" is the node a shortcut skips, -1 for a road.
+    """
+    n = len(graph)
+    indptr, indices, lengths = graph.indptr.tolist(), graph.indices.tolist(), graph.lengths.tolist()
+    out = [{} for _ in range(n)]  # Node -> {neighbor: length} over the nodes not contracted yet
+    inc = [{} for _ in range(n)]
+    via = {}  # (from, to) -> the node a shortcut skips; roads are not in it
+    for u in range(n):
+        for edge in range(indptr[u], indptr[u + 1]):
+            v = indices[edge]
+            if v != u and lengths[edge] < out[u].get(v, INFINITY):  # A loop is never part of a shortest route
+                out[u][v] = inc[v][u] = lengths[edge]
+    heappush, heappop = heapq.heappush, heapq.heappop
+
+    def witness(source, skipped, targets, limit):
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        remaining, settled = len(targets), 0
+        while heap and remaining:
+            d, u = heappop(heap)
+            if d > dist[u]:
+                continue
+            if settled == WITNESS_SETTLED:
+                break
+            settled += 1
+            if u in targets:
+                remaining -= 1
+            for v, length in out[u].items():
+                candidate = d + length
+                if candidate <= limit and v != skipped and candidate < dist.get(v, INFINITY):
+                    dist[v] = candidate
+                    heappush(heap, (candidate, v))
+        return dist
+
+    def shortcuts(v):
+        found = []
+        targets = out[v]
+        if not targets:
+            return found
+        longest = max(targets.values())
+        for u, to_v in inc[v].items():
+            dist = witness(u, v, targets, (to_v + longest) * (1 + TIE_TOLERANCE))
+            for w, from_v in targets.items():
+                if w != u and dist.get(w, INFINITY) > (to_v + from_v) * (1 + TIE_TOLERANCE):
+                    found.append((u, w, to_v + from_v))
+        return found
+
+    level = [0] * n
+    neighbors_contracted = [0] * n
+    added = [0] * n  # Shortcuts the contraction of each node adds, as of its last evaluation
+
+    def importance(v, found=None):
+        # Edge difference, plus contracted neighbors and depth so that contraction spreads evenly over the graph
+        if found is not None:
+            added[v] = len(found)
+        return added[v] - (len(inc[v]) + len(out[v])) + neighbors_contracted[v] + level[v]
+
+    started = time.time()
+    priority = [importance(v, shortcuts(v)) for v in range(n)]
+    queue = [(p, v) for v, p in enumerate(priority)]
+    heapq.heapify(queue)
+    up, down = [None] * n, [None] * n
+    contracted = 0
+    while queue:
+        p, v = heappop(queue)
+        if up[v] is not None or p != priority[v]:
+            continue  # Contracted, or queued again since
+        found = shortcuts(v)
+        priority[v] = importance(v, found)
+        if queue and priority[v] > queue[0][0]:
+            heappush(queue, (priority[v], v))
+            continue
+        up[v] = [(w, length, via.get((v, w), -1)) for w, length in out[v].items()]
+        down[v] = [(u, length, via.get((u, v), -1)) for u, length in inc[v].items()]
+        for w in out[v]:
+            del inc[w][v]
+        for u in inc[v]:
+            del out[u][v]
+        for u, w, length in found:
+            if length < out[u].get(w, INFINITY):
+                out[u][w] = inc[w][u] = length
+                via[u, w] = v
+        neighbors = set(out[v]) | set(inc[v])
+        out[v] = inc[v] = None
+        for neighbor in neighbors:
+            neighbors_contracted[neighbor] += 1
+            level[neighbor] = max(level[neighbor], level[v] + 1)
+            priority[neighbor] = importance(neighbor)  # Its shortcuts are counted again when it comes out
+            heappush(queue, (priority[neighbor], neighbor))
+        contracted += 1
+        if contracted % 100000 == 0:
+            logging.info(f"Contracted {contracted} of {n} nodes in {round(time.time() - started)} s")
+
+    arrays = {}
+    for name, rows in (("up", up), ("down", down)):
+        sizes = np.fromiter((len(row) for row in rows), dtype=np.int64, count=n)
+        arrays[name + "_indptr"] = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+        edges = [edge for row in rows for edge in row]
+        arrays[name + "_indices"] = np.fromiter((edge[0] for edge in edges), dtype=np.int64, count=len(edges))
+        arrays[name + "_lengths"] = np.fromiter((edge[1] for edge in edges), dtype=np.float64, count=len(edges))
+        arrays[name + "_via"] = np.fromiter((edge[2] for edge in edges), dtype=np.int64, count=len(edges))
+    return arrays
+
+
+class ContractionHierarchy:
+    """
+    Point-to-point routing over a contraction hierarchy (see contract), a routing backend like Dijkstra and
+    BidirectionalAStar of services.routing.
+
+    A query runs two Dijkstra searches that only climb the hierarchy: forward from the origin along the "up" edges
+    and backward from the destination along the "down" edges. Every shortest route has a highest node both reach,
+    so each search only settles a few hundred nodes even on a continental network. The shortcuts of the route are
+    then unpacked back into roads.
+
+    The arrays stay as loaded, memory-mapped from the cache and shared by every process mapping it; the row of a
+    node is only converted to Python lists, for fast iteration, the first time a query reaches it.
+
+    Attributes:
+        graph (CompiledGraph): The road network.
+        meta (dict): Digest of the graph, counts of nodes and edges, and preprocessing time.
+        arrays (dict): Name in ARRAYS -> array (see contract).
+    """
+
+    def __init__(self, graph, arrays, meta):
+        self.graph = graph
+        self.meta = meta
+        self.arrays = arrays
+        self._csr = tuple(tuple(arrays[prefix + name] for name in ("indptr", "indices", "lengths", "via"))
+                          for prefix in ("up_", "down_"))
+        self._rows = ({}, {})  # Node -> (neighbors, lengths, via) of the up and down rows converted so far
+        self._halves = {}  # Shortcut -> what its two halves skip, found once
+
+    @classmethod
+    def build(cls, graph):
+        """
+        Preprocesses a compiled graph.
+
+        Returns:
+            ContractionHierarchy: The hierarchy.
+        """
+        started = time.time()
+        arrays = contract(graph)
+        meta = {"digest": graph_digest(graph), "nodes": len(graph), "edges": graph.number_of_edges,
+                "shortcuts": int((arrays["up_via"] >= 0).sum() + (arrays["down_via"] >= 0).sum()),
+                "seconds": round(time.time() - started, 1), "version": HIERARCHY_VERSION}
+        return cls(graph, arrays, meta)
+
+    def save(self, path):
+        """
+        Writes the hierarchy as one .npy file per array plus a meta.json, replacing any previous version atomically.
+
+        Args:
+            path (str): The directory to write to.
+        """
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in ARRAYS:
+            np.save(os.path.join(tmp_path, name + ".npy"), self.arrays[name])
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=2)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, graph):
+        """
+        Loads a hierarchy written by `save`.
+
+        Args:
+            path (str): The directory the hierarchy was saved to.
+            graph (CompiledGraph): The road network it was built from.
+
+        Returns:
+            ContractionHierarchy: The hierarchy.
+        """
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode='r') for name in ARRAYS}
+        return cls(graph, arrays, meta)
+
+    def distance(self, source, target):
+        """
+        Returns the length of the shortest route between two node indices, inf if unreachable, without unpacking it.
+        """
+        return self._search(source, target)[0]
+
+    def route(self, source, target):
+        """
+        Returns the shortest route between two node indices (see services.routing.Dijkstra.route).
+        """
+        best, meeting, forward, backward = self._search(source, target)
+        if meeting < 0:
+            return best, [source] if source == target else None
+        edges = []  # (from, to, via) of the route through the hierarchy, in order
+        node = meeting
+        while forward[node][0] >= 0:
+            previous, skipped = forward[node]
+            edges.append((previous, node, skipped))
+            node = previous
+        edges.reverse()
+        node = meeting
+        while backward[node][0] >= 0:
+            following, skipped = backward[node]
+            edges.append((node, following, skipped))
+            node = following
+        path = [source]
+        for edge in edges:
+            self._unpack(edge, path)
+        return best, path
+
+    def _row(self, side, node):
+        """
+        Returns the neighbors, lengths and skipped nodes of a node's "up" (side 0) or "down" (side 1) edges.
+        """
+        row = self._rows[side].get(node)
+        if row is None:
+            indptr, indices, lengths, via = self._csr[side]
+            start, end = int(indptr[node]), int(indptr[node + 1])
+            row = self._rows[side][node] = (indices[start:end].tolist(), lengths[start:end].tolist(),
+                                            via[start:end].tolist())
+        return row
+
+    def _search(self, source, target):
+        """
+        Runs the two upward searches and returns the length of the route, the node where they meet (-1 if they do
+        not) and the links of both searches.
+        """
+        if source == target:
+            return 0.0, -1, None, None
+        searches = ((0, {source: 0.0}, {source: (-1, -1)}, [(0.0, source)]),
+                    (1, {target: 0.0}, {target: (-1, -1)}, [(0.0, target)]))
+        best, meeting = INFINITY, -1
+        while True:
+            forward = searches[0][3][0][0] if searches[0][3] else INFINITY
+            backward = searches[1][3][0][0] if searches[1][3] else INFINITY
+            if min(forward, backward) >= best:
+                break  # Neither search can reach a shorter route: each stops once its smallest key reaches it
+            side, dist, links, heap = searches[0 if forward <= backward else 1]
+            other = searches[1 - side][1]
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            # Stall on demand: a higher node already reached reaches u shorter, so the search need not go on from u
+            stall_indices, stall_lengths, _ = self._row(1 - side, u)
+            for w, length in zip(stall_indices, stall_lengths):
+                if dist.get(w, INFINITY) + length < d:
+                    break
+            else:
+                indices, lengths, via = self._row(side, u)
+                for v, length, skipped in zip(indices, lengths, via):
+                    candidate = d + length
+                    if candidate < dist.get(v, INFINITY):
+                        dist[v] = candidate
+                        links[v] = (u, skipped)
+                        heapq.heappush(heap, (candidate, v))
+                        if v in other and candidate + other[v] < best:
+                            best, meeting = candidate + other[v], v
+        return best, meeting, searches[0][2], searches[1][2]
+
+    def _unpack(self, edge, path):
+        """
+        Appends the nodes of an edge of the hierarchy after its first one, replacing shortcuts by the roads they skip.
+        """
+        stack = [edge]
+        while stack:
+            start, end, skipped = stack.pop()
+            if skipped < 0:
+                path.append(end)
+                continue
+            # The skipped node was contracted before both ends: start -> skipped is a "down" edge of it and
+            # skipped -> end an "up" edge
+            halves = self._halves.get((start, end, skipped))
+            if halves is None:
+                halves = self._halves[start, end, skipped] = (self._via(1, skipped, start), self._via(0, skipped, end))
+            stack.append((skipped, end, halves[1]))
+            stack.append((start, skipped, halves[0]))
+
+    def _via(self, side, node, neighbor):
+        indices, _, via = self._row(side, node)
+        return via[indices.index(neighbor)]
+
+
+def load_hierarchy(graph, cache_dir=GRAPH_CACHE_DIR):
+    """
+    Returns the contraction hierarchy of a compiled graph, preprocessing it on the first call only and keeping it
+    next to the compiled graphs.
+
+    Args:
+        graph (CompiledGraph): The road network.
+        cache_dir (str, optional): Where hierarchies are stored. Defaults to GRAPH_CACHE_DIR.
+
+    Returns:
+        ContractionHierarchy: The hierarchy.
+    """
+    digest = graph_digest(graph)
+    path = os.path.join(cache_dir, f"hierarchy_{digest}")
+    meta_path = os.path.join(path, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f).get("version") == HIERARCHY_VERSION:
+                return ContractionHierarchy.load(path, graph)
+    logging.info(f"Building the contraction hierarchy of {len(graph)} nodes, once")
+    hierarchy = ContractionHierarchy.build(graph)
+    os.makedirs(cache_dir, exist_ok=True)
+    hierarchy.save(path)
+    logging.info(f"Cached contraction hierarchy with {hierarchy.meta['shortcuts']} shortcuts, built in "
+                 f"{hierarchy.meta['seconds']} s, in {path}")
+    return hierarchy
+
+
+if __name__ == '__main__':
+    # Builds the hierarchies for scenario modules, e.g. `python -m services.contraction utils.constants utils.Mexico`
+    logging.basicConfig(level=logging.INFO)
+    for module_name in sys.argv[1:] or ["utils.constants", "utils.Mexico"]:
+        scenario = importlib.import_module(module_name)
+        load_hierarchy(load_graph(scenario.NORTH, scenario.SOUTH, scenario.EAST, scenario.WEST))
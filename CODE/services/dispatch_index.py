@@ -0,0 +1,190 @@
+import heapq
+import itertools
+import threading
+
+
+class DispatchIndex:
+    """
+    Tracks the available emergency vehicles by type and by the node they are on.
+
+    Idle vehicles wait at their station, so most of a fleet shares a handful of nodes and their route
+    length to an incident is read off the station's precomputed tree in O(1). Vehicles available on their way
+    home are found by expanding a Dijkstra search backwards from the incident, which stops as soon as it
+    cannot beat the k best candidates already known. A query therefore depends on the number of occupied
+    nodes and on k, not on the size of the fleet.
+
+    The index is also the pool of free vehicles: it counts the vehicles of each type it holds, so the
+    availability of a fleet is read in O(1), and a vehicle is claimed for a dispatch by atomically taking it out.
+
+    Attributes:
+        router (StationRouter): Routing used to measure the route length from a vehicle to an incident.
+        lock (threading.RLock): Lock protecting the index.
+    """
+
+    def __init__(self, router, vehicles=()):
+        """
+        Initializes the index and registers the vehicles that are currently available.
+
+        Args:
+            router (StationRouter): Routing with the trees of the vehicles' stations.
+            vehicles (iterable, optional): Vehicles to track. Defaults to none.
+        """
+        self.router = router
+        self.lock = threading.RLock()
+        self._nodes = {}  # vehicle_type -> {node: {vehicle: None}}, dicts used as insertion-ordered sets
+        self._located = {}  # vehicle -> node it is registered at
+        self._free = {}  # vehicle_type -> number of vehicles registered
+        for vehicle in vehicles:
+            vehicle.dispatch_index = self
+            if vehicle.available:
+                self.add(vehicle)
+
+    def add(self, vehicle):
+        """
+        Registers an available vehicle at its current node.
+        """
+        with self.lock:
+            self.remove(vehicle)
+            self._nodes.setdefault(vehicle.vehicle_type, {}).setdefault(vehicle.current_node, {})[vehicle] = None
+            self._located[vehicle] = vehicle.current_node
+            self._free[vehicle.vehicle_type] = self._free.get(vehicle.vehicle_type, 0) + 1
+
+    def remove(self, vehicle):
+        """
+        Unregisters a vehicle, typically because it was dispatched. Does nothing if it is not registered.
+        """
+        with self.lock:
+            node = self._located.pop(vehicle, None)
+            if node is None:
+                return
+            nodes = self._nodes[vehicle.vehicle_type]
+            del nodes[node][vehicle]
+            if not nodes[node]:
+                del nodes[node]
+            self._free[vehicle.vehicle_type] -= 1
+
+    def claim(self, vehicle):
+        """
+        Takes a vehicle out of the pool for a dispatch.
+
+        Returns:
+            bool: True if the vehicle was free and is now claimed, False if it was not in the pool.
+        """
+        with self.lock:
+            if vehicle not in self._located:
+                return False
+            self.remove(vehicle)
+            return True
+
+    def available(self, vehicle_type):
+        """
+        Returns the number of free vehicles of a type.
+        """
+        return self._free.get(vehicle_type, 0)
+
+    def availability(self, vehicle_types):
+        """
+        Returns the number of free vehicles of several types, read together as one consistent snapshot.
+
+        Args:
+            vehicle_types (iterable): The vehicle types.
+
+        Returns:
+            tuple: The number of free vehicles of each type.
+        """
+        with self.lock:
+            return tuple(self._free.get(vehicle_type, 0) for vehicle_type in vehicle_types)
+
+    def relocate(self, vehicle, previous_node):
+        """
+        Moves a registered vehicle from previous_node to its current node. Vehicles that were dispatched in the
+        meantime are left out.
+        """
+        with self.lock:
+            if self._located.get(vehicle) == previous_node:
+                self.add(vehicle)
+
+    def state(self):
+        """
+        Returns the registered vehicles as plain data, for checkpoints.
+
+        Returns:
+            list: (vehicle type, node, ids of the vehicles registered there) per occupied node, in the order
+            nearest() visits them.
+        """
+        with self.lock:
+            return [(vehicle_type, node, [vehicle.id for vehicle in vehicles])
+                    for vehicle_type, nodes in self._nodes.items() for node, vehicles in nodes.items()]
+
+    def restore(self, state, vehicles):
+        """
+        Replaces the registered vehicles with a state returned by state().
+
+        Args:
+            state (list): The state.
+            vehicles (dict): (vehicle type, id) -> vehicle.
+        """
+        with self.lock:
+            self._nodes, self._located, self._free = {}, {}, {}
+            for vehicle_type, node, ids in state:
+                registered = self._nodes.setdefault(vehicle_type, {}).setdefault(node, {})
+                for vehicle_id in ids:
+                    vehicle = vehicles[vehicle_type, vehicle_id]
+                    registered[vehicle] = None
+                    self._located[vehicle] = node
+                    self._free[vehicle_type] = self._free.get(vehicle_type, 0) + 1
+
+    def nearest(self, vehicle_type, node, k):
+        """
+        Returns the k available vehicles of a type with the shortest route to a node.
+
+        Args:
+            vehicle_type (str): The type of vehicle ("Police-Car", "Fire-Truck", "Ambulance").
+            node (int): OSM id of the incident location.
+            k (int): The number of vehicles wanted.
+
+        Returns:
+            list: Up to k (route length, vehicle) pairs, closest first.
+        """
+        if k <= 0:
+            return []
+        with self.lock:
+            nodes = self._nodes.get(vehicle_type, {})
+            best = []  # Max-heap of the k best candidates as (-length, -arrival order, vehicle)
+            order = itertools.count()
+            roaming = set()
+            for vehicle_node, vehicles in nodes.items():
+                if not self.router.is_station(vehicle_node):
+                    roaming.add(vehicle_node)
+                    continue
+                length = self.router.distance(vehicle_node, node)
+                for vehicle in vehicles:
+                    if not self._offer(best, k, length, vehicle, order):
+                        break
+
+            # Expand backwards from the incident until the remaining vehicles cannot beat the current k best
+            if roaming:
+                for length, reached in self.router.nodes_by_distance_to(node):
+                    if len(best) == k and length >= -best[0][0]:
+                        break
+                    if reached in roaming:
+                        roaming.discard(reached)
+                        for vehicle in nodes[reached]:
+                            if not self._offer(best, k, length, vehicle, order):
+                                break
+                        if not roaming:
+                            break
+            return [(-length, vehicle) for length, _, vehicle in sorted(best, reverse=True)]
+
+    def _offer(self, best, k, length, vehicle, order):
+        """
+        Adds a candidate to the bounded heap of best candidates. Returns False if it was too far to be kept.
+        """
+        entry = (-length, -next(order), vehicle)
+        if len(best) < k:
+            heapq.heappush(best, entry)
+            return True
+        if length < -best[0][0]:
+            heapq.heapreplace(best, entry)
+            return True
+        return False
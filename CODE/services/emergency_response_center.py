@@ -1,10 +1,13 @@
 import threading
-from queue import PriorityQueue
 import time
-import random
 from models.incident import Incident
-from utils.constants import INCIDENTS
+from utils.incident_catalog import CATALOG
 from utils.add_sql import sql
+from services.dispatch_index import DispatchIndex
+from utils.incident_queue import IncidentQueue
+from utils.constants import SQL_CROSS_CHECK
+from services.statistics import IncidentStatistics
+from utils.rng import agent_rng
 import logging
 
 class EmergencyResponseCenter(threading.Thread):
@@ -30,7 +33,8 @@ class EmergencyResponseCenter(threading.Thread):
             raise Exception("This class is a singleton!")
         else:
             super().__init__()
-            self.incident_queue = PriorityQueue()
+            self.clock = time.time  # Source of timestamps, replaced by the discrete-event engine
+            self.incident_queue = IncidentQueue(clock=lambda: self.clock())  # Ages with whatever clock is in use
             self.firetrucks = firetrucks
             self.police_cars = police_cars
             self.ambulances = ambulances
@@ -46,89 +50,190 @@ class EmergencyResponseCenter(threading.Thread):
             }
             self._instance = self
             self.city = city
-            self.sql = sql()
+            self.sql = sql(city.storage_backend)
+            self.on_dispatch = None  # Optional callback(vehicle, incident) fired when a vehicle is assigned
+            # Index of the available vehicles by position, used to send the closest ones
+            self.dispatch_index = DispatchIndex(city.router, firetrucks + police_cars + ambulances) if city.router else None
+            self.statistics = IncidentStatistics()  # Live statistics of the run, written to output.txt at the end
+            self.recorders = [self.statistics]  # Everything fed with the events of notify()
+            self.rng = agent_rng(city.seed, "center")
+            self.wakeup = threading.Event()  # Set whenever the dispatcher may have something to do
+            self.idle = threading.Condition(self.locks["active_incidents"])  # Notified when no incident is active
+            for vehicle in firetrucks + police_cars + ambulances:
+                vehicle.center = self
 
     def run(self):
         """
         Starts the Emergency Response Center and listens to the incident queue.
         """
         logging.info("Emergency Response Center activated")
-        while self.city.citizens == []:
-            time.sleep(0.2)
+        while not self.city.has_active_citizens():
+            self.wakeup.wait()
+            self.wakeup.clear()
         self.queue_listener()
 
+    def wake(self):
+        """
+        Wakes up the dispatcher: an incident was reported, resolved, a vehicle became available or a citizen left.
+        """
+        self.wakeup.set()
+
+    def wait_idle(self, timeout=None):
+        """
+        Blocks until no incident is active.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to no limit.
+
+        Returns:
+            bool: True if no incident is active, False if the timeout expired first.
+        """
+        with self.idle:
+            return self.idle.wait_for(lambda: not self.active_incidents, timeout)
+
     def queue_listener(self):
         """
         Listens to the incident queue and dispatches vehicles to handle the incidents.
         Continues processing until there are no more citizens or active incidents.
+        The dispatcher sleeps until it is woken up, and only loops right away while it keeps dispatching vehicles.
+        """
+        while True:
+            self.wakeup.clear()  # Before checking, so a citizen leaving right after the check still wakes us up
+            if not self.city.has_active_citizens() and self.active_incidents == {}:
+                break
+            if self.process_incidents() and not self.incident_queue.empty():
+                continue  # More than one pass worth of incidents can be served now
+            self.wakeup.wait()
+
+        logging.info("All citizens are done, shutting down Emergency Response Center")
+        self.city.shutdown()
+
+    def process_incidents(self):
+        """
+        Runs one pass of the dispatcher: dispatches up to 5 queued incidents and
+        moves the resolved ones from active_incidents to resolved_incidents.
+
+        Returns:
+            int: The number of vehicles dispatched.
         """
-        while self.city.citizens != [] or not self.active_incidents == {}:
-            try:
+        dispatched = 0
+        try:
+            with self.locks['incident_queue']:
+                incidents_to_process = min(5, len(self.incident_queue))  # Process up to 5 incidents
+
+                for _ in range(incidents_to_process):
+                    if not self.incident_queue.empty():
+                        priority, incident_id = self.incident_queue.pop()
+                        with self.locks['active_incidents'] and self.locks['logged_incidents']:
+                            incident = self.active_incidents[incident_id] if incident_id in self.active_incidents else self.logged_incidents[incident_id]
+                        dispatched += self.dispatch_vehicles(incident, priority)
+        except Exception as e:
+            logging.error(f"There was an ERROR: {e}")
+
+        with self.locks['active_incidents']:
+            incidents_to_remove = []
+            for incident_id, incident in self.active_incidents.items():
+                if incident.resolved:
+                    incidents_to_remove.append(incident_id)
+                    self.resolved_incidents[incident_id] = incident
+                    # logging.info(f"Resolved incident {incident_id} and removed it from active incidents")
+            # Remove the resolved incidents from active_incidents
+            for incident_id in incidents_to_remove:
+                self.active_incidents.pop(incident_id)
                 with self.locks['incident_queue']:
-                    incidents_to_process = min(5, self.incident_queue.qsize())  # Process up to 5 incidents
+                    self.incident_queue.cancel(incident_id)
+                    # logging.info(f"Removed incident {incident_id} from incident queue as it is resolved")
+            if incidents_to_remove and not self.active_incidents:
+                self.idle.notify_all()
+        return dispatched
 
-                    for _ in range(incidents_to_process):
-                        if not self.incident_queue.empty():
-                            priority, incident_id = self.incident_queue.get()
-                            with self.locks['active_incidents'] and self.locks['logged_incidents']:
-                                incident = self.active_incidents[incident_id] if incident_id in self.active_incidents else self.logged_incidents[incident_id]
-                            self.dispatch_vehicles(incident, priority)
-            except Exception as e:
-                logging.error(f"There was an ERROR: {e}")
+    def can_serve_queue(self):
+        """
+        Tells whether a queued incident still needs a type of vehicle the center has, so it is sent one sooner or
+        later. An incident needing only types the center has no vehicle of can never be served here.
 
-            with self.locks['active_incidents']:
-                incidents_to_remove = []
-                for incident_id, incident in self.active_incidents.items():
-                    if incident.resolved:
-                        incidents_to_remove.append(incident_id)
-                        self.resolved_incidents[incident_id] = incident
-                        # logging.info(f"Resolved incident {incident_id} and removed it from active incidents")
-                # Remove the resolved incidents from active_incidents
-                for incident_id in incidents_to_remove:
-                    self.active_incidents.pop(incident_id)
-                    with self.locks['incident_queue']:
-                        if (priority, incident_id) in self.incident_queue.queue:
-                            self.incident_queue.queue.remove((priority, incident_id))
-                            # logging.info(f"Removed incident {incident_id} from incident queue as it is resolved")
-
-            self.update_priorities()
-            time.sleep(0.1)
+        Returns:
+            bool: True if the dispatcher still has to serve queued incidents.
+        """
+        fleets = (len(self.police_cars), len(self.firetrucks), len(self.ambulances))
+        with self.locks["incident_queue"]:
+            queued = self.incident_queue.snapshot()
+        with self.locks["logged_incidents"]:
+            incidents = [self.logged_incidents.get(incident_id) for _, incident_id in queued]
+        return any(incident is not None and any(needed and fleet for needed, fleet in zip(incident.vehicles_needed, fleets))
+                   for incident in incidents)
 
-        logging.info("All citizens are done, shutting down Emergency Response Center")
-        self.city.shutdown()
+    def notify(self, event, incident, vehicle=None):
+        """
+        Timestamps an event of the run and forwards it to the recorders (statistics...).
+
+        Args:
+            event (str): "report", "triage" (first dispatch attempt), "dispatch", "arrival", "resolve" or "return".
+            incident (Incident): The incident concerned, None for "return".
+            vehicle (EmergencyVehicle, optional): The vehicle concerned.
+        """
+        now = self.clock()
+        if event == "arrival":
+            incident.vehicles_arrived += 1
+            if incident.arrival_time is None:
+                incident.arrival_time = now
+        elif event == "resolve":
+            incident.resolve_time = now
+        for recorder in self.recorders:
+            recorder.record(event, now, incident, vehicle)
+        if event in ("report", "resolve", "return"):
+            self.wake()
+
+    def write_statistics(self):
+        """
+        Writes the statistics of the run to output.txt, and the same statistics computed by SQL to output_sql.txt
+        when SQL_CROSS_CHECK is set.
+        """
+        self.statistics.write_to_file('output.txt')
+        if SQL_CROSS_CHECK:
+            self.sql.add_data()
+            self.sql.write_to_file('output_sql.txt')
 
-    def update_priorities(self):
+    def close(self):
         """
-        Updates the priorities of the incidents in the incident queue.
+        Closes the storage and the recorders that write to a file, once the run is over.
         """
-        with self.locks['incident_queue']:
-            updated_incidents = []
-            while not self.incident_queue.empty():
-                priority, incident_id = self.incident_queue.get()
-                if priority > 0:
-                    priority = round(priority - 0.1, 2)
-                updated_incidents.append((priority, incident_id))  # Increase priority
+        self.sql.close()
+        for recorder in self.recorders:
+            if hasattr(recorder, "close"):
+                recorder.close()
 
-            # Put the updated incidents back in the queue
-            for incident in updated_incidents:
-                self.incident_queue.put(incident)
+    @staticmethod
+    def draw_incident_type(rng):
+        """
+        Draws the type of a new incident according to the probabilities in INCIDENTS, from the alias table of
+        the incident catalog.
+
+        Args:
+            rng (random.Random): The random stream to draw from.
 
-    def report_incident(self, incident_location):
+        Returns:
+            str: The incident type.
+        """
+        return CATALOG.names[CATALOG.draw(rng)]
+
+    def report_incident(self, incident_location, incident_type=None):
         """
         Reports a new incident to the Emergency Response Center.
 
         Args:
             incident_location (str): The location of the incident.
+            incident_type (str, optional): The type of the incident. Drawn from the center's random stream if None.
         """
-        incidents = INCIDENTS
-        incident_types = list(incidents.keys())
-        probabilities = [incidents[incident]['probability'] for incident in incident_types]
-
-        incident_type = random.choices(incident_types, weights=probabilities, k=1)[0]
+        if incident_type is None:
+            type_code = CATALOG.draw(self.rng)
+            incident_type = CATALOG.names[type_code]
+        else:
+            type_code = CATALOG.codes[incident_type]
         self.incident_id_counter += 1
         id = self.incident_id_counter
-        reported = time.time()
-        incident = Incident(id, incident_location, incident_type, reported, incidents[incident_type]['severity'])
+        reported = self.clock()
+        incident = Incident(id, incident_location, incident_type, reported, CATALOG.rows[type_code][0], type_code)
         incident_priority = self.determine_incident_priority(incident_type, incident)
         logging.info(
             f"New incident {incident.id}  reported at {incident_location} with type {incident_type}, severity {incident.severity}, and priority {incident_priority} \n Firetrucks needed: {incident.vehicles_needed[1]} \n Police cars needed: {incident.vehicles_needed[0]} \n Ambulances needed: {incident.vehicles_needed[2]}")
@@ -136,7 +241,53 @@ class EmergencyResponseCenter(threading.Thread):
         with self.locks["logged_incidents"]:
             self.logged_incidents[incident.id] = incident
         with self.locks["incident_queue"]:
-            self.incident_queue.put((incident_priority, incident.id))
+            self.incident_queue.put(incident_priority, incident.id)
+        self.notify("report", incident)
+
+    def hand_over(self, incident_id):
+        """
+        Takes a queued incident that no vehicle was sent to out of this center, so another center can take it over.
+
+        Args:
+            incident_id (int): The incident.
+
+        Returns:
+            Incident: The incident, or None if it is no longer waiting in the queue.
+        """
+        with self.locks["incident_queue"]:
+            incident = self.logged_incidents.get(incident_id)
+            # Active incidents were sent vehicles already, possibly on an earlier pass than vehicles_dispatched tells
+            if incident is None or incident_id in self.active_incidents or not self.incident_queue.cancel(incident_id):
+                return None
+        incident.status = "handed over"
+        return incident
+
+    def take_over(self, incident_location, incident_type, report_time, severity, dispatch_attempts):
+        """
+        Queues an incident handed over by another center. It keeps its report time and severity, and it is not
+        triaged again if the other center already did, so it is counted once across centers.
+
+        Args:
+            incident_location (int): The location of the incident.
+            incident_type (str): The type of the incident.
+            report_time (float): When it was reported to the other center.
+            severity (float): Its current severity.
+            dispatch_attempts (int): The dispatches the other center attempted.
+
+        Returns:
+            Incident: The incident, with an id of this center.
+        """
+        type_code = CATALOG.codes[incident_type]
+        self.incident_id_counter += 1
+        incident = Incident(self.incident_id_counter, incident_location, incident_type, report_time, severity, type_code)
+        incident.dispatch_attempts = dispatch_attempts
+        incident_priority = self.determine_incident_priority(incident_type, incident)
+        with self.locks["logged_incidents"]:
+            self.logged_incidents[incident.id] = incident
+        with self.locks["incident_queue"]:
+            self.incident_queue.put(incident_priority, incident.id)
+        self.wake()
+        return incident
 
     def determine_incident_priority(self, incident_type, incident):
         """
@@ -149,19 +300,18 @@ class EmergencyResponseCenter(threading.Thread):
         Returns:
             int: The priority of the incident.
         """
-        incident_details = INCIDENTS.get(incident_type, {})
-
         # Get severity and required resources for the incident
-        severity = incident_details.get('severity', 0)
-        required_police_cars = incident_details.get('required_police_cars', 0)
-        required_firetrucks = incident_details.get('required_firetrucks', 0)
-        required_ambulances = incident_details.get('required_ambulances', 0)
+        severity, required_police_cars, required_firetrucks, required_ambulances = CATALOG.rows[incident.type_code]
         incident.vehicles_needed = [required_police_cars, required_firetrucks, required_ambulances]
 
-        # Calculate the number of available vehicles
-        available_police_cars = sum(1 for car in self.police_cars if car.available)
-        available_firetrucks = sum(1 for truck in self.firetrucks if truck.available)
-        available_ambulances = sum(1 for ambulance in self.ambulances if ambulance.available)
+        # Calculate the number of available vehicles, from the counters of the free pools when there are some
+        if self.dispatch_index is not None:
+            available_police_cars, available_firetrucks, available_ambulances = \
+                self.dispatch_index.availability(("Police-Car", "Fire-Truck", "Ambulance"))
+        else:
+            available_police_cars = sum(1 for car in self.police_cars if car.available)
+            available_firetrucks = sum(1 for truck in self.firetrucks if truck.available)
+            available_ambulances = sum(1 for ambulance in self.ambulances if ambulance.available)
 
         # Adjust priority based on availability of resources
         # If fewer vehicles are available than required, the priority increases (yes its not in the moment of deployment, but it is a good approximation)
@@ -184,15 +334,21 @@ class EmergencyResponseCenter(threading.Thread):
         Args:
             incident (Incident): The incident object.
             priority (int): The priority of the incident.
+
+        Returns:
+            int: The number of vehicles dispatched.
         """
         # determine the number of vehicles needed for the incident
         needed_police_cars = incident.vehicles_needed[0]
         needed_firetrucks = incident.vehicles_needed[1]
         needed_ambulances = incident.vehicles_needed[2]
 
-        # add to SQL
-        self.sql.add_incident(incident.report_time, incident.incident_type, incident.location, incident.severity,
-                              needed_police_cars, needed_firetrucks, needed_ambulances)
+        # add to SQL and the statistics the first time the incident is handled
+        if incident.dispatch_attempts == 0:
+            self.sql.add_incident(incident.report_time, incident.incident_type, incident.location, incident.severity,
+                                  needed_police_cars, needed_firetrucks, needed_ambulances)
+            self.notify("triage", incident)
+        incident.dispatch_attempts += 1
 
         # Attempt to dispatch vehicles
         dispatched_police_cars = self.dispatch_specific_vehicle(self.police_cars, needed_police_cars, incident)
@@ -217,7 +373,7 @@ class EmergencyResponseCenter(threading.Thread):
             incident.status = "more vehicles needed"
             priority = priority - 0.3 if priority > 0 else priority
             with self.locks['incident_queue']:
-                self.incident_queue.put((priority, incident.id))
+                self.incident_queue.put(priority, incident.id)
             with self.locks['active_incidents']:
                 self.active_incidents[incident.id] = incident
             # logging.info(f"Re-queued incident {incident.id} with updated priority {priority}")
@@ -226,12 +382,14 @@ class EmergencyResponseCenter(threading.Thread):
             incident.status = "no vehicles available"
             priority = priority - 5 if priority > 0 else priority
             with self.locks['incident_queue']:
-                self.incident_queue.put((priority, incident.id))
+                self.incident_queue.put(priority, incident.id)
             # logging.info(f"Re-queued incident {incident.id} with significantly increased priority {priority}")
+        return sum(incident.vehicles_dispatched)
 
     def dispatch_specific_vehicle(self, vehicles, needed, incident):
         """
         Dispatches a specific type of vehicle to handle an incident.
+        The available vehicles with the shortest route to the incident are sent first.
 
         Args:
             vehicles (list): A list of vehicles of a specific type.
@@ -241,11 +399,27 @@ class EmergencyResponseCenter(threading.Thread):
         Returns:
             int: The number of vehicles dispatched.
         """
+        if needed <= 0 or not vehicles:
+            return 0
+        index = self.dispatch_index
+        if index is not None:
+            if not index.available(vehicles[0].vehicle_type):
+                return 0
+            candidates = [vehicle for _, vehicle in index.nearest(vehicles[0].vehicle_type, incident.location, needed)]
+        else:
+            candidates = vehicles
         dispatched_count = 0
-        for vehicle in vehicles:
+        for vehicle in candidates:
+            if dispatched_count == needed:
+                break
             with vehicle.lock:
-                if vehicle.available and dispatched_count < needed:
+                # Claiming takes the vehicle out of the free pool atomically, so it cannot be sent twice
+                if index.claim(vehicle) if index is not None else vehicle.available:
                     vehicle.incident = incident
                     vehicle.available = False
                     dispatched_count += 1
+                    self.notify("dispatch", incident, vehicle)
+                    if self.on_dispatch:
+                        self.on_dispatch(vehicle, incident)
+                    vehicle.wakeup.notify()  # The vehicle thread starts right away instead of on its next poll
         return dispatched_count
@@ -0,0 +1,288 @@
+import heapq
+import itertools
+import time
+import logging
+from utils.constants import NINCIDENTS_PER_CITIZEN, CITIZEN_WAIT_TIME, CITIZEN_REPORT_PROBABILITY
+
+HOP_TIME = 0.1  # Seconds a vehicle spends on each node of its route
+WORK_INTERVAL = 1  # Seconds between two severity decrements at the incident
+SEVERITY_PER_INTERVAL = 3  # Severity removed by one vehicle every WORK_INTERVAL
+DISPATCH_INTERVAL = 0.1  # Seconds between two passes of the dispatcher
+POPULATION_WINDOW = 1  # Seconds of reports of a CitizenPopulation drawn at once
+
+
+class DiscreteEventEngine:
+    """
+    Runs a city on a simulated clock instead of one thread per agent.
+
+    Citizens, vehicles and the emergency response center are the same objects used by the threaded
+    simulation, but their threads are never started. Every `time.sleep` of the threaded version becomes an
+    event on a priority queue ordered by simulated time, so a run completes as fast as the events can be
+    processed while keeping the timings of the threaded version.
+
+    Attributes:
+        city (City): The city being simulated.
+        epoch (float): Wall-clock timestamp that corresponds to simulated time 0.
+        now (float): Current simulated time in seconds since the start of the run.
+        events (list): Heap of pending events as (time, sequence, handler, args) tuples.
+        processed_events (int): Number of events handled so far.
+        report_probability (float): Probability that a citizen reports an incident at each step.
+        trips (dict): Vehicle -> id of its current trip, so the hops of a trip cut short by a new dispatch are dropped.
+        pending_reports (int): Scheduled reports not yet seen by a pass of the dispatcher.
+        dispatching (bool): Whether the dispatcher is running, i.e. has its next pass scheduled.
+        checkpointer (Checkpointer): Takes the periodic checkpoints of the run (see services.checkpoint), or None.
+        track (TrackRecorder): Records the frames of the run for render.py (see services.track), or None.
+    """
+
+    def __init__(self, city, epoch=None, report_probability=CITIZEN_REPORT_PROBABILITY):
+        """
+        Initializes the engine.
+
+        Args:
+            city (City): The city to simulate.
+            epoch (float, optional): Timestamp of simulated time 0. Defaults to the current wall-clock time.
+            report_probability (float, optional): Probability that a citizen reports an incident at each step.
+                Defaults to CITIZEN_REPORT_PROBABILITY.
+        """
+        self.city = city
+        self.report_probability = report_probability
+        self.epoch = time.time() if epoch is None else epoch
+        self.now = 0.0
+        self.events = []
+        self.processed_events = 0
+        self.trips = {}
+        self.pending_reports = 0
+        self.dispatching = False
+        self.checkpointer = None
+        self.track = None
+        self._reports_fed = 0  # Scheduled reports fed since the last pass of the dispatcher
+        self._sequence = itertools.count()  # Tie breaker keeping same-time events in scheduling order
+
+    def clock(self):
+        """
+        Returns the simulated time as a timestamp, used by the emergency response center to date incidents.
+        """
+        return self.epoch + self.now
+
+    def schedule(self, delay, handler, *args):
+        """
+        Schedules handler(*args) to run after the given simulated delay.
+
+        Args:
+            delay (float): Simulated seconds from now.
+            handler (callable): The function to call.
+            *args: Arguments passed to the handler.
+        """
+        heapq.heappush(self.events, (self.now + delay, next(self._sequence), handler, args))
+
+    def run(self, until=None, write_output=True):
+        """
+        Deploys the city, unless it was restored from a checkpoint, and processes events until none are left or
+        the simulated time exceeds `until`.
+
+        Args:
+            until (float, optional): Simulated time in seconds at which to stop. Defaults to no limit.
+            write_output (bool, optional): Write output.txt at the end. Defaults to True.
+
+        Returns:
+            dict: The statistics of the run (see IncidentStatistics.snapshot).
+        """
+        center = self.city.emergency_response if self.city.emergency_response is not None else self.deploy()
+        started = time.time()
+        self.advance(until)
+        elapsed = time.time() - started
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+        if self.track is not None:
+            self.track.close()
+        logging.info(f"Simulated {round(self.now, 1)} s with {self.processed_events} events in {round(elapsed, 3)} s")
+        center.sql.add_data()
+        if write_output:
+            center.write_statistics()
+        center.close()
+        return center.statistics.snapshot()
+
+    def advance(self, until=None):
+        """
+        Processes events until none are left or the next one is after `until`, for callers stepping the engine
+        themselves, like the districts of districts.py.
+
+        Args:
+            until (float, optional): Simulated time in seconds at which to stop. Defaults to no limit.
+        """
+        while self.events:
+            if until is not None and self.events[0][0] > until:
+                break
+            if self.checkpointer is not None and self.events[0][0] >= self.checkpointer.next_time:
+                self.checkpointer.capture()  # Between two events, where the whole state is plain data
+            if self.track is not None and self.events[0][0] >= self.track.next_time:
+                self.track.capture(self.events[0][0])  # The state until the next event
+            self.now, _, handler, args = heapq.heappop(self.events)
+            handler(*args)
+            self.processed_events += 1
+        if until is not None:
+            self.now = max(self.now, until)
+
+    def resume(self):
+        """
+        Restarts the dispatcher if it stopped, e.g. when incidents are handed over by another response center.
+        """
+        if not self.dispatching:
+            self.dispatching = True
+            self.schedule(DISPATCH_INTERVAL, self.dispatcher_step)
+
+    def deploy(self):
+        """
+        Creates the vehicles, the emergency response center and the citizens without starting their threads,
+        and schedules their first events.
+
+        Returns:
+            EmergencyResponseCenter: The response center of the city.
+        """
+        self.city.epoch = self.epoch
+        self.city.deploy_emergency_services(start=False)
+        center = self.city.emergency_response
+        center.clock = self.clock
+        center.on_dispatch = self.vehicle_dispatched
+        self.city.deploy_citizens(start=False, report_probability=self.report_probability)
+        for citizen in self.city.citizens:
+            self.schedule(citizen.rng.randint(CITIZEN_WAIT_TIME[0], CITIZEN_WAIT_TIME[1]), self.citizen_step, citizen)
+        if self.city.population is not None:
+            self.schedule(self.city.population.next_time(), self.population_step)
+        self.resume()
+        return center
+
+    def citizen_step(self, citizen):
+        """
+        One iteration of `Citizen.run`: maybe report an incident, then wait up to 10 seconds.
+        """
+        if citizen.num_incidents_reported >= NINCIDENTS_PER_CITIZEN:
+            logging.info(f"Citizen {citizen.id} reported {citizen.num_incidents_reported} incidents and is done")
+            self.city.retire_citizen(citizen)
+            return
+        if citizen.rng.random() < self.report_probability:
+            citizen.report_incident()
+        self.schedule(citizen.rng.random() * 10, self.citizen_step, citizen)
+
+    def population_step(self):
+        """
+        Draws the reports of the city's CitizenPopulation for the next POPULATION_WINDOW seconds in bulk and
+        schedules each of them at its own time, then schedules the next draw.
+        """
+        population = self.city.population
+        until = self.now + POPULATION_WINDOW
+        for at, location, incident_type in zip(*population.due(until)):
+            self.schedule_report(at, int(location), incident_type)
+        if population.active:
+            self.schedule(max(population.next_time(), until) - self.now, self.population_step)
+
+    def schedule_report(self, at, location, incident_type):
+        """
+        Schedules an incident to be reported at a given simulated time instead of drawing it from a citizen,
+        to feed the response center with the incidents of a recorded run or of a CitizenPopulation.
+
+        Args:
+            at (float): Simulated time of the report in seconds.
+            location (int): The node of the incident.
+            incident_type (str): The type of the incident.
+        """
+        self.pending_reports += 1
+        self.schedule(at - self.now, self.replayed_report, location, incident_type)
+
+    def replayed_report(self, location, incident_type):
+        """
+        Feeds a scheduled report to the response center.
+        """
+        self._reports_fed += 1
+        self.city.emergency_response.report_incident(location, incident_type)
+
+    def dispatcher_step(self):
+        """
+        One iteration of `EmergencyResponseCenter.queue_listener`. Stops once there is nothing left to dispatch,
+        see dispatcher_done.
+        """
+        center = self.city.emergency_response
+        if self.dispatcher_done():
+            logging.info("All citizens are done, shutting down Emergency Response Center")
+            self.dispatching = False
+            return
+        center.process_incidents()
+        self.pending_reports -= self._reports_fed
+        self._reports_fed = 0
+        self.schedule(DISPATCH_INTERVAL, self.dispatcher_step)
+
+    def dispatcher_done(self):
+        """
+        Tells whether the dispatcher has nothing left to do: all citizens are done, every replayed report was fed,
+        no incident is active and no queued incident can still be sent a vehicle of this city.
+        """
+        center = self.city.emergency_response
+        return not self.city.has_active_citizens() and not self.pending_reports and not center.active_incidents and \
+            not center.can_serve_queue()
+
+    def vehicle_dispatched(self, vehicle, incident):
+        """
+        Called by the response center when a vehicle is assigned; sends it to the incident, cutting short its
+        way home if it was dispatched while returning.
+        """
+        vehicle.set_route(incident.location)
+        vehicle.at_home_location = False
+        self.start_trip(vehicle, self.vehicle_arrived)
+
+    def start_trip(self, vehicle, on_arrival):
+        """
+        Starts moving a vehicle along the route it was just given.
+        """
+        trip = next(self._sequence)
+        self.trips[vehicle] = trip
+        self.schedule(0, self.vehicle_hop, vehicle, on_arrival, trip)
+
+    def vehicle_hop(self, vehicle, on_arrival, trip):
+        """
+        Moves a vehicle one node along its route, or calls on_arrival once the route is exhausted.
+        """
+        if self.trips.get(vehicle) != trip:
+            return  # The vehicle was dispatched somewhere else in the meantime
+        if vehicle.move():
+            self.schedule(HOP_TIME, self.vehicle_hop, vehicle, on_arrival, trip)
+        else:
+            on_arrival(vehicle)
+
+    def vehicle_arrived(self, vehicle):
+        """
+        Starts working on the incident after the vehicle reached it.
+        """
+        vehicle.notify("arrival", vehicle.incident)
+        self.vehicle_work(vehicle, vehicle.incident)
+
+    def vehicle_work(self, vehicle, incident):
+        """
+        Reduces the severity of the incident, or releases the vehicle and sends it home once the incident is
+        resolved.
+        """
+        if incident.resolved:
+            vehicle.release()
+            vehicle.target_node = vehicle.home_location
+            vehicle.set_route(vehicle.home_location)
+            self.start_trip(vehicle, self.vehicle_home)
+            return
+        incident.severity -= SEVERITY_PER_INTERVAL
+        self.schedule(WORK_INTERVAL, self.vehicle_check, vehicle, incident)
+
+    def vehicle_check(self, vehicle, incident):
+        """
+        Marks the incident as resolved once its severity is exhausted and continues working.
+        """
+        if incident.severity <= 0 and not incident.resolved:
+            incident.resolved = True
+            incident.status = "resolved"
+            vehicle.notify("resolve", incident)
+        self.vehicle_work(vehicle, incident)
+
+    def vehicle_home(self, vehicle):
+        """
+        Marks a vehicle as back at its station.
+        """
+        self.trips.pop(vehicle, None)
+        vehicle.at_home_location = True
+        vehicle.notify("return", None)
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import struct
+import logging
+import threading
+from collections import namedtuple
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+MAGIC = b"ERLIVE"
+FEED_VERSION = 1
+FEED_NAME = "emergency-live"  # Default name of the shared memory block
+SLOTS = 4  # Frames in the ring: a reader copying one frame never blocks the publisher writing the next
+CAPACITY = 65536  # Points per frame; citizens beyond it are published as a density map
+DENSITY_BINS = 128  # Resolution of the citizens density map
+TEXT_SIZE = 16384  # Bytes of the active incidents and queue panels per frame
+TEXT_LINES = 40  # Lines of each panel
+PUBLISH_INTERVAL = 0.1  # Seconds between two frames
+META_SIZE = 4096  # Bytes reserved for the JSON metadata after the header
+HEADER = struct.Struct("<6sHIIIIq")  # Magic, version, slots, slot size, metadata length, closed, latest frame
+SLOT = struct.Struct("<qdIIIIIIIII")  # Sequence, simulated time, points per group, queued, active, density, text length
+GROUPS = ("citizens", "police", "firetrucks", "ambulances", "incidents")
+
+Frame = namedtuple("Frame", "number time groups density queued active text")
+
+
+def slot_size(capacity=CAPACITY):
+    return SLOT.size + capacity * 8 + DENSITY_BINS * DENSITY_BINS * 4 + TEXT_SIZE
+
+
+def collect(city, capacity, bbox):
+    """
+    Gathers what a frame of the city shows: the points of every group and the active incidents. When the citizens
+    do not fit in the capacity left by the other groups, they are counted into a density map instead.
+
+    Args:
+        city (City): The city.
+        capacity (int): Points per frame at most.
+        bbox (tuple): North, south, east and west of the density map.
+
+    Returns:
+        tuple: The (n, 2) points of each group in GROUPS order, the density of the citizens (float32 array of
+        DENSITY_BINS x DENSITY_BINS, None when they are points) and the list of active incidents.
+    """
+    center = city.emergency_response
+    graph = city.compiled_graph
+    groups = [city.positions[group].coordinates() for group in GROUPS[1:4]]
+    incidents = list(center.active_incidents.values()) if center is not None else []
+    if incidents:
+        indices = graph.indices_of(np.fromiter((incident.location for incident in incidents), dtype=np.int64))
+        groups.append(np.column_stack((graph.x[indices], graph.y[indices])))
+    else:
+        groups.append(np.empty((0, 2)))
+    citizens = city.positions["citizens"].coordinates()
+    density = None
+    room = capacity - sum(len(points) for points in groups)
+    if len(citizens) > room:
+        north, south, east, west = bbox
+        density = np.histogram2d(citizens[:, 1], citizens[:, 0], bins=DENSITY_BINS,
+                                 range=[[south, north], [west, east]])[0].astype(np.float32)
+        citizens = np.empty((0, 2))
+    groups.insert(0, citizens)
+    start, clipped = 0, []
+    for group in groups:
+        group = group[:capacity - start]
+        start += len(group)
+        clipped.append(group)
+    return clipped, density, incidents
+
+
+class LiveFeed(threading.Thread):
+    """
+    Publishes what the viewer shows (agent positions, active incidents and queue) into a shared-memory ring buffer,
+    so separate viewer processes (viewer.py) can watch a run without slowing it down.
+
+    The block starts with a header and JSON metadata (bounding box, base map), followed by SLOTS frame slots. Frame
+    k goes to slot k % SLOTS under a seqlock: its sequence is odd while it is written and 2k + 2 once complete,
+    and the header then points to it. Readers copy the latest complete frame and check that its sequence did not
+    change meanwhile, so they never take a lock the simulation waits for. Viewers attach, detach and reattach at
+    will; the publisher does not know about them. A frame costs a few NumPy copies every PUBLISH_INTERVAL on this
+    thread, the drawing happens in the viewer process.
+
+    Attributes:
+        city (City): The city being published.
+        name (str): Name of the shared memory block.
+        interval (float): Seconds between two frames.
+        capacity (int): Points per frame.
+        frames (int): The number of frames published.
+    """
+
+    def __init__(self, city, name=FEED_NAME, interval=PUBLISH_INTERVAL, capacity=CAPACITY, basemap=True):
+        """
+        Creates the shared memory block.
+
+        Args:
+            city (City): The city to publish.
+            name (str, optional): Name of the shared memory block. Defaults to FEED_NAME.
+            interval (float, optional): Seconds between two frames. Defaults to PUBLISH_INTERVAL.
+            capacity (int, optional): Points per frame. Defaults to CAPACITY.
+            basemap (bool, optional): Render the cached base map of the street network for the viewers. Defaults
+                to True.
+        """
+        super().__init__(name="Live feed", daemon=True)
+        self.city = city
+        self.name = name
+        self.interval = interval
+        self.capacity = capacity
+        self.frames = 0
+        self.done = threading.Event()
+        self._basemap = basemap
+        self._size = slot_size(capacity)
+        self._shm = shared_memory.SharedMemory(name=name, create=True,
+                                               size=HEADER.size + META_SIZE + SLOTS * self._size)
+        graph = city.compiled_graph
+        self._bbox = (float(graph.y.max()), float(graph.y.min()), float(graph.x.max()), float(graph.x.min()))
+        self._write_meta(None)
+        self._origin = None
+
+    def run(self):
+        if self._basemap:
+            from utils.basemap import load_basemap, basemap_path
+            north, south, east, west = self._bbox
+            graph = self.city.compiled_graph
+            load_basemap(graph, north, south, east, west)  # Renders it on the first run only
+            self._write_meta(os.path.abspath(basemap_path(graph, north, south, east, west)))
+        while not self.done.is_set():
+            self.publish()
+            self.done.wait(self.interval)
+
+    def publish(self):
+        """
+        Writes the current state of the city as the next frame.
+        """
+        city = self.city
+        center = city.emergency_response
+        if self._origin is None:
+            self._origin = city.epoch if city.epoch is not None else time.time()
+        groups, density, incidents = collect(city, self.capacity, self._bbox)
+
+        queued = center.incident_queue.snapshot(TEXT_LINES) if center is not None else []
+        text = json.dumps({
+            "active": [f"Incident {incident.id} - {incident.incident_type} - Severity {round(incident.severity, 2)}"
+                       for incident in incidents[:TEXT_LINES]],
+            "queue": [f"Incident {incident_id} - Priority {round(priority, 2)}" for priority, incident_id in queued],
+        }).encode()[:TEXT_SIZE]
+
+        frame = self.frames
+        offset = HEADER.size + META_SIZE + (frame % SLOTS) * self._size
+        buf = self._shm.buf
+        struct.pack_into("<q", buf, offset, 2 * frame + 1)  # Odd: being written
+        points = np.ndarray((self.capacity, 2), dtype=np.float32, buffer=buf, offset=offset + SLOT.size)
+        start = 0
+        for group in groups:
+            points[start:start + len(group)] = group
+            start += len(group)
+        if density is not None:
+            grid = np.ndarray((DENSITY_BINS, DENSITY_BINS), dtype=np.float32, buffer=buf,
+                              offset=offset + SLOT.size + self.capacity * 8)
+            grid[:] = density
+            del grid
+        del points
+        text_offset = offset + SLOT.size + self.capacity * 8 + DENSITY_BINS * DENSITY_BINS * 4
+        buf[text_offset:text_offset + len(text)] = text
+        now = (center.clock() if center is not None else time.time()) - self._origin
+        SLOT.pack_into(buf, offset, 2 * frame + 1, now, *(len(group) for group in groups),
+                       len(center.incident_queue) if center is not None else 0, len(incidents), density is not None,
+                       len(text))
+        struct.pack_into("<q", buf, offset, 2 * frame + 2)  # Even: complete
+        struct.pack_into("<q", buf, HEADER.size - 8, frame)
+        self.frames += 1
+
+    def close(self):
+        """
+        Stops publishing, marks the feed as closed for the attached viewers and removes the block.
+        """
+        self.done.set()
+        if self.is_alive():
+            self.join()
+        struct.pack_into("<I", self._shm.buf, HEADER.size - 12, 1)
+        self._shm.close()
+        self._shm.unlink()  # Attached viewers keep their mapping until they detach
+        logging.info(f"Published {self.frames} frames to {self.name}")
+
+    def _write_meta(self, basemap):
+        north, south, east, west = self._bbox
+        meta = json.dumps({"north": north, "south": south, "east": east, "west": west, "basemap": basemap,
+                           "capacity": self.capacity, "density_bins": DENSITY_BINS, "groups": GROUPS}).encode()
+        self._shm.buf[HEADER.size:HEADER.size + len(meta)] = meta
+        latest = self.frames - 1
+        HEADER.pack_into(self._shm.buf, 0, MAGIC, FEED_VERSION, SLOTS, self._size, len(meta), 0, latest)
+
+
+class LiveFeedReader:
+    """
+    Reads the frames of a LiveFeed from another process.
+
+    Attributes:
+        name (str): Name of the shared memory block.
+        meta (dict): The metadata of the feed, None while detached.
+    """
+
+    def __init__(self, name=FEED_NAME):
+        self.name = name
+        self.meta = None
+        self._shm = None
+        self._last = -1
+
+    @property
+    def attached(self):
+        return self._shm is not None
+
+    def attach(self):
+        """
+        Attaches to the feed if a simulation is publishing it.
+
+        Returns:
+            bool: Whether the reader is attached.
+        """
+        if self._shm is not None:
+            return True
+        try:
+            shm = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            return False
+        # Only the publisher owns the block: without this, the tracker of this process would remove it on exit
+        resource_tracker.unregister(shm._name, "shared_memory")
+        magic, version, slots, size, length, closed, _ = HEADER.unpack_from(shm.buf, 0)
+        if magic != MAGIC or version != FEED_VERSION or closed:
+            shm.close()
+            return False
+        self._shm = shm
+        self._slots, self._size = slots, size
+        self.meta = json.loads(bytes(shm.buf[HEADER.size:HEADER.size + length]))
+        self._last = -1
+        return True
+
+    def detach(self):
+        """
+        Detaches from the feed. The simulation goes on; attach again at any time.
+        """
+        if self._shm is not None:
+            self._shm.close()
+            self._shm, self.meta = None, None
+
+    def closed(self):
+        """
+        Returns whether the publisher stopped. Detach then, its simulation is over.
+        """
+        return self._shm is None or HEADER.unpack_from(self._shm.buf, 0)[5] == 1
+
+    def read(self):
+        """
+        Returns a copy of the latest complete frame, None if there is no new one.
+        """
+        if self._shm is None:
+            return None
+        buf = self._shm.buf
+        _, _, _, _, length, _, latest = HEADER.unpack_from(buf, 0)
+        if self.meta["basemap"] is None:
+            try:
+                self.meta = json.loads(bytes(buf[HEADER.size:HEADER.size + length]))  # The base map may be ready now
+            except ValueError:
+                pass  # Being written
+        capacity = self.meta["capacity"]
+        for frame in range(latest, max(latest - self._slots, self._last), -1):
+            offset = HEADER.size + META_SIZE + (frame % self._slots) * self._size
+            header = SLOT.unpack_from(buf, offset)
+            if header[0] != 2 * frame + 2:
+                continue  # Being overwritten by a newer frame
+            points = np.ndarray((capacity, 2), dtype=np.float32, buffer=buf, offset=offset + SLOT.size)
+            counts = header[2:7]
+            copies = np.array(points[:sum(counts)])
+            del points
+            density = None
+            if header[9]:
+                grid = np.ndarray((DENSITY_BINS, DENSITY_BINS), dtype=np.float32, buffer=buf,
+                                  offset=offset + SLOT.size + capacity * 8)
+                density = grid.copy()
+                del grid
+            text_offset = offset + SLOT.size + capacity * 8 + DENSITY_BINS * DENSITY_BINS * 4
+            text = bytes(buf[text_offset:text_offset + header[10]])
+            if struct.unpack_from("<q", buf, offset)[0] != header[0]:
+                continue  # Overwritten while copying
+            self._last = frame
+            bounds = np.cumsum((0,) + counts)
+            groups = {group: copies[bounds[i]:bounds[i + 1]] for i, group in enumerate(GROUPS)}
+            return Frame(frame, header[1], groups, density, header[7], header[8], json.loads(text))
+        return None
@@ -0,0 +1,111 @@
+import sys
+import json
+import time
+import logging
+from models.incident import Incident
+from services.event_engine import DiscreteEventEngine
+from utils.incident_catalog import CATALOG
+from utils.event_log import EVENTS, read_log, decode
+
+
+class Replay:
+    """
+    Plays back the binary event log of a run (see utils.event_log) without simulating the citizens again.
+
+    Attributes:
+        path (str): The log file.
+        meta (dict): The metadata of the log: seed, epoch and the type tables.
+        records (np.ndarray): The raw fixed-width records.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.meta, self.records = read_log(path)
+
+    def __len__(self):
+        return len(self.records)
+
+    def events(self, event=None):
+        """
+        Returns the events of the log as LogEvent tuples, optionally only those of one kind ("report"...).
+        """
+        records = self.records if event is None else self.records[self.records["event"] == EVENTS.index(event) + 1]
+        return decode(self.meta, records)
+
+    def play(self, callback, speed=None):
+        """
+        Calls callback(event) for every event of the log, in order.
+
+        Args:
+            callback (callable): Receives each LogEvent.
+            speed (float, optional): Playback speed relative to the recorded run (2 plays twice as fast).
+                Defaults to None, as fast as possible.
+        """
+        started = time.time()
+        for event in self.events():
+            if speed:
+                delay = event.time / speed - (time.time() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            callback(event)
+
+    def redispatch(self, city, write_output=False):
+        """
+        Feeds the recorded reports, at their recorded times and with their recorded types, to the response center
+        of a city run on the discrete-event engine. Only the dispatching and the vehicles are simulated, so a
+        change to the dispatch logic can be compared on exactly the same incidents.
+
+        Args:
+            city (City): A city without citizens, not deployed yet.
+            write_output (bool, optional): Write output.txt at the end. Defaults to False.
+
+        Returns:
+            dict: The statistics of the new run (see IncidentStatistics.snapshot).
+        """
+        engine = DiscreteEventEngine(city)
+        for event in self.events("report"):
+            engine.schedule_report(event.time, event.node, event.incident_type)
+        return engine.run(write_output=write_output)
+
+
+class ReplayView:
+    """
+    Applies the events of a log to a city whose services are deployed without threads, so that the Simulation
+    renderer draws the recorded run: vehicles jump to the node of each of their events and incidents are shown
+    while vehicles are assigned to them.
+
+    Attributes:
+        city (City): The city drawn by the renderer.
+        vehicles (dict): (vehicle type, id) -> EmergencyVehicle.
+        incidents (dict): Incident id -> Incident rebuilt from its report.
+    """
+
+    def __init__(self, city):
+        self.city = city
+        center = city.emergency_response
+        self.vehicles = {(vehicle.vehicle_type, vehicle.id): vehicle
+                         for vehicle in center.firetrucks + center.police_cars + center.ambulances}
+        self.incidents = {}
+
+    def __call__(self, event):
+        active_incidents = self.city.emergency_response.active_incidents
+        if event.event == "report":
+            type_code = CATALOG.codes[event.incident_type]
+            self.incidents[event.incident_id] = Incident(event.incident_id, event.node, event.incident_type, event.time,
+                                                         CATALOG.rows[type_code][0], type_code)
+        elif event.event == "dispatch" and event.incident_id in self.incidents:
+            active_incidents[event.incident_id] = self.incidents[event.incident_id]
+        elif event.event == "resolve":
+            active_incidents.pop(event.incident_id, None)
+        vehicle = self.vehicles.get((event.vehicle_type, event.vehicle_id))
+        if vehicle is not None and event.vehicle_type is not None:
+            vehicle.current_node = event.node
+
+
+if __name__ == '__main__':
+    # python -m services.replay run.log: re-dispatch the incidents of a log and print the new statistics
+    from services.city import City
+
+    logging.basicConfig(level=logging.WARNING)
+    stats = Replay(sys.argv[1]).redispatch(City(0, "memory"))
+    print(json.dumps({key: stats[key] for key in ("incidents", "response_time", "resolution_time")}, indent=2))
@@ -0,0 +1,341 @@
+import math
+import heapq
+import numpy as np
+from utils.constants import ROUTING_BACKEND
+
+INFINITY = float('inf')
+EARTH_RADIUS = 6371008.8  # Meters
+BACKENDS = ("dijkstra", "astar", "ch")
+
+
+def shortest_path_tree(indptr, indices, lengths, source, target=None):
+    """
+    Runs Dijkstra's algorithm over a CSR adjacency.
+
+    Args:
+        indptr (list): CSR row pointer.
+        indices (list): CSR column indices.
+        lengths (list): Edge lengths, aligned with indices.
+        source (int): Index of the source node.
+        target (int, optional): Index of a node at which to stop early. Defaults to exploring the whole graph.
+
+    Returns:
+        tuple: (dist, pred) lists, with the distance from the source and the predecessor of every node
+        (-1 for the source and unreachable nodes).
+    """
+    dist = [INFINITY] * (len(indptr) - 1)
+    pred = [-1] * (len(indptr) - 1)
+    dist[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        if u == target:
+            break
+        for edge in range(indptr[u], indptr[u + 1]):
+            v = indices[edge]
+            candidate = d + lengths[edge]
+            if candidate < dist[v]:
+                dist[v] = candidate
+                pred[v] = u
+                heapq.heappush(heap, (candidate, v))
+    return dist, pred
+
+
+def walk(links, start, end):
+    """
+    Follows predecessor (or successor) links from start until end and returns the visited node indices, or None if
+    end is never reached.
+    """
+    path = [start]
+    current = start
+    while current != end:
+        current = links[current]
+        if current < 0:
+            return None
+        path.append(current)
+    return path
+
+
+class Dijkstra:
+    """
+    Point-to-point routing with Dijkstra's algorithm, stopping once the target is settled.
+
+    Like the other backends (see create_backend), it routes between node indices of a CompiledGraph.
+    """
+
+    def __init__(self, graph, csr=None):
+        """
+        Args:
+            graph (CompiledGraph): The road network.
+            csr (tuple, optional): The (indptr, indices, lengths) lists of the graph, if the caller already has them.
+        """
+        self.graph = graph
+        self._csr = csr or (graph.indptr.tolist(), graph.indices.tolist(), graph.lengths.tolist())
+
+    def route(self, source, target):
+        """
+        Returns the shortest route between two nodes.
+
+        Args:
+            source (int): Index of the origin.
+            target (int): Index of the destination.
+
+        Returns:
+            tuple: The length of the route (inf if unreachable) and the indices of its nodes (None if unreachable).
+        """
+        dist, pred = shortest_path_tree(*self._csr, source, target)
+        path = walk(pred, target, source)
+        return dist[target], path[::-1] if path else None
+
+    def distance(self, source, target):
+        """
+        Returns the length of the shortest route between two node indices, inf if unreachable.
+        """
+        return shortest_path_tree(*self._csr, source, target)[0][target]
+
+
+class BidirectionalAStar:
+    """
+    Point-to-point routing with a bidirectional A* search guided by the straight-line distance between the node
+    coordinates.
+
+    The two searches share the average potential (h_t(v) - h_s(v)) / 2, where h_s and h_t are the straight-line
+    distances from the origin and to the destination. They then see the same reduced edge lengths and can stop like
+    a bidirectional Dijkstra, once the sum of their smallest keys reaches the best route met so far. The distances
+    are scaled by the smallest ratio of edge length to straight-line length in the graph, so they never overestimate
+    a route, even on networks whose lengths are not geodesic.
+
+    Attributes:
+        graph (CompiledGraph): The road network.
+        scale (float): The factor applied to the straight-line distances, at most 1.
+    """
+
+    def __init__(self, graph, csr=None, reverse_csr=None):
+        """
+        Projects the nodes on a plane in meters and computes the scale of the heuristic.
+
+        Args:
+            graph (CompiledGraph): The road network.
+            csr (tuple, optional): The (indptr, indices, lengths) lists of the graph.
+            reverse_csr (tuple, optional): The same lists for the reversed graph.
+        """
+        self.graph = graph
+        self._csr = csr or (graph.indptr.tolist(), graph.indices.tolist(), graph.lengths.tolist())
+        if reverse_csr is None:
+            reverse_graph = graph.reverse()
+            reverse_csr = (reverse_graph.indptr.tolist(), reverse_graph.indices.tolist(), reverse_graph.lengths.tolist())
+        self._reverse_csr = reverse_csr
+        # Equirectangular projection around the middle latitude: Euclidean, so the heuristic is consistent
+        meters = math.radians(1) * EARTH_RADIUS
+        latitude = math.radians((float(graph.y.min()) + float(graph.y.max())) / 2) if len(graph) else 0.0
+        x = np.asarray(graph.x) * meters * math.cos(latitude)
+        y = np.asarray(graph.y) * meters
+        sources = np.repeat(np.arange(len(graph)), np.diff(graph.indptr))
+        straight = np.hypot(x[graph.indices] - x[sources], y[graph.indices] - y[sources])
+        ratios = np.asarray(graph.lengths)[straight > 0] / straight[straight > 0]
+        self.scale = float(min(ratios.min(), 1.0)) if len(ratios) else 1.0
+        self._x = (x * self.scale).tolist()
+        self._y = (y * self.scale).tolist()
+
+    def route(self, source, target):
+        """
+        Returns the shortest route between two nodes (see Dijkstra.route).
+        """
+        if source == target:
+            return 0.0, [source]
+        xs, ys, hypot = self._x, self._y, math.hypot
+        sx, sy, tx, ty = xs[source], ys[source], xs[target], ys[target]
+        potentials = {}
+
+        def potential(v):
+            p = potentials.get(v)
+            if p is None:
+                x, y = xs[v], ys[v]
+                p = potentials[v] = (hypot(x - tx, y - ty) - hypot(x - sx, y - sy)) / 2
+            return p
+
+        # Forward keys are reduced by +potential, backward keys by -potential
+        searches = ((self._csr, {source: 0.0}, {source: -1}, [(0.0, source)], 1),
+                    (self._reverse_csr, {target: 0.0}, {target: -1}, [(0.0, target)], -1))
+        forward, backward = searches
+        settled = (set(), set())
+        best, meeting = INFINITY, -1
+        while forward[3] and backward[3] and forward[3][0][0] + backward[3][0][0] < best:
+            side = 0 if forward[3][0][0] <= backward[3][0][0] else 1
+            (indptr, indices, lengths), dist, links, heap, sign = searches[side]
+            other = searches[1 - side][1]
+            d, u = heapq.heappop(heap)
+            if u in settled[side]:
+                continue
+            settled[side].add(u)
+            pu = sign * potential(u)
+            for edge in range(indptr[u], indptr[u + 1]):
+                v = indices[edge]
+                candidate = d + lengths[edge] - pu + sign * potential(v)
+                if candidate < dist.get(v, INFINITY):
+                    dist[v] = candidate
+                    links[v] = u
+                    heapq.heappush(heap, (candidate, v))
+                    if v in other and candidate + other[v] < best:
+                        best, meeting = candidate + other[v], v
+        if meeting < 0:
+            return INFINITY, None
+        path = walk(forward[2], meeting, source)[::-1] + walk(backward[2], meeting, target)[1:]
+        return best + potential(source) - potential(target), path
+
+    def distance(self, source, target):
+        """
+        Returns the length of the shortest route between two node indices, inf if unreachable.
+        """
+        return self.route(source, target)[0]
+
+
+def create_backend(backend, graph, **options):
+    """
+    Creates the point-to-point routing of a backend name.
+
+    Args:
+        backend (str): "dijkstra", "astar" (bidirectional A*) or "ch" (contraction hierarchy, preprocessed once
+            and cached next to the compiled graphs, see services.contraction).
+        graph (CompiledGraph): The road network.
+        **options: csr and reverse_csr lists the caller already has.
+
+    Returns:
+        object: The backend, with route(source, target) and distance(source, target) methods over node indices.
+    """
+    if backend == "dijkstra":
+        return Dijkstra(graph, options.get("csr"))
+    if backend == "astar":
+        return BidirectionalAStar(graph, options.get("csr"), options.get("reverse_csr"))
+    if backend == "ch":
+        from services.contraction import load_hierarchy
+
+        return load_hierarchy(graph)
+    raise ValueError(f"Unknown routing backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+
+
+class StationRouter:
+    """
+    Routes vehicles using shortest-path trees precomputed for the fixed stations.
+
+    For every station a forward tree (station to every node) and a reverse tree (every node to the station)
+    are computed once with Dijkstra's algorithm on 'length' and kept as predecessor arrays. A route that
+    starts or ends at a station is then read off a tree in O(path length). Any other pair goes to the
+    point-to-point backend (see create_backend).
+
+    Attributes:
+        graph (CompiledGraph): The road network.
+        stations (list): OSM ids of the stations.
+        backend (object): The point-to-point routing used between two nodes that are not stations.
+        forward (dict): Station index -> (distance array, predecessor array) from the station.
+        reverse (dict): Station index -> (distance array, successor array) towards the station.
+    """
+
+    def __init__(self, graph, stations, backend=ROUTING_BACKEND):
+        """
+        Builds the trees of every station.
+
+        Args:
+            graph (CompiledGraph): The road network.
+            stations (list): OSM ids of the stations.
+            backend (str, optional): The point-to-point backend, see create_backend. Defaults to ROUTING_BACKEND.
+        """
+        self.graph = graph
+        self.stations = list(dict.fromkeys(stations))
+        self._node_ids = graph.node_ids.tolist()
+        self._csr = (graph.indptr.tolist(), graph.indices.tolist(), graph.lengths.tolist())
+        reverse_graph = graph.reverse()
+        self._reverse_csr = (reverse_graph.indptr.tolist(), reverse_graph.indices.tolist(), reverse_graph.lengths.tolist())
+        self.forward = {}
+        self.reverse = {}
+        for station in self.stations:
+            index = graph.index_of(station)
+            dist, pred = shortest_path_tree(*self._csr, index)
+            self.forward[index] = (np.array(dist), np.array(pred, dtype=np.int64))
+            dist, succ = shortest_path_tree(*self._reverse_csr, index)
+            self.reverse[index] = (np.array(dist), np.array(succ, dtype=np.int64))
+        self.backend = create_backend(backend, graph, csr=self._csr, reverse_csr=self._reverse_csr)
+
+    def shortest_path(self, source, target):
+        """
+        Returns the shortest route between two nodes, as `ox.shortest_path` would.
+
+        Args:
+            source (int): OSM id of the origin.
+            target (int): OSM id of the destination.
+
+        Returns:
+            list: OSM ids of the nodes on the route, or None if the target cannot be reached.
+        """
+        source_index = self.graph.index_of(source)
+        target_index = self.graph.index_of(target)
+        if source_index in self.forward:
+            path = self._walk(self.forward[source_index][1], target_index, source_index)
+            return path[::-1] if path else None
+        if target_index in self.reverse:
+            return self._walk(self.reverse[target_index][1], source_index, target_index)
+        _, path = self.backend.route(source_index, target_index)
+        return [self._node_ids[index] for index in path] if path else None
+
+    def distance(self, source, target):
+        """
+        Returns the length in meters of the shortest route between two nodes (inf if unreachable).
+        """
+        source_index = self.graph.index_of(source)
+        target_index = self.graph.index_of(target)
+        if source_index in self.forward:
+            return float(self.forward[source_index][0][target_index])
+        if target_index in self.reverse:
+            return float(self.reverse[target_index][0][source_index])
+        return float(self.backend.distance(source_index, target_index))
+
+    def is_station(self, node):
+        """
+        Returns True if the node has precomputed trees, making `distance` from it O(1).
+        """
+        return self.graph.index_of(node) in self.forward
+
+    def nodes_by_distance_to(self, target):
+        """
+        Yields the nodes in increasing order of their route length to the target, expanding a Dijkstra search
+        over the reversed graph only as far as the caller consumes it.
+
+        Args:
+            target (int): OSM id of the destination.
+
+        Yields:
+            tuple: (distance, OSM id) pairs.
+        """
+        indptr, indices, lengths = self._reverse_csr
+        target_index = self.graph.index_of(target)
+        dist = {target_index: 0.0}
+        settled = set()
+        heap = [(0.0, target_index)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            yield d, self._node_ids[u]
+            for edge in range(indptr[u], indptr[u + 1]):
+                v = indices[edge]
+                candidate = d + lengths[edge]
+                if candidate < dist.get(v, INFINITY):
+                    dist[v] = candidate
+                    heapq.heappush(heap, (candidate, v))
+
+    def _walk(self, links, start, end):
+        """
+        Follows predecessor (or successor) links from start until end and returns the visited OSM ids,
+        or None if end is never reached.
+        """
+        path = [self._node_ids[start]]
+        current = start
+        while current != end:
+            current = int(links[current])
+            if current < 0:
+                return None
+            path.append(self._node_ids[current])
+        return path
@@ -0,0 +1,208 @@
+import heapq
+import itertools
+import math
+import threading
+
+
+class QuantileSketch:
+    """
+    A streaming quantile sketch with bounded relative error (DDSketch).
+
+    Values are counted in logarithmic buckets whose bounds grow by a factor gamma = (1 + a) / (1 - a), so any
+    quantile is returned with a relative error of at most a. Memory and query cost depend on the range of the
+    values (a few hundred buckets for seconds to days at 1%), not on how many values were added.
+
+    Attributes:
+        relative_accuracy (float): The maximum relative error a of the quantiles.
+        count (int): The number of values added.
+        total (float): The sum of the values added.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self._buckets = {}
+        self._zeros = 0
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        """
+        Adds a non-negative value.
+        """
+        self.count += 1
+        self.total += value
+        if value <= 0:
+            self._zeros += 1
+            return
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self._buckets[key] = self._buckets.get(key, 0) + 1
+
+    def merge(self, other):
+        """
+        Adds the values of another sketch with the same accuracy, e.g. from another process.
+        """
+        self.count += other.count
+        self.total += other.total
+        self._zeros += other._zeros
+        for key, count in other._buckets.items():
+            self._buckets[key] = self._buckets.get(key, 0) + count
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q):
+        """
+        Returns the q-quantile (0 <= q <= 1) of the values added, or None if there are none.
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self._zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self._buckets):
+            seen += self._buckets[key]
+            if rank < seen:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self._buckets) / (self.gamma + 1)
+
+
+class IncidentStatistics:
+    """
+    Statistics of a run, updated incrementally from the events of the emergency response center.
+
+    Every incident is counted once, when the center first tries to dispatch vehicles to it, like the rows of the
+    emergencies table. Running counts per incident type, the top-k most severe incidents and the requested
+    resource totals are kept as they arrive. Response times (report to first arrival) and resolution times
+    (report to resolution) go into quantile sketches. Reading the statistics is O(1) in the length of the run and
+    needs no database.
+
+    Attributes:
+        incidents (int): The number of incidents handled.
+        type_counts (dict): Incident type -> number of incidents.
+        requested (list): Total police cars, firetrucks and ambulances requested.
+        response_times (QuantileSketch): Seconds from report to the first vehicle on site.
+        resolution_times (QuantileSketch): Seconds from report to resolution.
+        lock (threading.Lock): Lock protecting the statistics.
+    """
+
+    def __init__(self, top_k=5):
+        self.top_k = top_k
+        self.incidents = 0
+        self.type_counts = {}
+        self.requested = [0, 0, 0]
+        self.response_times = QuantileSketch()
+        self.resolution_times = QuantileSketch()
+        self.lock = threading.Lock()
+        self._most_severe = []  # Min-heap of (severity, -order, row) holding the top_k most severe incidents
+        self._order = itertools.count()
+
+    def record(self, event, time, incident, vehicle=None):
+        """
+        Updates the statistics with an event of the emergency response center.
+
+        Args:
+            event (str): "report", "triage", "dispatch", "arrival", "resolve" or "return".
+            time (float): Timestamp of the event.
+            incident (Incident): The incident concerned, None for "return".
+            vehicle (EmergencyVehicle, optional): The vehicle concerned.
+        """
+        with self.lock:
+            if event == "triage":
+                self.incidents += 1
+                self.type_counts[incident.incident_type] = self.type_counts.get(incident.incident_type, 0) + 1
+                police, firetrucks, ambulances = incident.vehicles_needed
+                self.requested[0] += police
+                self.requested[1] += firetrucks
+                self.requested[2] += ambulances
+                row = (incident.report_time, incident.incident_type, incident.location, incident.severity, police, firetrucks, ambulances)
+                entry = (incident.severity, -next(self._order), row)  # Ties keep the earliest incident
+                if len(self._most_severe) < self.top_k:
+                    heapq.heappush(self._most_severe, entry)
+                elif entry[0] > self._most_severe[0][0]:
+                    heapq.heapreplace(self._most_severe, entry)
+            elif event == "arrival" and incident.vehicles_arrived == 1:
+                self.response_times.add(time - incident.report_time)
+            elif event == "resolve":
+                self.resolution_times.add(time - incident.report_time)
+
+    def merge(self, other):
+        """
+        Adds the statistics of another run or district, e.g. received from another process.
+        """
+        with self.lock:
+            self.incidents += other.incidents
+            for incident_type, count in other.type_counts.items():
+                self.type_counts[incident_type] = self.type_counts.get(incident_type, 0) + count
+            self.requested = [mine + theirs for mine, theirs in zip(self.requested, other.requested)]
+            self.response_times.merge(other.response_times)
+            self.resolution_times.merge(other.resolution_times)
+            for severity, _, row in other._most_severe:
+                entry = (severity, -next(self._order), row)
+                if len(self._most_severe) < self.top_k:
+                    heapq.heappush(self._most_severe, entry)
+                elif entry[0] > self._most_severe[0][0]:
+                    heapq.heapreplace(self._most_severe, entry)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"], state["_order"]  # Neither can be pickled
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self._order = itertools.count(self.incidents)
+
+    def most_common_incident(self):
+        """
+        Returns the most frequent incident type, the first one seen in case of a tie.
+        """
+        return max(self.type_counts, key=self.type_counts.get) if self.type_counts else None
+
+    def most_severe(self):
+        """
+        Returns the top-k most severe incidents, most severe first, as
+        (time reported, type, location, severity, police, firetrucks, ambulances) tuples.
+        """
+        return [row for _, _, row in sorted(self._most_severe, reverse=True)]
+
+    def snapshot(self):
+        """
+        Returns the current statistics as a dictionary, safe to call at any time during the run.
+        """
+        with self.lock:
+            return {
+                "incidents": self.incidents,
+                "incident_types": dict(self.type_counts),
+                "most_common_incident": self.most_common_incident(),
+                "most_severe": self.most_severe(),
+                "requested": {"police": self.requested[0], "firetrucks": self.requested[1], "ambulances": self.requested[2]},
+                "response_time": self._summary(self.response_times),
+                "resolution_time": self._summary(self.resolution_times),
+            }
+
+    def write_to_file(self, filename='output.txt'):
+        """
+        Writes the summary of the run, in the same format as the SQL statistics.
+        """
+        stats = self.snapshot()
+        most_severe = stats["most_severe"][0] if stats["most_severe"] else (None,) * 7
+        time_reported, incident_type, location, severity, police, firetrucks, ambulances = most_severe
+        with open(filename, 'w') as f:
+            f.write(f"Number of incidents solved: {stats['incidents']}\n")
+            f.write(f"The most common incident: {stats['most_common_incident']}\n")
+            f.write(f"The most severe incident occurred at {time_reported} in {location}, ")
+            f.write(f"was a {incident_type} with a severity of {severity}. ")
+            f.write(f"It required {ambulances} ambulances, {firetrucks} firetrucks, ")
+            f.write(f"and {police} police cars.\n")
+            f.write(f"Total number of police cars requested: {stats['requested']['police']}\n")
+            f.write(f"Total number of firetrucks requested: {stats['requested']['firetrucks']}\n")
+            f.write(f"Total number of ambulances requested: {stats['requested']['ambulances']}\n")
+
+    @staticmethod
+    def _summary(sketch):
+        return {"count": sketch.count, "mean": sketch.mean(), "p50": sketch.quantile(0.5),
+                "p90": sketch.quantile(0.9), "p99": sketch.quantile(0.99)}
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import struct
+import threading
+import numpy as np
+from services.live_feed import collect, Frame, GROUPS, CAPACITY, DENSITY_BINS
+from utils.constants import TRACK_INTERVAL
+
+MAGIC = b"ERTRK\x00"
+TRACK_VERSION = 1
+HEADER = struct.Struct("<6sHI")  # Magic, version, length of the JSON metadata that follows
+RECORD = struct.Struct("<dIIIIIIII")  # Time, points per group, queued, active incidents, density map follows
+
+
+class TrackRecorder:
+    """
+    Records what the renderer shows (agent positions, active incidents, queue length) at regular intervals, so the
+    run can be rendered to a video afterwards (render.py) without simulating it again.
+
+    The track starts with a header (magic, version and JSON metadata: bounding box, base map) followed by one
+    RECORD per frame: its time, the number of points of each group and the counts of the panels, then the float32
+    coordinates of the points and, when the citizens were too many to store one by one, their density map. Frames
+    have a variable length; Track finds them by skipping from header to header.
+
+    The discrete-event engine captures a frame whenever its clock passes `next_time` (set it as the engine's
+    `track`); real-time engines are sampled by a thread, see start.
+
+    Attributes:
+        city (City): The city being recorded.
+        path (str): The track file.
+        interval (float): Seconds between two frames.
+        capacity (int): Points per frame.
+        next_time (float): Time of the next frame.
+        frames (int): The number of frames recorded.
+    """
+
+    def __init__(self, path, city, interval=TRACK_INTERVAL, capacity=CAPACITY, basemap=True):
+        """
+        Creates the track file, replacing any previous track at the same path.
+
+        Args:
+            path (str): The file to write.
+            city (City): The city to record.
+            interval (float, optional): Seconds between two frames. Defaults to TRACK_INTERVAL.
+            capacity (int, optional): Points per frame. Defaults to CAPACITY.
+            basemap (bool, optional): Render the cached base map of the street network now, for the renderer.
+                Defaults to True.
+        """
+        self.city = city
+        self.path = path
+        self.interval = interval
+        self.capacity = capacity
+        self.next_time = 0.0
+        self.frames = 0
+        self.lock = threading.Lock()
+        graph = city.compiled_graph
+        self._bbox = (float(graph.y.max()), float(graph.y.min()), float(graph.x.max()), float(graph.x.min()))
+        north, south, east, west = self._bbox
+        background = None
+        if basemap:
+            from utils.basemap import load_basemap, basemap_path
+            load_basemap(graph, north, south, east, west)  # Renders it on the first run only
+            background = os.path.abspath(basemap_path(graph, north, south, east, west))
+        meta = json.dumps({"north": north, "south": south, "east": east, "west": west, "basemap": background,
+                           "interval": interval, "groups": GROUPS, "density_bins": DENSITY_BINS}).encode()
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, TRACK_VERSION, len(meta)) + meta)
+        self._sampler = None
+        self._done = threading.Event()
+
+    def capture(self, now):
+        """
+        Records the current state of the city as a frame at time `now` and schedules the next one.
+
+        Args:
+            now (float): Seconds since the start of the run.
+        """
+        groups, density, incidents = collect(self.city, self.capacity, self._bbox)
+        center = self.city.emergency_response
+        points = np.concatenate(groups).astype(np.float32)
+        with self.lock:
+            self._file.write(RECORD.pack(now, *(len(group) for group in groups),
+                                         len(center.incident_queue) if center is not None else 0, len(incidents),
+                                         density is not None))
+            self._file.write(points.tobytes())
+            if density is not None:
+                self._file.write(density.tobytes())
+            self.frames += 1
+        while self.next_time <= now:
+            self.next_time += self.interval
+
+    def start(self):
+        """
+        Samples the city every `interval` seconds of wall-clock time from a thread, for the real-time engines.
+        """
+        started = time.time()
+
+        def sample():
+            while not self._done.wait(max(self.next_time - (time.time() - started), 0)):
+                self.capture(time.time() - started)
+
+        self._sampler = threading.Thread(target=sample, name="Track", daemon=True)
+        self._sampler.start()
+
+    def close(self):
+        """
+        Stops the sampling thread, if any, and closes the file.
+        """
+        self._done.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        with self.lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class Track:
+    """
+    Reads the frames of a track recorded by TrackRecorder.
+
+    Attributes:
+        path (str): The track file.
+        meta (dict): The metadata of the track.
+        times (np.ndarray): The time of every frame.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        offsets, times = [], []
+        with open(path, "rb") as f:
+            magic, version, length = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != TRACK_VERSION:
+                raise ValueError(f"{path} is not a track of version {TRACK_VERSION}")
+            self.meta = json.loads(f.read(length))
+            size = os.fstat(f.fileno()).st_size
+            offset = f.tell()
+            while offset + RECORD.size <= size:
+                f.seek(offset)
+                record = RECORD.unpack(f.read(RECORD.size))
+                end = offset + RECORD.size + sum(record[1:6]) * 8
+                if record[8]:
+                    end += DENSITY_BINS * DENSITY_BINS * 4
+                if end > size:
+                    break  # Cut short while being written
+                offsets.append(offset)
+                times.append(record[0])
+                offset = end
+        self._offsets = offsets
+        self.times = np.array(times)
+        self._file = None
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def frame(self, number):
+        """
+        Reads a frame.
+
+        Args:
+            number (int): The frame.
+
+        Returns:
+            Frame: The frame (see services.live_feed), without panel texts.
+        """
+        if self._file is None:
+            self._file = open(self.path, "rb")
+        self._file.seek(self._offsets[number])
+        record = RECORD.unpack(self._file.read(RECORD.size))
+        counts = record[1:6]
+        points = np.fromfile(self._file, dtype=np.float32, count=sum(counts) * 2).reshape(-1, 2)
+        density = None
+        if record[8]:
+            density = np.fromfile(self._file, dtype=np.float32, count=DENSITY_BINS * DENSITY_BINS).reshape(
+                DENSITY_BINS, DENSITY_BINS)
+        bounds = np.cumsum((0,) + counts)
+        groups = {group: points[bounds[i]:bounds[i + 1]] for i, group in enumerate(GROUPS)}
+        return Frame(number, record[0], groups, density, record[6], record[7], None)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -1,12 +1,16 @@
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from services.city import City
-import osmnx as ox
 from utils.constants import NORTH, SOUTH, EAST, WEST
+from utils.positions import node_coordinates
+from utils.basemap import load_basemap
 import numpy as np
 import time
 import logging
 
+DENSITY_BINS = 128  # Resolution of the citizens density map
+TEXT_LINES = 40  # Lines shown in the active incidents and queue panels
+
 
 class Simulation:
     """
@@ -22,6 +26,9 @@ class Simulation:
     - police_scatter: The scatter plot object for police.
     - firetruck_scatter: The scatter plot object for firetrucks.
     - ambulance_scatter: The scatter plot object for ambulances.
+    - density_image: The image showing the density of citizens when there are too many to draw one by one.
+    - render: "raster" to draw the street network from a cached image, "vector" to draw it with OSMnx.
+    - lod_threshold: Number of citizens in view above which they are drawn as a density map.
     - end: A boolean indicating whether the simulation has ended.
 
     Methods:
@@ -31,15 +38,18 @@ class Simulation:
     - update_texts: Updates the text information for active incidents and incident queue.
     - run: Runs the simulation by starting the emergency services, plotting the map, and animating the map updates.
     """
-    def __init__(self, city):
+    def __init__(self, city, render="raster", lod_threshold=2000):
         self.city = city
-        self.graph = city.graph 
+        self.graph = city.compiled_graph
         self.fig, self.ax = None, None
         self.citizen_scatter = None
         self.incident_scatter = None
         self.police_scatter = None
         self.firetruck_scatter = None
         self.ambulance_scatter = None
+        self.density_image = None
+        self.render = render
+        self.lod_threshold = lod_threshold
         self.end = False
 
     def plot_map(self):
@@ -51,7 +61,15 @@ class Simulation:
 
         # Map subplot
         self.ax = self.fig.add_subplot(gs[0, :]) 
-        ox.plot_graph(self.graph, ax=self.ax, node_size=0, show=False)
+        if self.render == "raster":
+            # The street network never changes: draw it once into an image instead of thousands of line artists
+            basemap = load_basemap(self.graph, NORTH, SOUTH, EAST, WEST)
+            self.ax.imshow(basemap, extent=[WEST, EAST, SOUTH, NORTH], interpolation='bilinear', zorder=0)
+            self.ax.set_axis_off()
+        else:
+            import osmnx as ox
+
+            ox.plot_graph(self.city.graph, ax=self.ax, node_size=0, show=False)
         self.ax.set_xlim([WEST, EAST])
         self.ax.set_ylim([SOUTH, NORTH])
         self.fig.subplots_adjust(top=0.95)
@@ -61,6 +79,10 @@ class Simulation:
         self.police_scatter = self.ax.scatter([], [], c='blue', s=30, label='Police')
         self.firetruck_scatter = self.ax.scatter([], [], c='red', s=30, label='Firetrucks')
         self.ambulance_scatter = self.ax.scatter([], [], c='green', s=30, label='Ambulances')
+        self.density_image = self.ax.imshow(np.zeros((DENSITY_BINS, DENSITY_BINS)), extent=[WEST, EAST, SOUTH, NORTH],
+                                            origin='lower', cmap='magma', alpha=0.6, zorder=1, visible=False)
+        self.ax.set_aspect('auto')
+        self.ax.legend(loc='upper right')  # Static, drawn once with the background
         self.ax_active_incidents = self.fig.add_subplot(gs[1, 0])
         self.ax_active_incidents.axis('off')
         self.active_incidents_text = self.ax_active_incidents.text(0, 1, '', ha='left', va='top', color='white')
@@ -76,11 +98,6 @@ class Simulation:
 
         mng = plt.get_current_fig_manager()
         mng.full_screen_toggle()
-        
-
-        self.anim = FuncAnimation(self.fig, self.refresh_map, interval=100, cache_frame_data=False)
-        plt.legend()
-        plt.show()
 
     def start_simulation(self):
         """
@@ -89,6 +106,7 @@ class Simulation:
         self.deploy_emergency_services()
         self.deploy_citizens()
         self.plot_map()
+        plt.show()
 
     def refresh_map(self, frame):
         """
@@ -100,18 +118,13 @@ class Simulation:
         Returns:
         A tuple of "artists" that have been changed.
         """
-        citizen_nodes = [citizen.current_node for citizen in self.city.citizens]
-        police_nodes = [police.current_node for police in self.city.police_onsite]
-        firetruck_nodes = [firetruck.current_node for firetruck in self.city.firetrucks_onsite]
-        incident_nodes = [incident.location for incident in self.city.emergency_response.active_incidents.values()]
-        ambulance_nodes = [ambulance.current_node for ambulance in self.city.ambulances_onsite]
-
-        # Get coordinates for each group
-        citizen_coords = [[self.graph.nodes[node]['x'], self.graph.nodes[node]['y']] for node in citizen_nodes] if citizen_nodes else np.empty((0, 2))
-        police_coords = [[self.graph.nodes[node]['x'], self.graph.nodes[node]['y']] for node in police_nodes] if police_nodes else np.empty((0, 2))
-        firetruck_coords = [[self.graph.nodes[node]['x'], self.graph.nodes[node]['y']] for node in firetruck_nodes] if firetruck_nodes else np.empty((0, 2))
-        ambulance_coords = [[self.graph.nodes[node]['x'], self.graph.nodes[node]['y']] for node in ambulance_nodes] if ambulance_nodes else np.empty((0, 2))
-        incident_coords = [[self.graph.nodes[node]['x'], self.graph.nodes[node]['y']] for node in incident_nodes] if incident_nodes else np.empty((0, 2))
+        # Agents publish their node into shared arrays, so each group is a single fancy-indexing lookup
+        citizen_coords = self.level_of_detail(self.city.positions["citizens"].coordinates())
+        police_coords = self.city.positions["police"].coordinates()
+        firetruck_coords = self.city.positions["firetrucks"].coordinates()
+        ambulance_coords = self.city.positions["ambulances"].coordinates()
+        incidents = list(self.city.emergency_response.active_incidents.values())
+        incident_coords = node_coordinates(self.city.compiled_graph, (incident.location for incident in incidents)) if incidents else np.empty((0, 2))
 
         # Update scatters with new positions
         self.citizen_scatter.set_offsets(citizen_coords)
@@ -120,10 +133,32 @@ class Simulation:
         self.ambulance_scatter.set_offsets(ambulance_coords)
         self.incident_scatter.set_offsets(incident_coords)
         self.update_texts()
-        self.ax.legend()
 
         # We need to return a tuple of "artists" that have been changed
-        return self.citizen_scatter, self.incident_scatter, self.police_scatter, self.firetruck_scatter, self.ambulance_scatter, self.active_incidents_text, self.queue_text
+        return self.density_image, self.citizen_scatter, self.incident_scatter, self.police_scatter, self.firetruck_scatter, self.ambulance_scatter, self.active_incidents_text, self.queue_text
+
+    def level_of_detail(self, coords):
+        """
+        Switches the citizens to a density map when too many of them are in view to draw one by one.
+
+        Parameters:
+        - coords: The (n, 2) coordinates of the citizens.
+
+        Returns:
+        The coordinates to draw as individual points, empty when the density map is shown instead.
+        """
+        (x_min, x_max), (y_min, y_max) = self.ax.get_xlim(), self.ax.get_ylim()
+        in_view = (coords[:, 0] >= x_min) & (coords[:, 0] <= x_max) & (coords[:, 1] >= y_min) & (coords[:, 1] <= y_max)
+        if np.count_nonzero(in_view) <= self.lod_threshold:
+            self.density_image.set_visible(False)
+            return coords
+        density, _, _ = np.histogram2d(coords[in_view, 1], coords[in_view, 0], bins=DENSITY_BINS,
+                                       range=[[y_min, y_max], [x_min, x_max]])
+        self.density_image.set_data(np.log1p(density))
+        self.density_image.set_extent([x_min, x_max, y_min, y_max])
+        self.density_image.set_clim(0, max(np.log1p(density.max()), 1))
+        self.density_image.set_visible(True)
+        return np.empty((0, 2))
 
 
     def update_texts(self):
@@ -133,20 +168,24 @@ class Simulation:
         # Update text for active incidents
         active_incidents = self.city.emergency_response.active_incidents
         active_incidents_info = "\n".join([f"Incident {id} - {incident.incident_type} - Severity {round(incident.severity,2)}"
-                                          for id, incident in active_incidents.items()])
+                                          for id, incident in list(active_incidents.items())[:TEXT_LINES]])
         self.active_incidents_text.set_text(active_incidents_info)
 
         # Update text for incident queue
         incident_queue_info = "\n".join([f"Incident {incident_id} - Priority {round(priority,2)}"
-                                        for priority, incident_id in self.city.emergency_response.incident_queue.queue])
+                                        for priority, incident_id in self.city.emergency_response.incident_queue.snapshot(TEXT_LINES)])
         self.queue_text.set_text(incident_queue_info)
 
-    def run(self):
+    def run(self, start=True):
         """
         Runs the simulation by starting the emergency services, plotting the map, and animating the map updates.
+
+        Parameters:
+        - start: Whether to start the services. False draws a city driven by something else, like a replay.
         """
-        self.city.start_services()
+        if start:
+            self.city.start_services()
         self.plot_map()
-        self.anim = FuncAnimation(self.fig, self.refresh_map, interval=50, blit=True)
-        plt.legend()
+        # Only the scatters, the density map and the texts are redrawn; the background is blitted
+        self.anim = FuncAnimation(self.fig, self.refresh_map, interval=50, blit=True, cache_frame_data=False)
         plt.show()
\ No newline at end of file
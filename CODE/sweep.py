@@ -0,0 +1,163 @@
+import os
+import csv
+import math
+import time
+import logging
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from utils.constants import NORTH, SOUTH, EAST, WEST, FIRE_TRUCKS, AMBULANCES, POLICE_CARS, NCITIZENS, CITIZEN_REPORT_PROBABILITY
+from utils.graph_cache import load_graph
+
+# Parameters that can be swept, with their type and default value
+PARAMETERS = {
+    "FIRE_TRUCKS": (int, FIRE_TRUCKS),
+    "AMBULANCES": (int, AMBULANCES),
+    "POLICE_CARS": (int, POLICE_CARS),
+    "NCITIZENS": (int, NCITIZENS),
+    "CITIZEN_REPORT_PROBABILITY": (float, CITIZEN_REPORT_PROBABILITY),
+}
+
+# Two-sided 95% Student t quantiles by degrees of freedom, 1.96 beyond the table
+T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131,
+        2.120, 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+_graph = None  # The compiled graph of the worker process, memory-mapped so every worker shares the same pages
+
+
+def _init_worker():
+    """
+    Loads the compiled graph once per worker process and silences the per-incident logging.
+    """
+    global _graph
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+    _graph = load_graph(NORTH, SOUTH, EAST, WEST, network_type='drive')
+
+
+def run_replication(config, replication, seed):
+    """
+    Runs one headless simulation of a configuration.
+
+    Args:
+        config (dict): Parameter name -> value, for the names in PARAMETERS.
+        replication (int): Index of the replication.
+        seed (int): Seed of the per-agent random streams of this replication.
+
+    Returns:
+        dict: The configuration, the replication index and the results of the run.
+    """
+    from services.city import City
+    from services.event_engine import DiscreteEventEngine
+
+    city = City(config["NCITIZENS"], "memory", fire_trucks=config["FIRE_TRUCKS"], police_cars=config["POLICE_CARS"],
+                ambulances=config["AMBULANCES"], compiled_graph=_graph, seed=seed)
+    started = time.time()
+    stats = DiscreteEventEngine(city, report_probability=config["CITIZEN_REPORT_PROBABILITY"]).run(write_output=False)
+    return dict(config, replication=replication, seed=seed, incidents=stats["incidents"],
+                response_time_mean=stats["response_time"]["mean"], response_time_p90=stats["response_time"]["p90"],
+                resolution_time_mean=stats["resolution_time"]["mean"], wall_time=time.time() - started)
+
+
+def confidence_interval(values):
+    """
+    Returns the mean of the values and the half-width of its 95% confidence interval (None with a single value).
+    """
+    values = [value for value in values if value is not None]
+    if not values:
+        return None, None
+    mean = sum(values) / len(values)
+    if len(values) < 2:
+        return mean, None
+    variance = sum((value - mean) ** 2 for value in values) / (len(values) - 1)
+    t = T_95[len(values) - 2] if len(values) - 1 <= len(T_95) else 1.96
+    return mean, t * math.sqrt(variance / len(values))
+
+
+def summarize(rows, names):
+    """
+    Groups the replications by configuration and computes the mean and 95% confidence interval of the results.
+
+    Args:
+        rows (list): The dictionaries returned by run_replication.
+        names (list): The parameter names of a configuration.
+
+    Returns:
+        list: One dictionary per configuration.
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row[name] for name in names), []).append(row)
+    summary = []
+    for key, group in groups.items():
+        result = dict(zip(names, key), replications=len(group))
+        for metric in ("response_time_mean", "response_time_p90", "resolution_time_mean", "incidents"):
+            mean, half_width = confidence_interval([row[metric] for row in group])
+            result[metric] = mean
+            result[metric + "_ci_low"] = None if half_width is None else mean - half_width
+            result[metric + "_ci_high"] = None if half_width is None else mean + half_width
+        summary.append(result)
+    return summary
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def parse_grid(specs):
+    """
+    Parses NAME=v1,v2,... specifications into a grid of values, using the constants for unspecified parameters.
+    """
+    grid = {name: [default] for name, (_, default) in PARAMETERS.items()}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in PARAMETERS:
+            raise ValueError(f"Unknown parameter {name!r}, expected one of {', '.join(PARAMETERS)}")
+        grid[name] = [PARAMETERS[name][0](value) for value in values.split(",")]
+    return grid
+
+
+def sweep(grid, replications, workers=None, seed=0):
+    """
+    Runs every configuration of the grid `replications` times across a process pool.
+
+    Args:
+        grid (dict): Parameter name -> list of values.
+        replications (int): Number of replications per configuration.
+        workers (int, optional): Number of processes. Defaults to the number of CPUs.
+        seed (int, optional): Base seed; replication i of every configuration uses seed + i. Defaults to 0.
+
+    Returns:
+        list: The result of every replication.
+    """
+    names = list(grid)
+    configs = [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+    load_graph(NORTH, SOUTH, EAST, WEST, network_type='drive')  # Build the cache once before the workers map it
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker) as pool:
+        futures = [pool.submit(run_replication, config, replication, seed + replication)
+                   for config in configs for replication in range(replications)]
+        return [future.result() for future in futures]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format="%(asctime)s  %(message)s", level=logging.INFO, datefmt="%H:%M:%S")
+    parser = argparse.ArgumentParser(description="Monte Carlo parameter sweep of the headless simulation")
+    parser.add_argument("--grid", action="append", default=[], metavar="NAME=v1,v2,...",
+                        help=f"values of a parameter, one of {', '.join(PARAMETERS)} (repeatable)")
+    parser.add_argument("--replications", type=int, default=10, help="runs per configuration")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all CPUs)")
+    parser.add_argument("--seed", type=int, default=0, help="base random seed")
+    parser.add_argument("--output", default="sweep_results.csv", help="summary table per configuration")
+    parser.add_argument("--raw", default=None, help="optional table with one row per replication")
+    args = parser.parse_args()
+
+    grid = parse_grid(args.grid)
+    started = time.time()
+    rows = sweep(grid, args.replications, args.workers, args.seed)
+    write_csv(args.output, summarize(rows, list(grid)))
+    if args.raw:
+        write_csv(args.raw, rows)
+    logging.info(f"Ran {len(rows)} simulations in {round(time.time() - started, 1)} s, results in {args.output}")
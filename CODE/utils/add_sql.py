@@ -1,45 +1,53 @@
-from utils.constants import NINCIDENTS_PER_CITIZEN, NCITIZENS, SQL_PASSWORD, SQL_USER
-import mysql.connector
+import threading
+from utils.constants import NINCIDENTS_PER_CITIZEN, NCITIZENS, SQL_PASSWORD, SQL_USER, STORAGE_BACKEND, SQLITE_PATH, STORAGE_BATCH_SIZE
+from utils.storage import create_storage, BatchWriter
 
-# Recall to start SQL
+# Recall to start SQL when using the MySQL backend
 class sql:
     """
     A class representing SQL operations for managing emergency incidents.
 
     Attributes:
-    - all_incidents (dict): A dictionary to store all incidents.
-    - cnx (mysql.connector.connection.MySQLConnection): The MySQL connection object.
-    - cursor (mysql.connector.cursor.MySQLCursor): The MySQL cursor object.
-    - mycursor (mysql.connector.cursor.MySQLCursor): The MySQL cursor object for executing queries.
+    - backend (str): The storage backend: "mysql", "sqlite" or "memory".
+    - storage (Storage): The database the emergencies table is stored in (MySQL, SQLite file or in-memory SQLite),
+      connected on first use.
+    - writer (BatchWriter): The background thread streaming incidents to the storage in batches, None until then.
 
     Methods:
-    - __init__(self): Initializes the SQL class and establishes a connection to the database.
-    - add_incident(self, time_reported, type, location, severity, required_police, required_firetrucks, required_ambulances): Adds an incident to the all_incidents dictionary.
-    - add_data(self): Inserts the data from all_incidents dictionary into the emergencies table in the database.
+    - __init__(self, backend): Records the backend; nothing is connected until an incident is stored or queried.
+    - add_incident(self, time_reported, type, location, severity, required_police, required_firetrucks, required_ambulances): Queues an incident for writing.
+    - add_data(self): Waits until every queued incident is written to the emergencies table.
+    - close(self): Stops the batch writer and closes the connection.
     - write_to_file(self): Retrieves various statistics from the emergencies table and writes them to a file.
     """
-    def __init__(self):
-        self.all_incidents = {}
-        self.cnx = mysql.connector.connect(user=SQL_USER, password=SQL_PASSWORD,
-                                      host='127.0.0.1')
-        self.cursor = self.cnx.cursor()
-
-        try:
-            self.cursor.execute("DROP DATABASE MadEmergencies")
-        except mysql.connector.errors.DatabaseError:
-            print('Creating database')
-
-        self.cursor.execute("CREATE DATABASE MadEmergencies")
-        self.cnx = mysql.connector.connect(user=SQL_USER, password=SQL_PASSWORD,
-                                           host='127.0.0.1', database='MadEmergencies')
-        self.mycursor = self.cnx.cursor()
-        self.mycursor.execute("CREATE TABLE emergencies (id INT AUTO_INCREMENT PRIMARY KEY, time_reported VARCHAR(255), "
-                              "incident_type VARCHAR(255), location VARCHAR(255), severity INT, required_police INT, "
-                                "required_firetrucks INT, required_ambulances INT)")
+    def __init__(self, backend=STORAGE_BACKEND):
+        self.backend = backend
+        self.writer = None
+        self._storage = None
+        self._lock = threading.Lock()
+
+    @property
+    def storage(self):
+        """
+        The storage, connected and given its batch writer on first use, so that building an emergency response
+        center opens no connection.
+        """
+        if self._storage is None:
+            self._connect()
+        return self._storage
+
+    def _connect(self):
+        with self._lock:
+            if self._storage is None:
+                storage = create_storage(self.backend, user=SQL_USER, password=SQL_PASSWORD, path=SQLITE_PATH)
+                self.writer = BatchWriter(storage, batch_size=STORAGE_BATCH_SIZE)
+                self.writer.start()
+                self._storage = storage
 
     def add_incident(self, time_reported, type, location, severity, required_police, required_firetrucks, required_ambulances):
         """
-        Adds an incident to the all_incidents dictionary.
+        Queues an incident to be written to the emergencies table by the batch writer.
+        An incident dispatched several times is only stored once.
 
         Parameters:
         - time_reported (str): The time the incident was reported.
@@ -49,47 +57,48 @@ class sql:
         - required_police (int): The number of police required for the incident.
         - required_firetrucks (int): The number of firetrucks required for the incident.
         - required_ambulances (int): The number of ambulances required for the incident.
-
-        Returns:
-        - bool: True if the incident was added successfully, False if the incident already exists.
         """
         unique_id = f"{time_reported}_{type}_{location}"  # Create a unique identifier
-        if unique_id not in self.all_incidents:
-            self.all_incidents[unique_id] = (time_reported, type, location, severity, required_police, required_firetrucks, required_ambulances)
-            return True
-        return False
+        if self._storage is None:
+            self._connect()
+        self.writer.put((unique_id, str(time_reported), type, str(location), severity, required_police, required_firetrucks, required_ambulances))
 
     def add_data(self):
         """
-        Inserts the data from all_incidents dictionary into the emergencies table in the database.
+        Waits until every queued incident has been inserted into the emergencies table.
         """
-        statement = ("INSERT INTO emergencies (time_reported, incident_type, location, severity, required_police, required_firetrucks, "
-                    "required_ambulances) VALUES (%s, %s, %s, %s, %s, %s, %s)")
-        self.mycursor.executemany(statement, list(self.all_incidents.values()))
-        self.cnx.commit()
-        self.all_incidents.clear()  # Clear the dictionary after data is added
+        if self.writer is not None:
+            self.writer.flush()
         print("Data added to SQL")
 
 
-    def write_to_file(self):
+    def close(self):
+        """
+        Writes the remaining incidents, stops the batch writer and closes the connection.
+        """
+        if self._storage is not None:
+            self.writer.close()
+            self._storage.close()
+
+    def write_to_file(self, filename='output.txt'):
         """
         Retrieves various statistics from the emergencies table and writes them to a file.
+
+        Parameters:
+        - filename (str): The file to write to.
         """
         all = {}
-        query = "SELECT MAX(id) as max_incident_id FROM emergencies"
-        self.mycursor.execute(query)
-        result = self.mycursor.fetchone()
+        query = "SELECT COUNT(*) as number_of_incidents FROM emergencies"
+        result = self.storage.fetchone(query)
         all['Number of incidents'] = result[0]
 
         query = "SELECT incident_type as most_common_incident_type FROM emergencies GROUP BY incident_type ORDER BY COUNT(*) DESC LIMIT 1"
-        self.mycursor.execute(query)
-        result = self.mycursor.fetchone()
+        result = self.storage.fetchone(query)
         all['Most common incident'] = result[0]
 
         # Most severe incident
         query = "SELECT * FROM emergencies WHERE severity = (SELECT MAX(severity) FROM emergencies) LIMIT 1"
-        self.mycursor.execute(query)
-        result = self.mycursor.fetchone()
+        result = self.storage.fetchone(query)
         all['Most severe incident (time reported)'] = result[1]
         all['Most severe incident (type)'] = result[2]
         all['Most severe incident (location)'] = result[3]
@@ -103,13 +112,12 @@ class sql:
             "SELECT SUM(required_police) as sum_required_police, SUM(required_firetrucks) as sum_required_firetrucks, "
             "SUM(required_ambulances) as sum_required_ambulances FROM emergencies")
 
-        self.mycursor.execute(query)
-        result = self.mycursor.fetchone()
+        result = self.storage.fetchone(query)
         all['Total police requested'] = result[0]
         all['Total firetrucks requested'] = result[1]
         all['Total ambulances requested'] = result[2]
 
-        with open('output.txt', 'w') as f:
+        with open(filename, 'w') as f:
             f.write(f"Number of incidents solved: {all['Number of incidents']}\n")
             f.write(f"The most common incident: {all['Most common incident']}\n")
             f.write(f"The most severe incident occurred at {all['Most severe incident (time reported)']} in {all['Most severe incident (location)']}, ")
@@ -0,0 +1,70 @@
+import os
+import logging
+import numpy as np
+from utils.graph_cache import GRAPH_CACHE_DIR, cache_key, graph_digest
+
+BASEMAP_CACHE_DIR = os.path.join(os.path.dirname(GRAPH_CACHE_DIR), "basemaps")
+BACKGROUND_COLOR = '#111111'  # Same style as ox.plot_graph
+EDGE_COLOR = '#999999'
+
+
+def render_basemap(graph, north, south, east, west, path, width=2000, height=1600):
+    """
+    Draws the street network once into a PNG, without axes, covering exactly the bounding box.
+
+    Args:
+        graph (CompiledGraph): The road network.
+        north, south, east, west (float): The bounding box drawn.
+        path (str): Where to write the PNG.
+        width, height (int, optional): Size of the image in pixels. Defaults to 2000x1600.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import LineCollection
+    from matplotlib.figure import Figure
+
+    sources = np.repeat(np.arange(len(graph.node_ids)), np.diff(graph.indptr))
+    segments = np.stack((np.column_stack((graph.x[sources], graph.y[sources])),
+                         np.column_stack((graph.x[graph.indices], graph.y[graph.indices]))), axis=1)
+
+    dpi = 100
+    fig = Figure(figsize=(width / dpi, height / dpi), dpi=dpi, facecolor=BACKGROUND_COLOR)
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    ax.set_facecolor(BACKGROUND_COLOR)
+    ax.add_collection(LineCollection(segments, colors=EDGE_COLOR, linewidths=1, antialiased=True))
+    ax.set_xlim(west, east)
+    ax.set_ylim(south, north)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fig.savefig(path + ".tmp.png", facecolor=BACKGROUND_COLOR)
+    os.replace(path + ".tmp.png", path)
+    logging.info(f"Rendered base map with {len(segments)} edges to {path}")
+
+
+def basemap_path(graph, north, south, east, west, width=2000, height=1600, cache_dir=BASEMAP_CACHE_DIR):
+    """
+    Returns the file the base map of a road network and bounding box is cached in. The name holds the digest of
+    the network, so a synthetic city never shows the streets of another network covering the same bounding box.
+    """
+    return os.path.join(cache_dir, f"{graph_digest(graph)}_{cache_key(north, south, east, west)}_{width}x{height}.png")
+
+
+def load_basemap(graph, north, south, east, west, width=2000, height=1600, cache_dir=BASEMAP_CACHE_DIR):
+    """
+    Returns the pre-rasterized street network of a bounding box, rendering it on the first call for the network.
+
+    Args:
+        graph (CompiledGraph): The road network.
+        north, south, east, west (float): The bounding box.
+        width, height (int, optional): Size of the image in pixels. Defaults to 2000x1600.
+        cache_dir (str, optional): Where the images are stored. Defaults to BASEMAP_CACHE_DIR.
+
+    Returns:
+        np.ndarray: The RGBA image, to be shown with imshow(extent=[west, east, south, north]).
+    """
+    import matplotlib.image as mpimg
+
+    path = basemap_path(graph, north, south, east, west, width, height, cache_dir)
+    if not os.path.exists(path):
+        render_basemap(graph, north, south, east, west, path, width, height)
+    return mpimg.imread(path)
@@ -11,6 +11,15 @@ CITIZEN_WAIT_TIME = (5, 15)
 CITIZEN_REPORT_PROBABILITY = 0.3
 SQL_USER = 'root'
 SQL_PASSWORD = 'JoseAlcala'
+STORAGE_BACKEND = 'mysql'  # 'mysql', 'sqlite' (SQLITE_PATH file) or 'memory'
+SQLITE_PATH = 'emergencies.db'
+STORAGE_BATCH_SIZE = 500
+SQL_CROSS_CHECK = False  # Also compute output.txt with SQL, into output_sql.txt
+SEED = None  # Seed of the per-agent random streams, None for a different run every time
+VECTORIZED_CITIZENS = False  # Citizens as one CitizenPopulation of arrays instead of one thread each, for large NCITIZENS
+CHECKPOINT_INTERVAL = 300  # Simulated seconds between two checkpoints of a discrete-event run
+TRACK_INTERVAL = 1.0  # Seconds between two frames recorded for render.py
+ROUTING_BACKEND = 'dijkstra'  # Routing between two non-station nodes: 'dijkstra', 'astar' (bidirectional A*) or 'ch' (contraction hierarchy)
 
 INCIDENTS = {
             'petty_theft': {
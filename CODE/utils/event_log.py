@@ -0,0 +1,129 @@
+import json
+import struct
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+from utils.incident_catalog import CATALOG
+
+MAGIC = b"ERLOG\x00"
+LOG_VERSION = 1
+HEADER = struct.Struct("<6sHI")  # Magic, version, length of the JSON metadata that follows
+RECORD = struct.Struct("<dBBBxIIq")  # 28 bytes: time, event, incident type, vehicle type, pad, vehicle id, incident id, node
+RECORD_DTYPE = np.dtype([("time", "<f8"), ("event", "u1"), ("incident_type", "u1"), ("vehicle_type", "u1"),
+                         ("pad", "u1"), ("vehicle_id", "<u4"), ("incident_id", "<u4"), ("node", "<i8")])
+EVENTS = ("report", "triage", "dispatch", "arrival", "resolve", "return")
+VEHICLE_TYPES = ("Police-Car", "Fire-Truck", "Ambulance")
+
+LogEvent = namedtuple("LogEvent", "time event incident_id incident_type vehicle_type vehicle_id node")
+
+
+class EventLog:
+    """
+    Append-only binary log of the events of the emergency response center.
+
+    The log starts with a small header (magic, version and JSON metadata: seed, epoch and the tables decoding
+    the type codes) followed by one fixed-width RECORD per event. Event, incident type and vehicle type are
+    stored as one-byte codes, 0 meaning none, and the time as seconds since the epoch of the log. Fixed-width
+    records keep writing to a buffered append and let the whole log be read back with a single np.fromfile.
+
+    Used as a recorder of the emergency response center, like IncidentStatistics.
+
+    Attributes:
+        path (str): The file the log is written to.
+        epoch (float): Timestamp that corresponds to time 0 in the records.
+        records (int): The number of records written.
+    """
+
+    def __init__(self, path, seed=None, epoch=None, records=None):
+        """
+        Creates the log file, replacing any previous log at the same path.
+
+        Args:
+            path (str): The file to write.
+            seed (int, optional): The seed of the run, stored in the header.
+            epoch (float, optional): Timestamp of time 0. Defaults to the current wall-clock time.
+            records (int, optional): Continue the existing log at path after its first `records` records instead
+                of replacing it, e.g. when a run resumes from a checkpoint. Defaults to a new log.
+        """
+        self.path = path
+        self.epoch = time.time() if epoch is None else epoch
+        self.records = 0
+        self.lock = threading.Lock()
+        self._event_codes = {name: code for code, name in enumerate(EVENTS, 1)}
+        self._vehicle_codes = {name: code for code, name in enumerate(VEHICLE_TYPES, 1)}
+        if records is not None:
+            self._file = open(path, "r+b")
+            magic, version, length = HEADER.unpack(self._file.read(HEADER.size))
+            if magic != MAGIC or version != LOG_VERSION:
+                raise ValueError(f"{path} is not an event log of version {LOG_VERSION}")
+            self._file.seek(HEADER.size + length + records * RECORD.size)
+            self._file.truncate()  # Drop what was recorded after the point the run resumes from
+            self.records = records
+            return
+        meta = json.dumps({"seed": seed, "epoch": self.epoch, "events": EVENTS, "incident_types": CATALOG.names,
+                           "vehicle_types": VEHICLE_TYPES}).encode()
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, LOG_VERSION, len(meta)) + meta)
+
+    def record(self, event, time, incident, vehicle=None):
+        """
+        Appends an event (see EmergencyResponseCenter.notify).
+        """
+        if vehicle is not None:
+            node = vehicle.current_node
+        else:
+            node = incident.location if incident is not None else -1
+        packed = RECORD.pack(time - self.epoch, self._event_codes[event],
+                             incident.type_code + 1 if incident is not None else 0,
+                             self._vehicle_codes.get(vehicle.vehicle_type, 0) if vehicle is not None else 0,
+                             vehicle.id if vehicle is not None else 0,
+                             incident.id if incident is not None else 0, node)
+        with self.lock:
+            self._file.write(packed)
+            self.records += 1
+
+    def flush(self):
+        """
+        Writes the buffered records to the file, so the first `records` records are on disk.
+        """
+        with self.lock:
+            self._file.flush()
+
+    def close(self):
+        with self.lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def read_log(path):
+    """
+    Reads a whole event log.
+
+    Args:
+        path (str): The log file.
+
+    Returns:
+        tuple: The metadata of the header (dict) and the records (np.ndarray with dtype RECORD_DTYPE).
+    """
+    with open(path, "rb") as f:
+        magic, version, length = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != LOG_VERSION:
+            raise ValueError(f"{path} is not an event log of version {LOG_VERSION}")
+        meta = json.loads(f.read(length))
+        records = np.fromfile(f, dtype=RECORD_DTYPE)
+    return meta, records
+
+
+def decode(meta, records):
+    """
+    Yields the records of a log as LogEvent tuples with the type codes replaced by their names
+    (None for no incident type or vehicle type).
+    """
+    events = meta["events"]
+    incident_types = [None] + meta["incident_types"]
+    vehicle_types = [None] + meta["vehicle_types"]
+    for record in records.tolist():
+        time, event, incident_type, vehicle_type, _, vehicle_id, incident_id, node = record
+        yield LogEvent(time, events[event - 1], incident_id, incident_types[incident_type], vehicle_types[vehicle_type],
+                       vehicle_id, node)
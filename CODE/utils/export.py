@@ -0,0 +1,216 @@
+import os
+import sys
+import glob
+import json
+import time
+import queue
+import threading
+import numpy as np
+from utils.incident_catalog import CATALOG
+from utils.event_log import VEHICLE_TYPES
+
+CHUNK_ROWS = 65536  # Rows buffered per table before a chunk is compressed and written
+INCIDENT_DTYPE = np.dtype([("id", "<u4"), ("type_code", "u1"), ("police_cars", "u1"), ("firetrucks", "u1"),
+                           ("ambulances", "u1"), ("severity", "<i2"), ("vehicles", "<u2"), ("node", "<i8"),
+                           ("report_time", "<f8"), ("triage_time", "<f8"), ("dispatch_time", "<f8"),
+                           ("arrival_time", "<f8"), ("resolve_time", "<f8")])
+TRIP_DTYPE = np.dtype([("vehicle_type", "u1"), ("vehicle_id", "<u4"), ("incident_id", "<u4"), ("start_node", "<i8"),
+                       ("incident_node", "<i8"), ("dispatch_time", "<f8"), ("arrival_time", "<f8"),
+                       ("return_time", "<f8")])
+TABLES = {"incidents": INCIDENT_DTYPE, "trips": TRIP_DTYPE}
+
+
+class ColumnarExport:
+    """
+    Streams every incident and every vehicle trip of a run to chunked, compressed, typed columnar files.
+
+    Each table is a directory of .npz chunks (one compressed array per column) of up to CHUNK_ROWS rows, next to a
+    meta.json with the epoch of the times and the tables decoding the type codes. An incident row is written once
+    the incident is resolved, with its report, triage, first dispatch, first arrival and resolution times; a trip
+    row once the vehicle is back at its station or sent elsewhere, with its dispatch, arrival and return times.
+    Times are seconds since the epoch, NaN for what did not happen. Rows are buffered in preallocated arrays and
+    full chunks are compressed by a background thread, so memory stays bounded however long the run.
+
+    Used as a recorder of the emergency response center, like IncidentStatistics and EventLog. A run resumed from a
+    checkpoint continues its export from the state() captured with the checkpoint.
+
+    Attributes:
+        directory (str): The directory the tables are written to.
+        epoch (float): Timestamp that corresponds to time 0 in the rows.
+        rows (dict): Table name -> the number of rows written.
+    """
+
+    def __init__(self, directory, seed=None, epoch=None, chunk_rows=CHUNK_ROWS, state=None):
+        """
+        Creates the directories of the tables, replacing any previous chunks.
+
+        Args:
+            directory (str): The directory to write.
+            seed (int, optional): The seed of the run, stored in meta.json.
+            epoch (float, optional): Timestamp of time 0. Defaults to the current wall-clock time.
+            chunk_rows (int, optional): Rows per chunk. Defaults to CHUNK_ROWS.
+            state (dict, optional): Continue the existing export in directory from a state() instead of replacing
+                it, e.g. when a run resumes from a checkpoint: the chunks written after it are deleted and the rows
+                it buffered or held open are restored. Defaults to a new export.
+        """
+        self.directory = directory
+        self.epoch = time.time() if epoch is None else epoch
+        self.chunk_rows = chunk_rows = state["chunk_rows"] if state is not None else chunk_rows
+        self.rows = {table: 0 for table in TABLES}
+        self.lock = threading.Lock()
+        self._buffers = {table: np.empty(chunk_rows, dtype=dtype) for table, dtype in TABLES.items()}
+        self._filled = {table: 0 for table in TABLES}
+        self._chunks = {table: 0 for table in TABLES}
+        self._incidents = {}  # Incident id -> its row, until it is resolved
+        self._trips = {}  # (vehicle type, vehicle id) -> the row of its current trip
+        self._vehicle_codes = {name: code for code, name in enumerate(VEHICLE_TYPES, 1)}
+        if state is not None:
+            self.rows.update(state["rows"])
+            self._chunks.update(state["chunks"])
+            for table, rows in state["buffered"].items():
+                self._buffers[table][:len(rows)] = rows
+                self._filled[table] = len(rows)
+            self._incidents = {incident_id: list(row) for incident_id, row in state["incidents"]}
+            self._trips = {key: list(row) for key, row in state["trips"]}
+        for table in TABLES:
+            os.makedirs(os.path.join(directory, table), exist_ok=True)
+            for chunk in glob.glob(os.path.join(directory, table, "part-*.npz")):
+                if int(os.path.basename(chunk)[5:-4]) >= self._chunks[table]:  # Not written yet at the state
+                    os.remove(chunk)
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({"seed": seed, "epoch": self.epoch, "incident_types": CATALOG.names,
+                       "vehicle_types": VEHICLE_TYPES, "chunk_rows": chunk_rows}, f)
+        self._pending = queue.Queue(maxsize=2)  # Full chunks waiting to be compressed; full means the disk is behind
+        self._writer = threading.Thread(target=self._write, name="Columnar export", daemon=True)
+        self._writer.start()
+
+    def record(self, event, time, incident, vehicle=None):
+        """
+        Updates the rows of the incident and of the vehicle's trip with an event (see EmergencyResponseCenter.notify).
+        """
+        time -= self.epoch
+        key = (vehicle.vehicle_type, vehicle.id) if vehicle is not None else None
+        with self.lock:
+            if event == "return":
+                trip = self._trips.pop(key, None)
+                if trip is not None:
+                    trip[7] = time
+                    self._append("trips", trip)
+                return
+            row = self._incidents.get(incident.id)
+            if row is None:
+                if event == "arrival" and key in self._trips:  # Reaching an incident resolved in the meantime
+                    self._trips[key][6] = time
+                if event in ("arrival", "resolve"):
+                    return
+                # Reported, or taken over from another center
+                police_cars, firetrucks, ambulances = CATALOG.required[incident.type_code]
+                row = [incident.id, incident.type_code, police_cars, firetrucks, ambulances, incident.severity, 0,
+                       incident.location, incident.report_time - self.epoch, np.nan, np.nan, np.nan, np.nan]
+                self._incidents[incident.id] = row
+            if event == "triage":
+                row[9] = time
+            elif event == "dispatch":
+                row[6] += 1
+                if row[6] == 1:
+                    row[10] = time
+                trip = self._trips.pop(key, None)
+                if trip is not None:  # Sent elsewhere on its way home
+                    self._append("trips", trip)
+                self._trips[key] = [self._vehicle_codes[vehicle.vehicle_type], vehicle.id, incident.id,
+                                    vehicle.current_node, incident.location, time, np.nan, np.nan]
+            elif event == "arrival":
+                if np.isnan(row[11]):
+                    row[11] = time
+                trip = self._trips.get(key)
+                if trip is not None:
+                    trip[6] = time
+            elif event == "resolve":
+                row[12] = time
+                self._append("incidents", self._incidents.pop(incident.id))
+
+    def state(self):
+        """
+        Waits until the full chunks are written and returns the state of the export as plain data, for
+        ColumnarExport(..., state=...): the chunks and rows written, the rows of the partial chunks and the rows
+        still open.
+        """
+        with self.lock:
+            self._pending.join()  # The writer thread never takes the lock
+            return {"chunk_rows": self.chunk_rows, "rows": dict(self.rows), "chunks": dict(self._chunks),
+                    "buffered": {table: self._buffers[table][:filled].copy() for table, filled in self._filled.items()},
+                    "incidents": [(incident_id, list(row)) for incident_id, row in self._incidents.items()],
+                    "trips": [(key, list(row)) for key, row in self._trips.items()]}
+
+    def close(self):
+        """
+        Writes the rows still open (unresolved incidents, trips under way) and the partial chunks, and waits for
+        the writer thread.
+        """
+        with self.lock:
+            if not self._writer.is_alive():
+                return
+            for row in self._incidents.values():
+                self._append("incidents", row)
+            for trip in self._trips.values():
+                self._append("trips", trip)
+            self._incidents, self._trips = {}, {}
+            for table in TABLES:
+                self._submit(table)
+            self._pending.put(None)
+        self._writer.join()
+
+    def _append(self, table, row):
+        buffer = self._buffers[table]
+        buffer[self._filled[table]] = tuple(row)
+        self._filled[table] += 1
+        self.rows[table] += 1
+        if self._filled[table] == self.chunk_rows:
+            self._submit(table)
+
+    def _submit(self, table):
+        filled = self._filled[table]
+        if not filled:
+            return
+        path = os.path.join(self.directory, table, f"part-{self._chunks[table]:05d}.npz")
+        self._pending.put((path, self._buffers[table][:filled].copy()))
+        self._chunks[table] += 1
+        self._filled[table] = 0
+
+    def _write(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            path, chunk = item
+            np.savez_compressed(path, **{name: chunk[name] for name in chunk.dtype.names})
+            self._pending.task_done()
+
+
+def read_table(directory, table):
+    """
+    Reads a whole table of an export.
+
+    Args:
+        directory (str): The directory of the export.
+        table (str): "incidents" or "trips".
+
+    Returns:
+        dict: Column name -> np.ndarray, e.g. for pandas.DataFrame.
+    """
+    chunks = sorted(glob.glob(os.path.join(directory, table, "part-*.npz")))
+    columns = {name: [] for name in TABLES[table].names}
+    for chunk in chunks:
+        with np.load(chunk) as data:
+            for name in columns:
+                columns[name].append(data[name])
+    return {name: np.concatenate(parts) if parts else np.empty(0, dtype=TABLES[table][name])
+            for name, parts in columns.items()}
+
+
+if __name__ == '__main__':
+    with open(os.path.join(sys.argv[1], "meta.json")) as f:
+        print(f.read())
+    for name in TABLES:
+        columns = read_table(sys.argv[1], name)
+        print(f"{name}: {len(next(iter(columns.values())))} rows, columns {', '.join(columns)}")
@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import importlib
+import numpy as np
+
+GRAPH_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "graphs")
+CACHE_VERSION = 1
+ARRAYS = ("node_ids", "x", "y", "indptr", "indices", "lengths")
+
+
+class CompiledGraph:
+    """
+    A road network compiled into flat NumPy arrays.
+
+    Nodes are stored sorted by OSM id, so the position of a node in `node_ids` is its index in every other
+    array. Edges are stored in CSR form: the outgoing edges of node i are indices[indptr[i]:indptr[i + 1]]
+    with the matching lengths. Parallel edges are collapsed to the shortest one, which is all that
+    shortest-path routing on 'length' ever uses.
+
+    Attributes:
+        node_ids (np.ndarray): Sorted OSM ids of the nodes (int64).
+        x (np.ndarray): Longitude of each node (float64).
+        y (np.ndarray): Latitude of each node (float64).
+        indptr (np.ndarray): CSR row pointer, one entry per node plus one (int64).
+        indices (np.ndarray): CSR column indices, the target node index of each edge (int64).
+        lengths (np.ndarray): Length in meters of each edge (float64).
+        meta (dict): Bounding box, network type, CRS and counts of the graph.
+    """
+
+    def __init__(self, node_ids, x, y, indptr, indices, lengths, meta=None):
+        self.node_ids = node_ids
+        self.x = x
+        self.y = y
+        self.indptr = indptr
+        self.indices = indices
+        self.lengths = lengths
+        self.meta = meta or {}
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def number_of_edges(self):
+        return len(self.indices)
+
+    @classmethod
+    def from_networkx(cls, graph, **meta):
+        """
+        Compiles an OSMnx MultiDiGraph.
+
+        Args:
+            graph (networkx.MultiDiGraph): The graph, with 'x'/'y' node attributes and 'length' edge attributes.
+            **meta: Extra metadata stored alongside the arrays (bbox, network type...).
+
+        Returns:
+            CompiledGraph: The compiled graph.
+        """
+        node_ids = np.array(sorted(graph.nodes()), dtype=np.int64)
+        x = np.array([graph.nodes[node]['x'] for node in node_ids.tolist()], dtype=np.float64)
+        y = np.array([graph.nodes[node]['y'] for node in node_ids.tolist()], dtype=np.float64)
+
+        shortest = {}
+        for u, v, length in graph.edges(data='length', default=0.0):
+            if (u, v) not in shortest or length < shortest[(u, v)]:
+                shortest[(u, v)] = length
+        sources = np.searchsorted(node_ids, np.fromiter((u for u, _ in shortest), dtype=np.int64, count=len(shortest)))
+        targets = np.searchsorted(node_ids, np.fromiter((v for _, v in shortest), dtype=np.int64, count=len(shortest)))
+        lengths = np.fromiter(shortest.values(), dtype=np.float64, count=len(shortest))
+
+        meta = dict(meta)
+        meta.setdefault("crs", str(graph.graph.get("crs", "epsg:4326")))
+        return cls.from_arrays(node_ids, x, y, sources, targets, lengths, **meta)
+
+    @classmethod
+    def from_arrays(cls, node_ids, x, y, sources, targets, lengths, **meta):
+        """
+        Compiles a graph given as edge arrays, without going through NetworkX.
+
+        Args:
+            node_ids (np.ndarray): Sorted node ids.
+            x, y (np.ndarray): Coordinates of each node.
+            sources, targets (np.ndarray): Index in node_ids of the two ends of each edge, without duplicate pairs.
+            lengths (np.ndarray): Length in meters of each edge.
+            **meta: Extra metadata stored alongside the arrays (bbox, network type...).
+
+        Returns:
+            CompiledGraph: The compiled graph.
+        """
+        order = np.lexsort((targets, sources))
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(node_ids)), out=indptr[1:])
+
+        meta = dict(meta)
+        meta.setdefault("crs", "epsg:4326")
+        meta.update(nodes=len(node_ids), edges=len(lengths), version=CACHE_VERSION)
+        return cls(np.asarray(node_ids, dtype=np.int64), np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64),
+                   indptr, np.asarray(targets, dtype=np.int64)[order], np.asarray(lengths, dtype=np.float64)[order], meta)
+
+    def to_networkx(self):
+        """
+        Rebuilds an OSMnx-compatible MultiDiGraph, for the code paths (plotting, OSMnx routing) that need one.
+
+        Returns:
+            networkx.MultiDiGraph: The graph with 'x'/'y' node attributes and 'length' edge attributes.
+        """
+        import networkx as nx
+
+        graph = nx.MultiDiGraph(crs=self.meta.get("crs", "epsg:4326"))
+        node_ids = self.node_ids.tolist()
+        graph.add_nodes_from((node, {'x': x, 'y': y}) for node, x, y in zip(node_ids, self.x.tolist(), self.y.tolist()))
+        sources = np.repeat(np.arange(len(node_ids)), np.diff(self.indptr)).tolist()
+        graph.add_edges_from((node_ids[u], node_ids[v], 0, {'length': length})
+                             for u, v, length in zip(sources, self.indices.tolist(), self.lengths.tolist()))
+        return graph
+
+    def reverse(self):
+        """
+        Returns the graph with every edge reversed, sharing the node arrays with this one.
+        """
+        sources = np.repeat(np.arange(len(self.node_ids), dtype=np.int64), np.diff(self.indptr))
+        order = np.argsort(self.indices, kind='stable')
+        indptr = np.zeros(len(self.node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=len(self.node_ids)), out=indptr[1:])
+        return CompiledGraph(self.node_ids, self.x, self.y, indptr, sources[order], self.lengths[order], dict(self.meta))
+
+    def index_of(self, node):
+        """
+        Returns the array index of an OSM node id.
+
+        Raises:
+            KeyError: If the node is not part of the graph.
+        """
+        index = int(np.searchsorted(self.node_ids, node))
+        if index == len(self.node_ids) or self.node_ids[index] != node:
+            raise KeyError(node)
+        return index
+
+    def indices_of(self, nodes):
+        """
+        Returns the array indices of several OSM node ids at once. The ids must be part of the graph.
+        """
+        return np.searchsorted(self.node_ids, np.asarray(nodes, dtype=np.int64))
+
+    def save(self, path):
+        """
+        Writes the graph as one .npy file per array plus a meta.json, replacing any previous version atomically.
+
+        Args:
+            path (str): The directory to write to.
+        """
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in ARRAYS:
+            np.save(os.path.join(tmp_path, name + ".npy"), getattr(self, name))
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=2)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Loads a graph written by `save`.
+
+        Args:
+            path (str): The directory the graph was saved to.
+            mmap (bool, optional): Memory-map the arrays instead of reading them. Defaults to True.
+
+        Returns:
+            CompiledGraph: The loaded graph.
+        """
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = [np.load(os.path.join(path, name + ".npy"), mmap_mode='r' if mmap else None) for name in ARRAYS]
+        return cls(*arrays, meta=meta)
+
+
+def graph_digest(graph):
+    """
+    Returns a short hash of the nodes and edges of a compiled graph, naming what is cached for it (contraction
+    hierarchy, base map).
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for array in (graph.node_ids, graph.indptr, graph.indices, graph.lengths):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def cache_key(north, south, east, west, network_type='drive'):
+    """
+    Returns the name of the cache entry for a bounding box and network type.
+    """
+    return f"{network_type}_{north:.6f}_{south:.6f}_{east:.6f}_{west:.6f}"
+
+
+def load_graph(north, south, east, west, network_type='drive', cache_dir=GRAPH_CACHE_DIR):
+    """
+    Returns the compiled road network of a bounding box, downloading and compiling it on the first call only.
+
+    Args:
+        north, south, east, west (float): The bounding box.
+        network_type (str, optional): The OSMnx network type. Defaults to 'drive'.
+        cache_dir (str, optional): Where compiled graphs are stored. Defaults to GRAPH_CACHE_DIR.
+
+    Returns:
+        CompiledGraph: The memory-mapped compiled graph.
+    """
+    path = os.path.join(cache_dir, cache_key(north, south, east, west, network_type))
+    meta_path = os.path.join(path, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f).get("version") == CACHE_VERSION:
+                return CompiledGraph.load(path)
+
+    import osmnx as ox
+
+    logging.info(f"Downloading {network_type} network for bbox {north}, {south}, {east}, {west}")
+    graph = ox.graph_from_bbox(north, south, east, west, network_type=network_type)
+    compiled = CompiledGraph.from_networkx(graph, bbox=[north, south, east, west], network_type=network_type)
+    os.makedirs(cache_dir, exist_ok=True)
+    compiled.save(path)
+    logging.info(f"Cached compiled graph with {compiled.meta['nodes']} nodes and {compiled.meta['edges']} edges in {path}")
+    return CompiledGraph.load(path)
+
+
+if __name__ == '__main__':
+    # Builds the cache for scenario modules, e.g. `python -m utils.graph_cache utils.constants utils.Mexico`
+    logging.basicConfig(level=logging.INFO)
+    for module_name in sys.argv[1:] or ["utils.constants", "utils.Mexico"]:
+        scenario = importlib.import_module(module_name)
+        load_graph(scenario.NORTH, scenario.SOUTH, scenario.EAST, scenario.WEST)
@@ -0,0 +1,107 @@
+import numpy as np
+from utils.constants import INCIDENTS
+
+
+class IncidentCatalog:
+    """
+    The incident types of INCIDENTS compiled into integer-coded arrays, with a Walker alias table to draw types.
+
+    A type is identified by its code, its position in INCIDENTS. Incidents carry their code, so the hot paths
+    read a row of the catalog instead of looking the type name up in nested dicts.
+
+    Drawing a type with the alias table takes one uniform number and one comparison whatever the number of
+    types: the uniform picks a column, and its fractional part decides between the column's own type and its
+    alias.
+
+    Attributes:
+        names (list): Type name per code.
+        codes (dict): Type name -> code.
+        severity (np.ndarray): Initial severity per code (int64).
+        required (np.ndarray): Police cars, firetrucks and ambulances required per code, shape (types, 3) (int64).
+        probability (np.ndarray): Normalized probability of each type (float64).
+        rows (list): (severity, police cars, firetrucks, ambulances) per code as Python ints, for scalar lookups.
+        alias_probability (np.ndarray): Probability of keeping the column's own type (float64).
+        alias (np.ndarray): Type drawn instead, per column (int64).
+    """
+
+    def __init__(self, incidents=INCIDENTS):
+        """
+        Compiles a catalog.
+
+        Args:
+            incidents (dict, optional): Type name -> {'severity', 'required_police_cars', 'required_firetrucks',
+                'required_ambulances', 'probability'}. Defaults to INCIDENTS.
+        """
+        self.names = list(incidents)
+        self.codes = {name: code for code, name in enumerate(self.names)}
+        details = [incidents[name] for name in self.names]
+        self.severity = np.array([d.get('severity', 0) for d in details], dtype=np.int64)
+        self.required = np.array([[d.get('required_police_cars', 0), d.get('required_firetrucks', 0),
+                                   d.get('required_ambulances', 0)] for d in details], dtype=np.int64).reshape(-1, 3)
+        probability = np.array([d.get('probability', 0) for d in details], dtype=np.float64)
+        self.probability = probability / probability.sum()
+        self.rows = [(int(severity), *map(int, required)) for severity, required in zip(self.severity, self.required)]
+        self.alias_probability, self.alias = self.alias_table(self.probability)
+        self._alias_probability = self.alias_probability.tolist()
+        self._alias = self.alias.tolist()
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def alias_table(probability):
+        """
+        Builds the Walker alias table of a discrete distribution (Vose's method).
+
+        Args:
+            probability (np.ndarray): Probabilities summing to 1.
+
+        Returns:
+            tuple: The probability of keeping each column's own outcome (np.ndarray) and the alias of each
+            column (np.ndarray).
+        """
+        count = len(probability)
+        scaled = probability * count
+        keep = np.ones(count)
+        alias = np.arange(count)
+        small = [i for i in range(count) if scaled[i] < 1]
+        large = [i for i in range(count) if scaled[i] >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            keep[less] = scaled[less]
+            alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        return keep, alias  # Columns left over are full up to rounding errors
+
+    def draw(self, rng):
+        """
+        Draws the code of one incident type.
+
+        Args:
+            rng (random.Random): The random stream to draw from.
+
+        Returns:
+            int: The type code.
+        """
+        u = rng.random() * len(self.names)
+        column = int(u)
+        return column if u - column < self._alias_probability[column] else self._alias[column]
+
+    def draw_many(self, rng, count):
+        """
+        Draws the codes of many incident types at once.
+
+        Args:
+            rng (np.random.Generator): The random generator to draw from.
+            count (int): The number of types.
+
+        Returns:
+            np.ndarray: The type codes (int64).
+        """
+        u = rng.random(count) * len(self.names)
+        column = u.astype(np.int64)
+        return np.where(u - column < self.alias_probability[column], column, self.alias[column])
+
+
+CATALOG = IncidentCatalog()
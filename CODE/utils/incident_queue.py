@@ -0,0 +1,200 @@
+import heapq
+import threading
+import time
+
+AGING_RATE = 1.0  # Priority points an incident gains per second of waiting (0.1 every 100 ms)
+
+
+class IncidentQueue:
+    """
+    A priority queue of incident ids with aging, O(log n) reprioritization and O(log n) cancellation.
+
+    Lower priorities are served first, and every queued incident gets AGING_RATE closer to the front per second.
+    Instead of rewriting every entry periodically, the heap is keyed on priority + AGING_RATE * enqueue time:
+    all entries age at the same rate, so the order of the keys never changes and the current priority of an
+    entry is its key minus AGING_RATE * now. Unlike the old periodic update, aging does not stop at 0.
+
+    An index from incident id to heap position makes reprioritize and cancel O(log n) without breaking the
+    heap invariant. All methods are thread safe.
+
+    Attributes:
+        clock (callable): Returns the current time in seconds.
+        aging_rate (float): Priority points gained per second of waiting.
+        lock (threading.RLock): Lock protecting the queue.
+    """
+
+    def __init__(self, clock=time.time, aging_rate=AGING_RATE):
+        """
+        Initializes an empty queue.
+
+        Args:
+            clock (callable, optional): Returns the current time in seconds. Defaults to time.time.
+            aging_rate (float, optional): Priority points gained per second. Defaults to AGING_RATE.
+        """
+        self.clock = clock
+        self.aging_rate = aging_rate
+        self.lock = threading.RLock()
+        self._origin = clock()  # Keeps keys small so they do not lose precision
+        self._heap = []  # [key, incident_id] entries
+        self._position = {}  # incident_id -> index of its entry in _heap
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, incident_id):
+        return incident_id in self._position
+
+    def empty(self):
+        return not self._heap
+
+    def put(self, priority, incident_id):
+        """
+        Queues an incident with the given current priority, or reprioritizes it if it is already queued.
+        """
+        with self.lock:
+            if incident_id in self._position:
+                self.reprioritize(incident_id, priority)
+                return
+            self._heap.append([self._key(priority), incident_id])
+            self._position[incident_id] = len(self._heap) - 1
+            self._sift_up(len(self._heap) - 1)
+
+    def pop(self):
+        """
+        Removes and returns the most urgent incident.
+
+        Returns:
+            tuple: (current priority, incident_id).
+
+        Raises:
+            IndexError: If the queue is empty.
+        """
+        with self.lock:
+            key, incident_id = self._heap[0]
+            self._delete(0)
+            return self._priority(key), incident_id
+
+    def peek(self):
+        """
+        Returns the most urgent incident as (current priority, incident_id) without removing it, or None.
+        """
+        with self.lock:
+            if not self._heap:
+                return None
+            key, incident_id = self._heap[0]
+            return self._priority(key), incident_id
+
+    def priority(self, incident_id):
+        """
+        Returns the current priority of a queued incident.
+
+        Raises:
+            KeyError: If the incident is not queued.
+        """
+        with self.lock:
+            return self._priority(self._heap[self._position[incident_id]][0])
+
+    def reprioritize(self, incident_id, priority):
+        """
+        Sets the current priority of a queued incident.
+
+        Raises:
+            KeyError: If the incident is not queued.
+        """
+        with self.lock:
+            index = self._position[incident_id]
+            self._heap[index][0] = self._key(priority)
+            self._sift_up(index)
+            self._sift_down(self._position[incident_id])
+
+    def cancel(self, incident_id):
+        """
+        Removes an incident from the queue.
+
+        Returns:
+            bool: True if the incident was queued, False otherwise.
+        """
+        with self.lock:
+            index = self._position.get(incident_id)
+            if index is None:
+                return False
+            self._delete(index)
+            return True
+
+    def snapshot(self, limit=None):
+        """
+        Returns a copy of the queue in service order, safe to use while other threads modify the queue.
+
+        Args:
+            limit (int, optional): Only return the `limit` most urgent incidents. Defaults to all of them.
+
+        Returns:
+            list: (current priority, incident_id) tuples.
+        """
+        with self.lock:
+            entries = [tuple(entry) for entry in self._heap]
+            now = self.clock()
+        entries = sorted(entries) if limit is None else heapq.nsmallest(limit, entries)
+        return [(key - self.aging_rate * (now - self._origin), incident_id) for key, incident_id in entries]
+
+    def state(self):
+        """
+        Returns the content of the queue as plain data, for checkpoints: the origin of the keys and the heap entries.
+        """
+        with self.lock:
+            return self._origin, [tuple(entry) for entry in self._heap]
+
+    def restore(self, state):
+        """
+        Replaces the content of the queue with a state returned by state().
+        """
+        with self.lock:
+            self._origin, heap = state
+            self._heap = [list(entry) for entry in heap]
+            self._position = {entry[1]: index for index, entry in enumerate(self._heap)}
+
+    def _key(self, priority):
+        return priority + self.aging_rate * (self.clock() - self._origin)
+
+    def _priority(self, key):
+        return key - self.aging_rate * (self.clock() - self._origin)
+
+    def _delete(self, index):
+        last = self._heap.pop()
+        del self._position[self._heap[index][1] if index < len(self._heap) else last[1]]
+        if index < len(self._heap):
+            self._heap[index] = last
+            self._position[last[1]] = index
+            self._sift_up(index)
+            self._sift_down(self._position[last[1]])
+
+    def _sift_up(self, index):
+        heap = self._heap
+        entry = heap[index]
+        while index > 0:
+            parent = (index - 1) >> 1
+            if heap[parent] <= entry:
+                break
+            heap[index] = heap[parent]
+            self._position[heap[index][1]] = index
+            index = parent
+        heap[index] = entry
+        self._position[entry[1]] = index
+
+    def _sift_down(self, index):
+        heap = self._heap
+        entry = heap[index]
+        size = len(heap)
+        while True:
+            child = 2 * index + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap[child + 1] < heap[child]:
+                child += 1
+            if entry <= heap[child]:
+                break
+            heap[index] = heap[child]
+            self._position[heap[index][1]] = index
+            index = child
+        heap[index] = entry
+        self._position[entry[1]] = index
@@ -0,0 +1,109 @@
+import threading
+import numpy as np
+
+
+class AgentPositions:
+    """
+    Positions of a group of agents (citizens, police cars...) kept as a struct of arrays.
+
+    Every agent owns a slot in `nodes`, where it publishes the index of the node it is on in the compiled graph.
+    Rendering a frame is then a single fancy-indexing of the graph's x/y arrays, whatever the number of agents.
+
+    Attributes:
+        graph (CompiledGraph): The road network, whose x/y arrays give the coordinates.
+        nodes (np.ndarray): Node index per slot, -1 for unused slots (int64).
+        lock (threading.Lock): Lock protecting slot allocation.
+    """
+
+    def __init__(self, graph, capacity=16):
+        """
+        Initializes an empty group.
+
+        Args:
+            graph (CompiledGraph): The road network.
+            capacity (int, optional): Initial number of slots, doubled whenever it runs out. Defaults to 16.
+        """
+        self.graph = graph
+        self.nodes = np.full(capacity, -1, dtype=np.int64)
+        self.lock = threading.Lock()
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return int(np.count_nonzero(self.nodes >= 0))
+
+    def register(self, node):
+        """
+        Allocates a slot for an agent standing on the given OSM node.
+
+        Returns:
+            int: The slot of the agent.
+        """
+        with self.lock:
+            if not self._free:
+                capacity = len(self.nodes)
+                self.nodes = np.concatenate((self.nodes, np.full(capacity, -1, dtype=np.int64)))
+                self._free = list(range(2 * capacity - 1, capacity - 1, -1))
+            slot = self._free.pop()
+            self.nodes[slot] = self.graph.index_of(node)
+            return slot
+
+    def register_many(self, indices):
+        """
+        Allocates slots for many agents at once, e.g. a whole CitizenPopulation.
+
+        Args:
+            indices (np.ndarray): Node index of each agent in the compiled graph (not OSM ids).
+
+        Returns:
+            np.ndarray: The slots of the agents.
+        """
+        with self.lock:
+            start = len(self.nodes)
+            self.nodes = np.concatenate((self.nodes, np.asarray(indices, dtype=np.int64)))
+            return np.arange(start, len(self.nodes))
+
+    def update_many(self, slots, indices):
+        """
+        Publishes the node indices of many agents at once, -1 for agents that left the simulation.
+        """
+        with self.lock:
+            self.nodes[slots] = indices
+
+    def release(self, slot):
+        """
+        Frees the slot of an agent that left the simulation.
+        """
+        with self.lock:
+            self.nodes[slot] = -1
+            self._free.append(slot)
+
+    def update(self, slot, node):
+        """
+        Publishes the OSM node an agent is on.
+        """
+        index = self.graph.index_of(node)
+        with self.lock:  # The array may be replaced by a concurrent register
+            self.nodes[slot] = index
+
+    def coordinates(self):
+        """
+        Returns the coordinates of every agent of the group.
+
+        Returns:
+            np.ndarray: An (n, 2) array of x/y coordinates.
+        """
+        nodes = self.nodes
+        indices = nodes[nodes >= 0]
+        return np.column_stack((self.graph.x[indices], self.graph.y[indices]))
+
+
+def node_coordinates(graph, nodes):
+    """
+    Returns the coordinates of a sequence of OSM node ids as an (n, 2) array.
+
+    Args:
+        graph (CompiledGraph): The road network.
+        nodes (iterable): OSM ids of nodes of the graph.
+    """
+    indices = graph.indices_of(np.fromiter(nodes, dtype=np.int64))
+    return np.column_stack((graph.x[indices], graph.y[indices]))
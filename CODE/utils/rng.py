@@ -0,0 +1,22 @@
+import random
+
+
+def agent_rng(seed, kind, id=0):
+    """
+    Returns the random stream of an agent.
+
+    With a seed, every agent gets its own random.Random derived from the seed, its kind and its id, so what an
+    agent draws does not depend on how the threads or events of the other agents interleave. Without a seed,
+    the shared `random` module is returned, which has the same interface.
+
+    Args:
+        seed (int): The seed of the run, or None.
+        kind (str): The kind of agent ("citizen", "center"...).
+        id (int, optional): The id of the agent within its kind. Defaults to 0.
+
+    Returns:
+        random.Random: The random stream of the agent.
+    """
+    if seed is None:
+        return random
+    return random.Random(f"{seed}:{kind}:{id}")
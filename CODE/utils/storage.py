@@ -0,0 +1,200 @@
+import time
+import queue
+import sqlite3
+import threading
+import logging
+
+COLUMNS = ("incident_key", "time_reported", "incident_type", "location", "severity", "required_police",
+           "required_firetrucks", "required_ambulances")
+
+
+class Storage:
+    """
+    Base class of the databases the emergencies table can be stored in.
+
+    Subclasses open the connection and provide the SQL dialect; this class creates the table, inserts batches
+    and runs queries. Every call is serialized by `lock`, so one connection can be shared by the batch writer
+    thread and the thread producing the statistics.
+
+    Attributes:
+    - cnx: The DB-API connection.
+    - lock: A threading.Lock serializing the use of the connection.
+    - placeholder: The parameter placeholder of the driver ("%s" or "?").
+    - insert_ignore: The statement prefix inserting a row unless its key already exists.
+    """
+    placeholder = "%s"
+    insert_ignore = "INSERT IGNORE INTO"
+    id_column = "id INT AUTO_INCREMENT PRIMARY KEY"
+
+    def __init__(self):
+        self.cnx = None
+        self.lock = threading.Lock()
+
+    def create_table(self):
+        """
+        Drops and recreates the emergencies table, so every run starts from an empty table.
+        The incident_key column is unique, which makes inserting the same incident twice a no-op.
+        """
+        with self.lock:
+            cursor = self.cnx.cursor()
+            cursor.execute("DROP TABLE IF EXISTS emergencies")
+            cursor.execute(f"CREATE TABLE emergencies ({self.id_column}, time_reported VARCHAR(255), "
+                           "incident_type VARCHAR(255), location VARCHAR(255), severity INT, required_police INT, "
+                           "required_firetrucks INT, required_ambulances INT, incident_key VARCHAR(255) UNIQUE)")
+            self.cnx.commit()
+
+    def insert_many(self, rows):
+        """
+        Inserts a batch of rows in a single transaction with one prepared statement.
+
+        Parameters:
+        - rows: A list of tuples ordered like COLUMNS.
+        """
+        statement = (f"{self.insert_ignore} emergencies ({', '.join(COLUMNS)}) "
+                     f"VALUES ({', '.join([self.placeholder] * len(COLUMNS))})")
+        with self.lock:
+            cursor = self.cnx.cursor()
+            try:
+                cursor.executemany(statement, rows)
+                self.cnx.commit()
+            except Exception:
+                self.cnx.rollback()
+                raise
+
+    def fetchone(self, query):
+        """
+        Runs a query and returns its first row.
+        """
+        with self.lock:
+            cursor = self.cnx.cursor()
+            cursor.execute(query)
+            return cursor.fetchone()
+
+    def close(self):
+        with self.lock:
+            self.cnx.close()
+
+
+class MySQLStorage(Storage):
+    """
+    Stores the emergencies table in the MadEmergencies database of a MySQL server.
+    """
+
+    def __init__(self, user, password, host='127.0.0.1', database='MadEmergencies'):
+        super().__init__()
+        import mysql.connector
+
+        server = mysql.connector.connect(user=user, password=password, host=host)
+        server.cursor().execute(f"CREATE DATABASE IF NOT EXISTS {database}")
+        server.close()
+        self.cnx = mysql.connector.connect(user=user, password=password, host=host, database=database)
+        self.create_table()
+
+
+class SQLiteStorage(Storage):
+    """
+    Stores the emergencies table in a local SQLite file, or in memory with path ":memory:". Needs no server.
+    """
+    placeholder = "?"
+    insert_ignore = "INSERT OR IGNORE INTO"
+    id_column = "id INTEGER PRIMARY KEY AUTOINCREMENT"
+
+    def __init__(self, path=":memory:"):
+        super().__init__()
+        self.cnx = sqlite3.connect(path, check_same_thread=False)
+        self.create_table()
+
+
+def create_storage(backend, **options):
+    """
+    Creates the storage for a backend name.
+
+    Parameters:
+    - backend: "mysql", "sqlite" (file) or "memory" (in-memory SQLite).
+    - options: user/password for MySQL, path for SQLite.
+
+    Returns:
+    - Storage: The connected storage with an empty emergencies table.
+    """
+    if backend == "mysql":
+        return MySQLStorage(options["user"], options["password"])
+    if backend == "sqlite":
+        return SQLiteStorage(options.get("path", "emergencies.db"))
+    if backend == "memory":
+        return SQLiteStorage(":memory:")
+    raise ValueError(f"Unknown storage backend {backend!r}")
+
+
+FLUSH = object()  # Queued by BatchWriter.flush to have the current batch written without waiting for more rows
+
+
+class BatchWriter(threading.Thread):
+    """
+    Streams rows to a storage from a background thread, in bounded batches.
+
+    Rows wait in a bounded queue, so producers block instead of letting memory grow if the database falls behind.
+    Once a row arrives, the writer keeps collecting rows for up to `flush_interval` seconds and inserts them in one
+    transaction as soon as `batch_size` rows are in or the interval is over. At low rates this costs one
+    transaction per interval instead of one per row. flush() writes the partial batch right away.
+
+    Attributes:
+    - storage: The Storage rows are written to.
+    - batch_size: The maximum number of rows per transaction.
+    - flush_interval: Seconds a batch waits to fill up after its first row before being written.
+    - rows: The bounded queue of pending rows.
+    - written: The number of rows written so far.
+    """
+
+    def __init__(self, storage, batch_size=500, flush_interval=1.0, max_pending=10000):
+        super().__init__(name="Storage Writer", daemon=True)
+        self.storage = storage
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows = queue.Queue(maxsize=max_pending)
+        self.written = 0
+        self._closed = threading.Event()
+
+    def put(self, row):
+        """
+        Queues a row for writing, blocking while the queue is full.
+        """
+        self.rows.put(row)
+
+    def flush(self):
+        """
+        Blocks until every queued row has been written, without waiting for the current batch to fill up.
+        """
+        self.rows.put(FLUSH)
+        self.rows.join()
+
+    def close(self):
+        """
+        Writes the remaining rows and stops the thread.
+        """
+        self.flush()
+        self._closed.set()
+        self.rows.put(FLUSH)  # Wakes the writer up if it waits for a first row
+        self.join()
+
+    def run(self):
+        while not (self._closed.is_set() and self.rows.empty()):
+            try:
+                batch = [self.rows.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not FLUSH:
+                try:
+                    batch.append(self.rows.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            rows = [row for row in batch if row is not FLUSH]
+            try:
+                if rows:
+                    self.storage.insert_many(rows)
+                    self.written += len(rows)
+            except Exception as e:
+                logging.error(f"Could not write {len(rows)} incidents: {e}")
+            finally:
+                for _ in batch:
+                    self.rows.task_done()
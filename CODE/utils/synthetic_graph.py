@@ -0,0 +1,262 @@
+import math
+import logging
+import argparse
+import numpy as np
+from utils.constants import NORTH, SOUTH, EAST, WEST
+from utils.graph_cache import CompiledGraph
+
+LAYOUTS = ("grid", "radial", "random")
+EARTH_RADIUS = 6371008.8  # Meters, as used by OSMnx
+STATION_TYPES = ("Fire-Truck", "Police-Car", "Ambulance")
+
+
+def great_circle(x, y, sources, targets):
+    """
+    Returns the great-circle length in meters of edges between nodes given by longitude x and latitude y.
+    """
+    lon1, lat1, lon2, lat2 = (np.radians(a) for a in (x[sources], y[sources], x[targets], y[targets]))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def _compile(x, y, sources, targets, layout, bbox, seed):
+    """
+    Builds the CompiledGraph of undirected street segments: every segment becomes two opposite edges and
+    duplicated segments are dropped. Node ids are 1..n.
+    """
+    pairs = np.unique(np.concatenate((np.column_stack((sources, targets)), np.column_stack((targets, sources)))), axis=0)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    sources, targets = pairs[:, 0], pairs[:, 1]
+    node_ids = np.arange(1, len(x) + 1, dtype=np.int64)
+    return CompiledGraph.from_arrays(node_ids, x, y, sources, targets, great_circle(x, y, sources, targets),
+                                     bbox=list(bbox), network_type=f"synthetic_{layout}", seed=seed)
+
+
+def grid(nodes, bbox=(NORTH, SOUTH, EAST, WEST), seed=0, jitter=0.2):
+    """
+    A Manhattan grid of two-way streets covering the bounding box.
+
+    Args:
+        nodes (int): Approximate number of nodes; the grid is the smallest square with at least that many.
+        bbox (tuple, optional): (north, south, east, west). Defaults to the bbox of utils.constants.
+        seed (int, optional): Seed of the jitter. Defaults to 0.
+        jitter (float, optional): Random displacement of the intersections, as a fraction of a block. Defaults to 0.2.
+
+    Returns:
+        CompiledGraph: The grid.
+    """
+    north, south, east, west = bbox
+    side = max(2, math.ceil(math.sqrt(nodes)))
+    rng = np.random.default_rng(seed)
+    rows, columns = np.divmod(np.arange(side * side), side)
+    x = west + (east - west) * (columns + rng.uniform(-jitter, jitter, side * side)) / (side - 1)
+    y = south + (north - south) * (rows + rng.uniform(-jitter, jitter, side * side)) / (side - 1)
+    index = np.arange(side * side).reshape(side, side)
+    sources = np.concatenate((index[:, :-1].ravel(), index[:-1, :].ravel()))
+    targets = np.concatenate((index[:, 1:].ravel(), index[1:, :].ravel()))
+    return _compile(np.clip(x, west, east), np.clip(y, south, north), sources, targets, "grid", bbox, seed)
+
+
+def radial(nodes, bbox=(NORTH, SOUTH, EAST, WEST), seed=0, spokes=None):
+    """
+    A radial city: concentric ring roads crossed by avenues from the center, filling the ellipse inscribed in the
+    bounding box.
+
+    Args:
+        nodes (int): Approximate number of nodes.
+        bbox (tuple, optional): (north, south, east, west). Defaults to the bbox of utils.constants.
+        seed (int, optional): Seed of the displacement of the intersections. Defaults to 0.
+        spokes (int, optional): Number of avenues. Defaults to about sqrt(nodes).
+
+    Returns:
+        CompiledGraph: The radial network.
+    """
+    north, south, east, west = bbox
+    spokes = spokes or max(8, round(math.sqrt(nodes)))
+    rings = max(1, math.ceil((nodes - 1) / spokes))
+    rng = np.random.default_rng(seed)
+    ring, spoke = np.divmod(np.arange(rings * spokes), spokes)
+    radius = (ring + 1 + rng.uniform(-0.2, 0.2, rings * spokes)) / (rings + 0.2)
+    angle = 2 * np.pi * (spoke + rng.uniform(-0.2, 0.2, rings * spokes)) / spokes
+    x = np.concatenate(([(east + west) / 2], (east + west) / 2 + (east - west) / 2 * radius * np.cos(angle)))
+    y = np.concatenate(([(north + south) / 2], (north + south) / 2 + (north - south) / 2 * radius * np.sin(angle)))
+    index = np.arange(1, rings * spokes + 1).reshape(rings, spokes)
+    sources = np.concatenate((index.ravel(), index[:-1].ravel(), np.zeros(spokes, dtype=np.int64)))
+    targets = np.concatenate((np.roll(index, -1, axis=1).ravel(), index[1:].ravel(), index[0]))
+    return _compile(x, y, sources, targets, "radial", bbox, seed)
+
+
+def random_geometric(nodes, bbox=(NORTH, SOUTH, EAST, WEST), seed=0, neighbors=3):
+    """
+    Intersections scattered uniformly over the bounding box, each linked to its nearest neighbors. Only the largest
+    connected component is kept, so the result can be slightly smaller than `nodes`.
+
+    Neighbors are searched in the 3x3 surrounding cells of a uniform bucket grid, so generation stays O(n) in
+    time and memory up to millions of nodes.
+
+    Args:
+        nodes (int): Number of intersections scattered.
+        bbox (tuple, optional): (north, south, east, west). Defaults to the bbox of utils.constants.
+        seed (int, optional): Seed of the positions. Defaults to 0.
+        neighbors (int, optional): Streets drawn from every intersection to its nearest ones. Defaults to 3.
+
+    Returns:
+        CompiledGraph: The random geometric network.
+    """
+    north, south, east, west = bbox
+    rng = np.random.default_rng(seed)
+    u = rng.random(nodes)
+    v = rng.random(nodes)
+    cells = max(1, int(math.sqrt(nodes / 2)))  # About two points per cell
+    cx = np.minimum((u * cells).astype(np.int64), cells - 1)
+    cy = np.minimum((v * cells).astype(np.int64), cells - 1)
+    cell = cx * cells + cy
+    order = np.argsort(cell, kind='stable')
+    starts = np.searchsorted(cell[order], np.arange(cells * cells + 1))
+
+    candidate_sources, candidate_targets = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            nx, ny = cx + dx, cy + dy
+            inside = np.flatnonzero((nx >= 0) & (nx < cells) & (ny >= 0) & (ny < cells))
+            neighbor_cell = nx[inside] * cells + ny[inside]
+            counts = starts[neighbor_cell + 1] - starts[neighbor_cell]
+            points = np.repeat(inside, counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            candidate_sources.append(points)
+            candidate_targets.append(order[np.repeat(starts[neighbor_cell], counts) + offsets])
+    sources = np.concatenate(candidate_sources)
+    targets = np.concatenate(candidate_targets)
+    keep = sources != targets
+    sources, targets = sources[keep], targets[keep]
+    distance = (u[sources] - u[targets]) ** 2 + (v[sources] - v[targets]) ** 2
+    by_distance = np.lexsort((distance, sources))
+    sources, targets = sources[by_distance], targets[by_distance]
+    first = np.searchsorted(sources, sources)
+    nearest = np.arange(len(sources)) - first < neighbors
+    sources, targets = sources[nearest], targets[nearest]
+
+    # Keep the largest connected component, renumbering its nodes
+    labels = connected_components(nodes, sources, targets)
+    largest = labels == np.bincount(labels).argmax()
+    renumber = np.cumsum(largest) - 1
+    edges = largest[sources]
+    x = west + (east - west) * u[largest]
+    y = south + (north - south) * v[largest]
+    return _compile(x, y, renumber[sources[edges]], renumber[targets[edges]], "random", bbox, seed)
+
+
+def connected_components(nodes, sources, targets):
+    """
+    Labels the connected components of an undirected graph by hooking and pointer jumping, in O(log n) vectorized
+    passes over the edges.
+
+    Returns:
+        np.ndarray: The smallest node index of its component, for every node.
+    """
+    parent = np.arange(nodes)
+    while True:
+        pu, pv = parent[sources], parent[targets]
+        differ = pu != pv
+        if not differ.any():
+            return parent
+        np.minimum.at(parent, np.maximum(pu[differ], pv[differ]), np.minimum(pu[differ], pv[differ]))
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+
+def kmeans(points, count, rng, iterations=20, sample=100000):
+    """
+    Clusters points with k-means.
+
+    Args:
+        points (np.ndarray): An (n, 2) array of coordinates.
+        count (int): Number of clusters.
+        rng (np.random.Generator): Random generator of the initial centers and of the sample.
+        iterations (int, optional): Iterations of k-means. Defaults to 20.
+        sample (int, optional): Points the clustering runs on, for large inputs. Defaults to 100000.
+
+    Returns:
+        np.ndarray: The (count, 2) centers of the clusters, or one per point when there are fewer points than count.
+    """
+    if len(points) > sample:
+        points = points[rng.choice(len(points), sample, replace=False)]
+    centers = points[rng.choice(len(points), min(count, len(points)), replace=False)]
+    for _ in range(iterations):
+        closest = np.argmin(((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2), axis=1)
+        for k in range(len(centers)):
+            members = points[closest == k]
+            if len(members):
+                centers[k] = members.mean(axis=0)
+    return centers
+
+
+def place_stations(graph, count=len(STATION_TYPES), seed=0, iterations=20, sample=100000, nodes=None):
+    """
+    Places stations spread over the city: the centers of a k-means clustering of the intersections, each moved to
+    the closest intersection.
+
+    Args:
+        graph (CompiledGraph): The road network.
+        count (int, optional): Number of stations. Defaults to one per vehicle type.
+        seed (int, optional): Seed of the clustering. Defaults to 0.
+        iterations (int, optional): Iterations of k-means. Defaults to 20.
+        sample (int, optional): Intersections the clustering runs on, for large graphs. Defaults to 100000.
+        nodes (np.ndarray, optional): Indices of the intersections to place the stations among, e.g. a district.
+            Defaults to all of them.
+
+    Returns:
+        list: The node ids of the stations, all different unless there are fewer intersections than stations, in
+            which case stations share them.
+    """
+    rng = np.random.default_rng(seed)
+    nodes = np.arange(len(graph)) if nodes is None else np.asarray(nodes)
+    x, y = graph.x[nodes], graph.y[nodes]
+    centers = kmeans(np.column_stack((x, y)), count, rng, iterations, sample)
+    stations = []
+    distance = np.empty(len(nodes))
+    for center in centers:
+        np.add((x - center[0]) ** 2, (y - center[1]) ** 2, out=distance)
+        for station in stations:
+            distance[station] = np.inf
+        stations.append(int(np.argmin(distance)))
+    return [int(graph.node_ids[nodes[stations[k % len(stations)]]]) for k in range(count)]
+
+
+def synthetic_city(layout, nodes, bbox=(NORTH, SOUTH, EAST, WEST), seed=0):
+    """
+    Generates a road network and places its stations.
+
+    Args:
+        layout (str): "grid", "radial" or "random".
+        nodes (int): Approximate number of nodes.
+        bbox (tuple, optional): (north, south, east, west). Defaults to the bbox of utils.constants.
+        seed (int, optional): Seed of the generator. Defaults to 0.
+
+    Returns:
+        CompiledGraph: The network, with the stations in meta["stations"] as vehicle type -> node id, which City
+        uses instead of the stations of utils.constants.
+    """
+    generators = {"grid": grid, "radial": radial, "random": random_geometric}
+    if layout not in generators:
+        raise ValueError(f"Unknown layout {layout!r}, expected one of {', '.join(LAYOUTS)}")
+    graph = generators[layout](nodes, bbox, seed)
+    graph.meta["stations"] = dict(zip(STATION_TYPES, place_stations(graph, seed=seed)))
+    return graph
+
+
+if __name__ == '__main__':
+    # Generates and saves a synthetic city, e.g. `python -m utils.synthetic_graph grid 1000000 cache/graphs/grid_1m`
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Generate a synthetic road network")
+    parser.add_argument("layout", choices=LAYOUTS)
+    parser.add_argument("nodes", type=int)
+    parser.add_argument("output", help="directory the compiled graph is saved to (load it with CompiledGraph.load)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    city = synthetic_city(args.layout, args.nodes, seed=args.seed)
+    city.save(args.output)
+    logging.info(f"Saved {city.meta['nodes']} nodes, {city.meta['edges']} edges and stations {city.meta['stations']} to {args.output}")
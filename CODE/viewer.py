@@ -0,0 +1,175 @@
+import os
+import time
+import argparse
+import numpy as np
+from services.live_feed import LiveFeedReader, FEED_NAME
+
+ATTACH_INTERVAL = 1.0  # Seconds between two attempts to attach while no simulation is publishing
+
+
+class Viewer:
+    """
+    Draws the live feed of a simulation (see services.live_feed) with matplotlib, in its own process.
+
+    The viewer only copies the latest frame out of shared memory, so however slow the drawing, the simulation never
+    waits for it. It attaches whenever a simulation publishes under its name, and waits for the next one when the
+    run ends; closing the window only detaches.
+
+    Attributes:
+        reader (LiveFeedReader): The reader of the feed.
+        lod_threshold (int): Number of citizens above which they are drawn as a density map.
+    """
+
+    def __init__(self, name=FEED_NAME, lod_threshold=2000):
+        """
+        Initializes the viewer.
+
+        Args:
+            name (str, optional): Name of the feed. Defaults to FEED_NAME.
+            lod_threshold (int, optional): Citizens drawn one by one at most. Defaults to 2000.
+        """
+        self.reader = LiveFeedReader(name)
+        self.lod_threshold = lod_threshold
+        self.fig = self.ax = None
+        self.scatters = {}
+        self.density_image = None
+        self.basemap = None
+        self._next_attempt = 0.0
+
+    def plot(self):
+        """
+        Creates the figure: the map with one scatter per group, and the active incidents and queue panels.
+        """
+        import matplotlib.pyplot as plt
+
+        self.fig = plt.figure(figsize=(16, 14), facecolor='black')
+        gs = self.fig.add_gridspec(2, 2, height_ratios=[5, 1])
+        self.ax = self.fig.add_subplot(gs[0, :])
+        self.ax.set_facecolor('#111111')
+        self.ax.set_axis_off()
+        styles = {"citizens": ('black', 20, 'o', 'Citizens'), "incidents": ('orange', 60, 's', 'Incidents'),
+                  "police": ('blue', 30, 'o', 'Police'), "firetrucks": ('red', 30, 'o', 'Firetrucks'),
+                  "ambulances": ('green', 30, 'o', 'Ambulances')}
+        for group, (color, size, marker, label) in styles.items():
+            self.scatters[group] = self.ax.scatter([], [], c=color, s=size, marker=marker, label=label, zorder=2)
+        self.density_image = self.ax.imshow(np.zeros((2, 2)), origin='lower', cmap='magma', alpha=0.6, zorder=1,
+                                            visible=False)
+        self.ax.legend(loc='upper right')
+        self.title = self.ax.set_title("", color='white')
+        panels = []
+        for column, title in enumerate(("Active Incidents", "Incident Queue")):
+            ax = self.fig.add_subplot(gs[1, column])
+            ax.axis('off')
+            ax.set_title(title, color='white')
+            panels.append(ax.text(0, 1, '', ha='left', va='top', color='white'))
+        self.active_text, self.queue_text = panels
+
+    def refresh(self, _):
+        """
+        Draws the latest frame of the feed, attaching first if needed.
+        """
+        reader = self.reader
+        if not reader.attached:
+            if time.time() < self._next_attempt or not reader.attach():
+                self._next_attempt = time.time() + ATTACH_INTERVAL
+                self.title.set_text(f"Waiting for a simulation publishing to {reader.name}")
+                return
+            meta = reader.meta
+            self.ax.set_xlim(meta["west"], meta["east"])
+            self.ax.set_ylim(meta["south"], meta["north"])
+            self.density_image.set_extent([meta["west"], meta["east"], meta["south"], meta["north"]])
+        self.show_basemap(reader.meta)
+        frame = reader.read()
+        if frame is None:
+            if reader.closed():
+                reader.detach()
+                self.title.set_text("Simulation finished, waiting for the next one")
+            return
+        for group, points in frame.groups.items():
+            self.scatters[group].set_offsets(points)
+        if frame.density is not None or len(frame.groups["citizens"]) > self.lod_threshold:
+            density = frame.density
+            if density is None:
+                meta = reader.meta
+                citizens = frame.groups["citizens"]
+                density = np.histogram2d(citizens[:, 1], citizens[:, 0], bins=meta["density_bins"],
+                                         range=[[meta["south"], meta["north"]], [meta["west"], meta["east"]]])[0]
+            self.scatters["citizens"].set_offsets(np.empty((0, 2)))
+            self.density_image.set_data(np.log1p(density))
+            self.density_image.set_clim(0, max(np.log1p(density.max()), 1))
+            self.density_image.set_visible(True)
+        else:
+            self.density_image.set_visible(False)
+        self.active_text.set_text("\n".join(frame.text["active"]))
+        self.queue_text.set_text("\n".join(frame.text["queue"]))
+        self.title.set_text(f"{round(frame.time, 1)} s - {frame.active} active incidents - {frame.queued} queued")
+
+    def show_basemap(self, meta):
+        """
+        Draws the street network under the agents once the simulation has rendered it.
+        """
+        if self.basemap is not None or not meta["basemap"] or not os.path.exists(meta["basemap"]):
+            return
+        import matplotlib.image as mpimg
+
+        self.basemap = self.ax.imshow(mpimg.imread(meta["basemap"]), zorder=0, interpolation='bilinear',
+                                      extent=[meta["west"], meta["east"], meta["south"], meta["north"]])
+        self.ax.set_aspect('auto')
+
+    def run(self):
+        """
+        Opens the window and draws the feed until it is closed.
+        """
+        import matplotlib.pyplot as plt
+        from matplotlib.animation import FuncAnimation
+
+        self.plot()
+        self.anim = FuncAnimation(self.fig, self.refresh, interval=50, cache_frame_data=False)
+        plt.show()
+        self.reader.detach()
+
+
+def watch(name=FEED_NAME, interval=1.0):
+    """
+    Prints the live feed of a simulation in the terminal, one line per interval, until interrupted.
+
+    Args:
+        name (str, optional): Name of the feed. Defaults to FEED_NAME.
+        interval (float, optional): Seconds between two lines. Defaults to 1.
+    """
+    reader = LiveFeedReader(name)
+    waiting = False
+    try:
+        while True:
+            if not reader.attach():
+                if not waiting:
+                    print(f"Waiting for a simulation publishing to {name}")
+                    waiting = True
+                time.sleep(ATTACH_INTERVAL)
+                continue
+            waiting = False
+            frame = reader.read()
+            if frame is not None:
+                groups = frame.groups
+                citizens = int(frame.density.sum()) if frame.density is not None else len(groups["citizens"])
+                print(f"{frame.time:9.1f} s  citizens {citizens}  police {len(groups['police'])}  "
+                      f"firetrucks {len(groups['firetrucks'])}  ambulances {len(groups['ambulances'])}  "
+                      f"active {frame.active}  queued {frame.queued}  next: {'; '.join(frame.text['queue'][:3])}")
+            elif reader.closed():
+                reader.detach()
+                print("Simulation finished")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        reader.detach()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Live view of a running simulation, in its own process")
+    parser.add_argument("name", nargs="?", default=FEED_NAME, help="name of the feed (main.py --live NAME)")
+    parser.add_argument("--terminal", action="store_true", help="print one line per second instead of drawing")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between two lines of --terminal")
+    args = parser.parse_args()
+    if args.terminal:
+        watch(args.name, args.interval)
+    else:
+        Viewer(args.name).run()